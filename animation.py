@@ -0,0 +1,236 @@
+"""
+Animation renderer: works out every camera state of a tween or turntable up front, then renders the
+frames in parallel over worker processes into a numbered image sequence.
+
+    python animation.py -o frames/shot.png --tween 48 --workers 8
+    python animation.py -o frames/turn.png --turntable 120 --width 640 --height 480
+
+Frames already on disk are skipped, so an interrupted render picks up where it stopped when run again.
+"""
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import argparse, math, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pygame
+import raytracer, scenes
+from math3d import Vec3
+
+# The Raytracer each animation worker process received when it started, see AnimationRenderer.render
+_workerRaytracer = None
+
+
+def _initAnimationWorker(raytracer):
+    global _workerRaytracer
+    _workerRaytracer = raytracer
+    _workerRaytracer.setRenderSurface(pygame.Surface((raytracer.mPyWidth, raytracer.mPyHeight)))
+    _workerRaytracer.getBVH()
+
+
+def _renderFrameInWorker(frame, state, fileName, mode):
+    start = time.perf_counter()
+    renderFrameToFile(_workerRaytracer, state, fileName, mode)
+    return frame, fileName, time.perf_counter() - start
+
+
+def getCameraState(RT):
+    """
+    :param RT: a Raytracer
+    :return: its camera as a (camPos, camCOI, camUp, camFOV, camNear) tuple of plain values
+    """
+
+    return tuple(RT.mCamPos), tuple(RT.mCamCOI), tuple(RT.mCamUp), RT.mCamFOV, RT.mCamNear
+
+
+def setCameraState(RT, state):
+    """
+    :param RT: a Raytracer
+    :param state: a tuple from getCameraState
+    :return: None
+    """
+
+    camPos, camCOI, camUp, camFOV, camNear = state
+    RT.mCamUp = Vec3(*camUp)
+    RT.setCamera(camPos, camCOI, camUp, camFOV, camNear)
+
+
+def computeTweenStates(RT, function=None):
+    """
+    Steps RT's camera tween (see Raytracer.setCameraTweenDest) through to the end, recording every frame.
+    RT's camera and tween are put back the way they were afterwards.
+    :param RT: a Raytracer with a tween set up
+    :param function: easing function passed on to updateTween
+    :return: a list of camera states, the current camera first
+    """
+
+    start = getCameraState(RT)
+    tweenFrame = RT.mCurTweenFrame
+    isTweening = RT.mIsTweening
+
+    states = [start]
+    while RT.mIsTweening and RT.mCurTweenFrame < RT.mNumTweenFrames:
+        RT.updateTween(function)
+        states.append(getCameraState(RT))
+
+    setCameraState(RT, start)
+    RT.mCurTweenFrame = tweenFrame
+    RT.mIsTweening = isTweening
+    return states
+
+
+def computeTurntableStates(RT, numFrames, totalAngle=2*math.pi):
+    """
+    Swings RT's camera round the Y axis with rotateAboutYAxis, recording every frame. Each frame turns
+    the starting camera by its whole angle, rather than the previous frame by one step, so rounding
+    doesn't build up and a full turn loops back onto the first frame.
+    RT's camera is put back the way it was afterwards.
+    :param RT: a Raytracer
+    :param numFrames: number of frames, the last one stopping one step short of totalAngle
+    :param totalAngle: how far round to go, in radians
+    :return: a list of camera states, the current camera first
+    """
+
+    start = getCameraState(RT)
+
+    states = [start]
+    for i in range(1, numFrames):
+        setCameraState(RT, start)
+        RT.rotateAboutYAxis(i * totalAngle / numFrames)
+        states.append(getCameraState(RT))
+
+    setCameraState(RT, start)
+    return states
+
+
+def renderFrameToFile(RT, state, fileName, mode="frame"):
+    """
+    Renders one camera state and saves it. The image is written under a temporary name and renamed
+    into place, so a file at fileName is always a finished frame.
+    :param RT: a Raytracer with a render surface
+    :param state: a tuple from getCameraState
+    :param fileName: where to save the image
+    :param mode: "frame" for renderFrame or "line" for renderOneLine over every row
+    :return: None
+    """
+
+    setCameraState(RT, state)
+    if mode == "frame":
+        RT.renderFrame()
+    else:
+        for iy in range(RT.mPyHeight):
+            RT.renderOneLine(iy)
+
+    root, ext = os.path.splitext(fileName)
+    partialName = root + ".partial" + ext
+    pygame.image.save(RT.mRenderSurface, partialName)
+    os.replace(partialName, fileName)
+
+
+class AnimationRenderer(object):
+
+    def __init__(self, raytracer, states, output, mode="frame"):
+        """
+        Renders a list of camera states to a numbered image sequence
+        :param raytracer: the Raytracer holding the scene, sent to every worker process
+        :param states: camera states, from computeTweenStates or computeTurntableStates
+        :param output: file name pattern, frame N of "frames/shot.png" is saved as "frames/shot_000N.png"
+        :param mode: "frame" or "line", see renderFrameToFile
+        :return: N/A
+        """
+
+        self.mRaytracer = raytracer
+        self.mStates = list(states)
+        self.mOutput = output
+        self.mMode = mode
+
+    def getFileName(self, frame):
+        """
+        :param frame: index into the states
+        :return: the file that frame is saved to
+        """
+
+        root, ext = os.path.splitext(self.mOutput)
+        return "%s_%04d%s" % (root, frame, ext or ".png")
+
+    def getPendingFrames(self):
+        """
+        :return: the frames whose image isn't on disk yet
+        """
+
+        return [frame for frame in range(len(self.mStates)) if not os.path.exists(self.getFileName(frame))]
+
+    def render(self, numWorkers=None, onFrame=None):
+        """
+        Renders every pending frame, a whole frame per task, across a pool of processes. The scene is
+        sent to each worker once when the pool starts; after that only camera states go out.
+        :param numWorkers: number of processes, defaults to the number of CPUs
+        :param onFrame: called as onFrame(frame, fileName, seconds) as each frame is saved
+        :return: the list of frames rendered
+        """
+
+        pending = self.getPendingFrames()
+        if not pending:
+            return []
+
+        if numWorkers is None:
+            numWorkers = os.cpu_count() or 1
+
+        directory = os.path.dirname(self.mOutput)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        rendered = []
+        with ProcessPoolExecutor(max_workers=min(numWorkers, len(pending)), initializer=_initAnimationWorker,
+                                 initargs=(self.mRaytracer,)) as executor:
+            futures = [executor.submit(_renderFrameInWorker, frame, self.mStates[frame], self.getFileName(frame), self.mMode)
+                       for frame in pending]
+
+            for future in as_completed(futures):
+                frame, fileName, seconds = future.result()
+                rendered.append(frame)
+                if onFrame is not None:
+                    onFrame(frame, fileName, seconds)
+
+        return sorted(rendered)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a camera animation to a numbered image sequence.")
+    parser.add_argument("-o", "--output", default="frames/frame.png", help="file name pattern, frame numbers are added")
+    parser.add_argument("--scene", default="default", choices=sorted(scenes.SCENES), help="scene to render")
+    parser.add_argument("--width", type=int, default=300)
+    parser.add_argument("--height", type=int, default=200)
+    parser.add_argument("--mode", default="frame", choices=("frame", "line"))
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the CPU count")
+    animation = parser.add_mutually_exclusive_group(required=True)
+    animation.add_argument("--tween", type=int, metavar="N", help="the scene's camera tween over N frames")
+    animation.add_argument("--turntable", type=int, metavar="N", help="a full turn round the Y axis in N frames")
+    args = parser.parse_args(argv)
+    wallStart = time.perf_counter()
+
+    RT = raytracer.Raytracer(pygame.Surface((args.width, args.height)))
+    scenes.SCENES[args.scene](RT)
+
+    if args.tween:
+        if args.scene not in scenes.TWEENS:
+            parser.error("scene %r has no camera tween" % args.scene)
+        scenes.TWEENS[args.scene](RT, args.tween)
+        states = computeTweenStates(RT)
+    else:
+        states = computeTurntableStates(RT, args.turntable)
+
+    renderer = AnimationRenderer(RT, states, args.output, args.mode)
+    skipped = len(states) - len(renderer.getPendingFrames())
+    if skipped:
+        print("%d of %d frames already rendered, skipping them" % (skipped, len(states)))
+
+    def onFrame(frame, fileName, seconds):
+        print("frame %d: %.3f s -> %s" % (frame, seconds, fileName))
+
+    rendered = renderer.render(args.workers, onFrame)
+    print("%d frame(s) rendered in %.3f s" % (len(rendered), time.perf_counter() - wallStart))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+"""
+Standard benchmark suite: renders each scene in scenes.SCENES and times every primitive's
+intersection routines, then writes the throughput numbers to JSON.
+
+    python benchmark.py -o baseline.json
+    python benchmark.py -o new.json --compare baseline.json --threshold 0.1
+
+With --compare, any rate that dropped by more than the threshold is reported as a regression
+and the exit status is 1.
+"""
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import argparse, json, platform, random, sys, time
+import numpy as np
+import pygame
+import raytracer, scenes
+from math3d import VectorN
+from objects3d import *
+
+# Version of the JSON layout, bumped if the meaning of a field changes
+RESULTS_VERSION = 2
+
+# Primitives timed by benchmarkPrimitives, built around the origin
+PRIMITIVES = {
+    "Sphere": lambda material: Sphere(VectorN((0, 0, 0)), 10, material),
+    "Plane": lambda material: Plane(VectorN((0, 1, 0)), 0, material),
+    "AABB": lambda material: AABB(VectorN((-10, -10, -10)), VectorN((10, 10, 10)), material),
+    "CylinderY": lambda material: CylinderY(VectorN((0, -10, 0)), 20.0, 10.0, material),
+}
+
+
+def benchmarkScene(name, width, height):
+    """
+    Renders one scene line by line twice: first with stats on for the ray counts and the split of time
+    between primary, shadow and reflection rays, then with stats off for the time, so it doesn't include
+    the counting wrappers.
+    :param name: a key of scenes.SCENES
+    :param width: frame width in pixels
+    :param height: frame height in pixels
+    :return: a dict of results
+    """
+
+    RT = raytracer.Raytracer(pygame.Surface((width, height)))
+    scenes.SCENES[name](RT)
+
+    def render():
+        RT.getBVH()
+        start = time.perf_counter()
+        for iy in range(height):
+            RT.renderOneLine(iy)
+        return time.perf_counter() - start
+
+    RT.enableStats()
+    statsSeconds = render()
+    frame = RT.mStats.mFrames[-1]
+    RT.disableStats()
+    seconds = render()
+
+    result = {"seconds": seconds, "pixelsPerSecond": width * height / seconds, "statsSeconds": statsSeconds}
+    for kind in ("primary", "shadow", "reflection"):
+        rays = frame[kind + "Rays"]
+        raySeconds = frame[kind + "Seconds"]
+        result[kind + "Rays"] = rays
+        result[kind + "RaysPerSecond"] = rays / raySeconds if raySeconds else 0.0
+
+    totalRays = frame["primaryRays"] + frame["shadowRays"] + frame["reflectionRays"]
+    result["raysPerSecond"] = totalRays / seconds
+    result["intersectionTests"] = frame["tests"]
+    result["intersectionHits"] = frame["hits"]
+    return result
+
+
+def bestTime(function, repeat):
+    """
+    :param function: called with no arguments
+    :param repeat: how many times to call it
+    :return: the fastest wall time of the calls, in seconds
+    """
+
+    best = float("inf")
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmarkPrimitives(numRays=20000, repeat=3, seed=1803):
+    """
+    Times rayHit and rayHitBatch of each primitive in PRIMITIVES on the same random rays,
+    roughly half of which hit
+    :param numRays: how many rays to test
+    :param repeat: each test is run this many times and the fastest kept
+    :param seed: random seed so runs are comparable
+    :return: a dict of results by primitive name
+    """
+
+    rng = random.Random(seed)
+    rays = []
+    for i in range(numRays):
+        origin = VectorN([rng.uniform(-40, 40) for j in range(3)])
+        target = VectorN([rng.uniform(-15, 15) for j in range(3)])
+        rays.append(Ray(origin, target - origin))
+
+    origins = np.array([R.mOrigin.mData for R in rays])
+    directions = np.array([R.mDirection.mData for R in rays])
+
+    results = {}
+    material = Material(VectorN((1, 1, 1)))
+    for name, make in PRIMITIVES.items():
+        primitive = make(material)
+        hits = sum(1 for R in rays if primitive.rayHit(R))
+
+        def scalar():
+            for R in rays:
+                primitive.rayHit(R)
+
+        scalarSeconds = bestTime(scalar, repeat)
+        batchSeconds = bestTime(lambda: primitive.rayHitBatch(origins, directions), repeat)
+
+        results[name] = {"hitRate": hits / numRays,
+                         "rayHitPerSecond": numRays / scalarSeconds,
+                         "rayHitBatchPerSecond": numRays / batchSeconds}
+
+    return results
+
+
+def findRegressions(old, new, threshold, path=""):
+    """
+    Walks two result dicts and collects every "...PerSecond" rate that dropped by more than threshold
+    :param old: the baseline results
+    :param new: the current results
+    :param threshold: allowed fractional drop, e.g. 0.1 for 10%
+    :return: a list of (path, old rate, new rate)
+    """
+
+    regressions = []
+    for key, newValue in new.items():
+        if key not in old:
+            continue
+
+        oldValue = old[key]
+        if isinstance(newValue, dict) and isinstance(oldValue, dict):
+            regressions += findRegressions(oldValue, newValue, threshold, path + key + ".")
+        elif key.endswith("PerSecond") and oldValue > 0 and newValue < oldValue * (1 - threshold):
+            regressions.append((path + key, oldValue, newValue))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the raytracer and track regressions.")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="JSON file to write results to")
+    parser.add_argument("--width", type=int, default=64)
+    parser.add_argument("--height", type=int, default=48)
+    parser.add_argument("--scenes", nargs="*", default=sorted(scenes.SCENES), choices=sorted(scenes.SCENES))
+    parser.add_argument("--rays", type=int, default=20000, help="rays per primitive intersection test")
+    parser.add_argument("--repeat", type=int, default=3, help="primitive tests are run this many times, fastest kept")
+    parser.add_argument("--compare", metavar="BASELINE", help="earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fractional slowdown that counts as a regression (default 0.1)")
+    args = parser.parse_args(argv)
+
+    results = {"version": RESULTS_VERSION,
+               "python": platform.python_version(),
+               "machine": platform.machine(),
+               "width": args.width,
+               "height": args.height,
+               "scenes": {},
+               "primitives": {}}
+
+    for name in args.scenes:
+        sceneResult = benchmarkScene(name, args.width, args.height)
+        results["scenes"][name] = sceneResult
+        print("%-12s %7.3f s  primary %9.0f/s  shadow %9.0f/s  reflection %9.0f/s" %
+              (name, sceneResult["seconds"], sceneResult["primaryRaysPerSecond"],
+               sceneResult["shadowRaysPerSecond"], sceneResult["reflectionRaysPerSecond"]))
+
+    results["primitives"] = benchmarkPrimitives(args.rays, args.repeat)
+    for name, primitiveResult in results["primitives"].items():
+        print("%-12s rayHit %10.0f/s  rayHitBatch %12.0f/s" %
+              (name, primitiveResult["rayHitPerSecond"], primitiveResult["rayHitBatchPerSecond"]))
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print("results written to", args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        regressions = findRegressions(baseline, results, args.threshold)
+        for path, oldValue, newValue in regressions:
+            print("REGRESSION %s: %.0f -> %.0f (%.1f%%)" % (path, oldValue, newValue, 100 * (newValue / oldValue - 1)))
+
+        if regressions:
+            return 1
+        print("no regressions beyond %.0f%% against %s" % (100 * args.threshold, args.compare))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
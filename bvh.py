@@ -0,0 +1,576 @@
+import math
+import numpy as np
+
+# Relative cost of visiting a node compared to testing one primitive, used by the SAH
+TRAVERSAL_COST = 0.125
+# Stand-in for 1 / 0 in the slab test, large enough to behave like infinity but never produce NaN
+BIG_INVERSE = 1e30
+
+
+def surfaceArea(minPt, maxPt):
+    """
+    Surface area of a box given as two float tuples
+    :param minPt: (x, y, z) minimum corner
+    :param maxPt: (x, y, z) maximum corner
+    :return: a float
+    """
+
+    dx = maxPt[0] - minPt[0]
+    dy = maxPt[1] - minPt[1]
+    dz = maxPt[2] - minPt[2]
+    return 2 * (dx*dy + dy*dz + dz*dx)
+
+
+def unionBounds(minA, maxA, minB, maxB):
+    """
+    Bounding box of two boxes
+    :return: a (minPt, maxPt) tuple of float tuples
+    """
+
+    return (min(minA[0], minB[0]), min(minA[1], minB[1]), min(minA[2], minB[2])), \
+           (max(maxA[0], maxB[0]), max(maxA[1], maxB[1]), max(maxA[2], maxB[2]))
+
+
+def packetBoxEntry(minPt, maxPt, origins, invDirs, tMax):
+    """
+    Slab test of a packet of rays against one box
+    :param minPt: (x, y, z) minimum corner
+    :param maxPt: (x, y, z) maximum corner
+    :param origins: (N, 3) array of ray origins
+    :param invDirs: (N, 3) array from inverseDirectionBatch
+    :param tMax: (N,) array of distances beyond which hits don't matter
+    :return: (N,) array of the distances the rays enter the box (clamped to 0), inf for rays that miss it within tMax
+    """
+
+    t1 = (minPt - origins) * invDirs
+    t2 = (maxPt - origins) * invDirs
+    tNear = np.maximum(np.minimum(t1, t2).max(axis=1), 0.0)
+    tFar = np.minimum(np.maximum(t1, t2).min(axis=1), tMax)
+    return np.where(tNear <= tFar, tNear, np.inf)
+
+
+def inverseDirectionBatch(directions):
+    """
+    Array version of inverseDirection
+    :param directions: (N, 3) array of directions
+    :return: (N, 3) array
+    """
+
+    with np.errstate(divide="ignore"):
+        return np.where(directions != 0, 1 / directions, np.copysign(BIG_INVERSE, directions))
+
+
+def inverseDirection(direction):
+    """
+    Component-wise 1 / direction, with zero components mapped to a huge number of the same sign
+    :param direction: a Vec3
+    :return: a float tuple
+    """
+
+    return tuple(1.0 / d if d != 0.0 else math.copysign(BIG_INVERSE, d) for d in (direction.mX, direction.mY, direction.mZ))
+
+
+class BVH(object):
+
+    def __init__(self, objects, maxLeafSize=2, numBins=12, nodes=None):
+        """
+        A bounding volume hierarchy built with binned SAH over objects that have getBounds().
+        The tree is stored flattened in parallel lists, node 0 being the root.
+        :param objects: a sequence of bounded objects (getBounds() returning two VectorN corners)
+        :param maxLeafSize: leaves at or below this many objects are never split
+        :param numBins: number of centroid bins tried per axis
+        :param nodes: (nodeMin, nodeMax, nodeLeft, nodeRight, nodeStart, nodeCount) of a tree already built
+                      over objects, which are then taken to be in leaf order and nothing is built. Any sequences
+                      indexed by node will do, e.g. scenefile.ChunkedRows over a scene file's stored tree.
+        :return: N/A
+        """
+
+        self.mMaxLeafSize = maxLeafSize
+        self.mNumBins = numBins
+
+        self.mObjects = []
+        self.mNodeMin = []
+        self.mNodeMax = []
+        self.mNodeLeft = []       # Index of the left child, -1 for leaves
+        self.mNodeRight = []      # Index of the right child, -1 for leaves
+        self.mNodeStart = []      # First index into mObjects for leaves
+        self.mNodeCount = []      # Number of objects in a leaf, 0 for interior nodes
+        self.mNodeBoundsArrays = None
+
+        if nodes is not None:
+            self.mObjects = objects
+            self.mNodeMin, self.mNodeMax, self.mNodeLeft, self.mNodeRight, self.mNodeStart, self.mNodeCount = nodes
+        elif len(objects):
+            self.build(objects)
+
+    def __len__(self):
+        return len(self.mObjects)
+
+    def getNodeBoundsArrays(self):
+        """
+        :return: (minimum corners, maximum corners) of every node as (nodes, 3) arrays, made on first use
+        """
+
+        if self.mNodeBoundsArrays is None:
+            self.mNodeBoundsArrays = (np.array(self.mNodeMin, dtype=float).reshape(-1, 3),
+                                      np.array(self.mNodeMax, dtype=float).reshape(-1, 3))
+        return self.mNodeBoundsArrays
+
+    def build(self, objects):
+        """
+        Builds the tree, top down with an explicit stack
+        :param objects: a sequence of bounded objects
+        :return: None
+        """
+
+        boundsList = []
+        centroids = []
+        for obj in objects:
+            minPt, maxPt = obj.getBounds()
+            minPt = (minPt[0], minPt[1], minPt[2])
+            maxPt = (maxPt[0], maxPt[1], maxPt[2])
+            boundsList.append((minPt, maxPt))
+            centroids.append(((minPt[0] + maxPt[0]) / 2, (minPt[1] + maxPt[1]) / 2, (minPt[2] + maxPt[2]) / 2))
+
+        root = self.addNode(list(range(len(objects))), boundsList)
+        stack = [(root, list(range(len(objects))))]
+
+        while stack:
+            node, items = stack.pop()
+            split = self.findSplit(items, boundsList, centroids, self.mNodeMin[node], self.mNodeMax[node])
+
+            if split is None:
+                self.mNodeStart[node] = len(self.mObjects)
+                self.mNodeCount[node] = len(items)
+                for i in items:
+                    self.mObjects.append(objects[i])
+                continue
+
+            leftItems, rightItems = split
+            left = self.addNode(leftItems, boundsList)
+            right = self.addNode(rightItems, boundsList)
+            self.mNodeLeft[node] = left
+            self.mNodeRight[node] = right
+            stack.append((right, rightItems))
+            stack.append((left, leftItems))
+
+    def addNode(self, items, boundsList):
+        """
+        Appends a node bounding the given items
+        :return: the index of the new node
+        """
+
+        minPt, maxPt = boundsList[items[0]]
+        for i in items[1:]:
+            minPt, maxPt = unionBounds(minPt, maxPt, boundsList[i][0], boundsList[i][1])
+
+        self.mNodeMin.append(minPt)
+        self.mNodeMax.append(maxPt)
+        self.mNodeLeft.append(-1)
+        self.mNodeRight.append(-1)
+        self.mNodeStart.append(0)
+        self.mNodeCount.append(0)
+        return len(self.mNodeMin) - 1
+
+    def findSplit(self, items, boundsList, centroids, nodeMin, nodeMax):
+        """
+        Finds the cheapest binned SAH split of items
+        :return: (leftItems, rightItems), or None if the items should become a leaf
+        """
+
+        count = len(items)
+        if count <= self.mMaxLeafSize:
+            return None
+
+        nodeArea = surfaceArea(nodeMin, nodeMax)
+        bestCost = math.inf
+        bestAxis = -1
+        bestBin = 0
+
+        for axis in range(3):
+            cMin = min(centroids[i][axis] for i in items)
+            cMax = max(centroids[i][axis] for i in items)
+            extent = cMax - cMin
+            if extent <= 0:
+                continue
+
+            binCounts = [0] * self.mNumBins
+            binBounds = [None] * self.mNumBins
+            scale = self.mNumBins / extent
+            for i in items:
+                b = min(self.mNumBins - 1, int((centroids[i][axis] - cMin) * scale))
+                binCounts[b] += 1
+                if binBounds[b] is None:
+                    binBounds[b] = boundsList[i]
+                else:
+                    binBounds[b] = unionBounds(binBounds[b][0], binBounds[b][1], boundsList[i][0], boundsList[i][1])
+
+            # Sweep from the right to get the area and count of everything right of each plane
+            rightArea = [0.0] * self.mNumBins
+            rightCount = [0] * self.mNumBins
+            bounds = None
+            running = 0
+            for b in range(self.mNumBins - 1, 0, -1):
+                if binBounds[b] is not None:
+                    bounds = binBounds[b] if bounds is None else unionBounds(bounds[0], bounds[1], *binBounds[b])
+                running += binCounts[b]
+                rightCount[b] = running
+                rightArea[b] = surfaceArea(*bounds) if bounds is not None else 0.0
+
+            bounds = None
+            running = 0
+            for b in range(self.mNumBins - 1):
+                if binBounds[b] is not None:
+                    bounds = binBounds[b] if bounds is None else unionBounds(bounds[0], bounds[1], *binBounds[b])
+                running += binCounts[b]
+                if running == 0 or rightCount[b + 1] == 0:
+                    continue
+
+                cost = surfaceArea(*bounds) * running + rightArea[b + 1] * rightCount[b + 1]
+                if cost < bestCost:
+                    bestCost = cost
+                    bestAxis = axis
+                    bestBin = b
+
+        if bestAxis < 0:
+            # Every centroid is in the same spot, nothing to split on
+            return None
+
+        if nodeArea > 0 and TRAVERSAL_COST + bestCost / nodeArea >= count and count <= 4 * self.mMaxLeafSize:
+            return None
+
+        cMin = min(centroids[i][bestAxis] for i in items)
+        scale = self.mNumBins / (max(centroids[i][bestAxis] for i in items) - cMin)
+        leftItems = []
+        rightItems = []
+        for i in items:
+            if min(self.mNumBins - 1, int((centroids[i][bestAxis] - cMin) * scale)) <= bestBin:
+                leftItems.append(i)
+            else:
+                rightItems.append(i)
+
+        return leftItems, rightItems
+
+    def rayBoxEntry(self, node, origin, invDir, tMax):
+        """
+        Slab test of a ray against one node's box
+        :param node: index of the node
+        :param origin: ray origin as a float tuple
+        :param invDir: inverseDirection of the ray direction
+        :param tMax: distance beyond which hits don't matter
+        :return: the distance the ray enters the box (clamped to 0), or None if it misses within tMax
+        """
+
+        minPt = self.mNodeMin[node]
+        maxPt = self.mNodeMax[node]
+        tNear = 0.0
+        tFar = tMax
+
+        for axis in range(3):
+            t1 = (minPt[axis] - origin[axis]) * invDir[axis]
+            t2 = (maxPt[axis] - origin[axis]) * invDir[axis]
+            if t1 > t2:
+                t1, t2 = t2, t1
+            if t1 > tNear:
+                tNear = t1
+            if t2 < tFar:
+                tFar = t2
+            if tNear > tFar:
+                return None
+
+        return tNear
+
+    def findClosestHit(self, ray, tMax=math.inf):
+        """
+        Front to back traversal, skipping any node that starts further away than the best hit so far.
+        Each object's closestHit is given the best distance so far, so it can give up early, and no
+        hit record is built; the caller asks the winner for one with getHitResult.
+        :param ray: a Ray
+        :param tMax: only hits closer than this are considered
+        :return: (object, distance) of the closest hit, or (None, tMax)
+        """
+
+        if not self.mObjects:
+            return None, tMax
+
+        origin = (ray.mOrigin.mX, ray.mOrigin.mY, ray.mOrigin.mZ)
+        invDir = inverseDirection(ray.mDirection)
+        bestDist = tMax
+        bestObject = None
+
+        rootEntry = self.rayBoxEntry(0, origin, invDir, bestDist)
+        if rootEntry is None:
+            return None, tMax
+
+        stack = [(0, rootEntry)]
+        while stack:
+            node, entry = stack.pop()
+            if entry > bestDist:
+                # Found something closer since this node was pushed
+                continue
+
+            count = self.mNodeCount[node]
+            if count:
+                start = self.mNodeStart[node]
+                for obj in self.mObjects[start:start + count]:
+                    dist = obj.closestHit(ray, bestDist)
+                    if dist is not None:
+                        bestDist = dist
+                        bestObject = obj
+                continue
+
+            left = self.mNodeLeft[node]
+            right = self.mNodeRight[node]
+            leftEntry = self.rayBoxEntry(left, origin, invDir, bestDist)
+            rightEntry = self.rayBoxEntry(right, origin, invDir, bestDist)
+
+            # Push the far child first so the near one is popped and searched first
+            if leftEntry is not None and rightEntry is not None:
+                if leftEntry <= rightEntry:
+                    stack.append((right, rightEntry))
+                    stack.append((left, leftEntry))
+                else:
+                    stack.append((left, leftEntry))
+                    stack.append((right, rightEntry))
+            elif leftEntry is not None:
+                stack.append((left, leftEntry))
+            elif rightEntry is not None:
+                stack.append((right, rightEntry))
+
+        return bestObject, bestDist
+
+    def findAnyHit(self, ray, maxDist):
+        """
+        Finds any object the ray hits closer than maxDist, stopping at the first one
+        :param ray: a Ray
+        :param maxDist: the distance along the ray that matters
+        :return: the RayHitResult of the first blocker found, or None
+        """
+
+        if not self.mObjects:
+            return None
+
+        origin = (ray.mOrigin.mX, ray.mOrigin.mY, ray.mOrigin.mZ)
+        invDir = inverseDirection(ray.mDirection)
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if self.rayBoxEntry(node, origin, invDir, maxDist) is None:
+                continue
+
+            count = self.mNodeCount[node]
+            if count:
+                start = self.mNodeStart[node]
+                for obj in self.mObjects[start:start + count]:
+                    result = obj.rayHit(ray)
+                    if result:
+                        for dist in result.mIntersectionDistances:
+                            if dist <= maxDist:
+                                return result
+            else:
+                stack.append(self.mNodeRight[node])
+                stack.append(self.mNodeLeft[node])
+
+        return None
+
+    def findOccluder(self, ray, maxDist):
+        """
+        Shadow ray query, like findAnyHit but through each object's occludes() so no hit records are built
+        :param ray: a Ray
+        :param maxDist: the distance along the ray that matters
+        :return: the first object found blocking the ray, or None
+        """
+
+        if not self.mObjects:
+            return None
+
+        origin = (ray.mOrigin.mX, ray.mOrigin.mY, ray.mOrigin.mZ)
+        invDir = inverseDirection(ray.mDirection)
+
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if self.rayBoxEntry(node, origin, invDir, maxDist) is None:
+                continue
+
+            count = self.mNodeCount[node]
+            if count:
+                start = self.mNodeStart[node]
+                for obj in self.mObjects[start:start + count]:
+                    if obj.occludes(ray, maxDist):
+                        return obj
+            else:
+                stack.append(self.mNodeRight[node])
+                stack.append(self.mNodeLeft[node])
+
+        return None
+
+    def findContaining(self, point):
+        """
+        Point query: collects the objects in every leaf whose box holds point. Leaves are tested as a
+        whole, so objects whose own bounds miss point can be among them.
+        :param point: (x, y, z) float tuple
+        :return: a list of objects
+        """
+
+        found = []
+        if not self.mObjects:
+            return found
+
+        x, y, z = point
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            minPt = self.mNodeMin[node]
+            maxPt = self.mNodeMax[node]
+            if x < minPt[0] or y < minPt[1] or z < minPt[2] or x > maxPt[0] or y > maxPt[1] or z > maxPt[2]:
+                continue
+
+            count = self.mNodeCount[node]
+            if count:
+                start = self.mNodeStart[node]
+                found.extend(self.mObjects[start:start + count])
+            else:
+                stack.append(self.mNodeRight[node])
+                stack.append(self.mNodeLeft[node])
+
+        return found
+
+    def findOverlapping(self, boxMin, boxMax):
+        """
+        Box query: collects the objects in every leaf whose box overlaps the given one. Like findContaining,
+        leaves are tested as a whole.
+        :param boxMin: (x, y, z) minimum corner
+        :param boxMax: (x, y, z) maximum corner
+        :return: a list of objects
+        """
+
+        found = []
+        if not self.mObjects:
+            return found
+
+        x0, y0, z0 = boxMin
+        x1, y1, z1 = boxMax
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            minPt = self.mNodeMin[node]
+            maxPt = self.mNodeMax[node]
+            if x1 < minPt[0] or y1 < minPt[1] or z1 < minPt[2] or x0 > maxPt[0] or y0 > maxPt[1] or z0 > maxPt[2]:
+                continue
+
+            count = self.mNodeCount[node]
+            if count:
+                start = self.mNodeStart[node]
+                found.extend(self.mObjects[start:start + count])
+            else:
+                stack.append(self.mNodeRight[node])
+                stack.append(self.mNodeLeft[node])
+
+        return found
+
+    def findClosestHitPacket(self, origins, directions, tMax):
+        """
+        Packet version of findClosestHit: the rays are walked down the tree together, each node's box
+        tested against the whole packet at once. Rays that miss a node drop out of the packet below it,
+        so the packet only splits where the rays diverge. Leaves test their objects with rayHitBatch.
+        :param origins: (N, 3) array of ray origins
+        :param directions: (N, 3) array of normalized ray directions
+        :param tMax: (N,) array, only hits closer than this are considered
+        :return: (distances, positions in mObjects, parts), tMax and -1 where a ray hits nothing closer, parts
+                 being the part of the object hit as its rayHitBatch reports it, e.g. a mesh's triangle, or -1
+        """
+
+        bestDist = np.array(tMax, dtype=float)
+        bestObject = np.full(len(origins), -1)
+        bestPart = np.full(len(origins), -1)
+        if not self.mObjects or not len(origins):
+            return bestDist, bestObject, bestPart
+
+        invDirs = inverseDirectionBatch(directions)
+        nodeMin, nodeMax = self.getNodeBoundsArrays()
+
+        entry = packetBoxEntry(nodeMin[0], nodeMax[0], origins, invDirs, bestDist)
+        stack = [(0, np.flatnonzero(entry < np.inf), entry)]
+        while stack:
+            node, rays, entry = stack.pop()
+            # Drop the rays that found something closer since this node was pushed
+            rays = rays[entry[rays] <= bestDist[rays]]
+            if not len(rays):
+                continue
+
+            count = self.mNodeCount[node]
+            if count:
+                start = self.mNodeStart[node]
+                rayOrigins = origins[rays]
+                rayDirections = directions[rays]
+                for position in range(start, start + count):
+                    parts = np.full(len(rays), -1)
+                    dist = self.mObjects[position].rayHitBatch(rayOrigins, rayDirections, parts)
+                    closer = dist < bestDist[rays]
+                    if closer.any():
+                        bestDist[rays[closer]] = dist[closer]
+                        bestObject[rays[closer]] = position
+                        bestPart[rays[closer]] = parts[closer]
+                continue
+
+            rayOrigins = origins[rays]
+            rayInvDirs = invDirs[rays]
+            children = []
+            for child in (self.mNodeLeft[node], self.mNodeRight[node]):
+                childEntry = np.full(len(origins), np.inf)
+                childEntry[rays] = packetBoxEntry(nodeMin[child], nodeMax[child], rayOrigins, rayInvDirs, bestDist[rays])
+                childRays = rays[childEntry[rays] < np.inf]
+                if len(childRays):
+                    children.append((childEntry[childRays].min(), child, childRays, childEntry))
+
+            # Push the far child first so the near one is searched first
+            children.sort(key=lambda item: item[0], reverse=True)
+            for nearest, child, childRays, childEntry in children:
+                stack.append((child, childRays, childEntry))
+
+        return bestDist, bestObject, bestPart
+
+    def findOccludedPacket(self, origins, directions, maxDist):
+        """
+        Packet version of findOccluder: rays drop out of the packet as soon as something blocks them
+        :param origins: (N, 3) array of shadow ray origins
+        :param directions: (N, 3) array of normalized directions towards the light
+        :param maxDist: (N,) array of distances to the light
+        :return: (N,) boolean array, True where the ray is blocked
+        """
+
+        occluded = np.zeros(len(origins), dtype=bool)
+        if not self.mObjects or not len(origins):
+            return occluded
+
+        invDirs = inverseDirectionBatch(directions)
+        nodeMin, nodeMax = self.getNodeBoundsArrays()
+
+        stack = [(0, np.arange(len(origins)))]
+        while stack:
+            node, rays = stack.pop()
+            rays = rays[~occluded[rays]]
+            if not len(rays):
+                continue
+
+            entry = packetBoxEntry(nodeMin[node], nodeMax[node], origins[rays], invDirs[rays], maxDist[rays])
+            rays = rays[entry < np.inf]
+            if not len(rays):
+                continue
+
+            count = self.mNodeCount[node]
+            if count:
+                start = self.mNodeStart[node]
+                for position in range(start, start + count):
+                    rays = rays[~occluded[rays]]
+                    if not len(rays):
+                        break
+                    dist = self.mObjects[position].rayHitBatch(origins[rays], directions[rays])
+                    occluded[rays[dist <= maxDist[rays]]] = True
+            else:
+                stack.append((self.mNodeRight[node], rays))
+                stack.append((self.mNodeLeft[node], rays))
+
+        return occluded
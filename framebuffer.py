@@ -0,0 +1,104 @@
+import numpy as np
+import pygame
+
+
+def clampToneMap(colors):
+    """
+    Cuts every channel off at 1, the way colors were always shown
+    :param colors: float array of linear colors
+    :return: float array of colors between 0 and 1
+    """
+
+    return np.clip(colors, 0, 1)
+
+
+def reinhardToneMap(colors):
+    """
+    Compresses bright colors towards 1 instead of cutting them off, c / (1 + c) per channel
+    :param colors: float array of linear colors
+    :return: float array of colors between 0 and 1
+    """
+
+    colors = np.maximum(colors, 0)
+    return colors / (1 + colors)
+
+
+# Tone mapping operators by name
+TONE_MAPS = {
+    "clamp": clampToneMap,
+    "reinhard": reinhardToneMap,
+}
+
+
+class FrameBuffer(object):
+
+    def __init__(self, width, height, toneMap="clamp", exposure=1.0):
+        """
+        The float RGB image the Raytracer traces into. Nothing is written to a pygame surface until
+        present is called, which tone maps and clamps a whole region and copies it in one blit.
+        :param width: width in pixels
+        :param height: height in pixels
+        :param toneMap: a key of TONE_MAPS
+        :param exposure: colors are scaled by this before tone mapping
+        :return: N/A
+        """
+
+        self.mWidth = width
+        self.mHeight = height
+        self.mPixels = np.zeros((height, width, 3))   # Linear colors, indexed [y, x, channel]
+
+        self.mToneMap = toneMap
+        self.mExposure = exposure
+
+    def __getstate__(self):
+        """
+        Pickles the size and tone mapping settings but not the pixels, which are zero again on the other side
+        """
+
+        state = self.__dict__.copy()
+        del state["mPixels"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.mPixels = np.zeros((self.mHeight, self.mWidth, 3))
+
+    def toBytes(self, x=0, y=0, width=None, height=None):
+        """
+        Tone maps a region down to 8 bits per channel
+        :param x: left edge of the region
+        :param y: top edge of the region
+        :param width: width of the region, defaults to the rest of the row
+        :param height: height of the region, defaults to the rest of the frame
+        :return: the region as packed RGB bytes, row by row
+        """
+
+        if width is None:
+            width = self.mWidth - x
+        if height is None:
+            height = self.mHeight - y
+
+        colors = self.mPixels[y:y + height, x:x + width]
+        if self.mExposure != 1.0:
+            colors = colors * self.mExposure
+
+        return (TONE_MAPS[self.mToneMap](colors) * 255).astype(np.uint8).tobytes()
+
+    def present(self, surface, x=0, y=0, width=None, height=None):
+        """
+        Copies a region onto surface, at the same position, in one blit
+        :param surface: a pygame.Surface the size of the frame buffer
+        :param x: left edge of the region
+        :param y: top edge of the region
+        :param width: width of the region, defaults to the rest of the row
+        :param height: height of the region, defaults to the rest of the frame
+        :return: None
+        """
+
+        if width is None:
+            width = self.mWidth - x
+        if height is None:
+            height = self.mHeight - y
+
+        if width > 0 and height > 0:
+            surface.blit(pygame.image.frombuffer(self.toBytes(x, y, width, height), (width, height), "RGB"), (x, y))
@@ -0,0 +1,72 @@
+import numpy as np
+
+
+class GBufferLayer(object):
+
+    __slots__ = ("mPixels", "mPoints", "mDirections", "mObjectIndices", "mNormals", "mWeights")
+
+    def __init__(self, pixels, points, directions, objectIndices, normals, weights):
+        """
+        The hits of one bounce, the primary hits being the first layer
+        :param pixels: (N,) array of the pixel (index into the flattened frame) each hit belongs to
+        :param points: (N, 3) array of hit points
+        :param directions: (N, 3) array of the directions of the rays that hit them
+        :param objectIndices: (N,) array of indices into mObjects
+        :param normals: (N, 3) array of surface normals
+        :param weights: (N,) array, how much of each hit's shaded color goes into its pixel
+        :return: N/A
+        """
+
+        self.mPixels = pixels
+        self.mPoints = points
+        self.mDirections = directions
+        self.mObjectIndices = objectIndices
+        self.mNormals = normals
+        self.mWeights = weights
+
+
+class GBuffer(object):
+
+    def __init__(self, width, height, cameraKey, bvh, reflectivity, reflectionDepth, minContribution):
+        """
+        Everything renderFrame traced for one frame, so it can be shaded again without tracing a ray:
+        per pixel, the first hit object, distance, position and normal, and the reflection hits below them.
+
+        It stays valid while the camera, the geometry (the BVH) and the materials' reflection
+        settings are unchanged. Lights and material colors are free to change, see Raytracer.relight.
+        :param width: width of the frame in pixels
+        :param height: height of the frame in pixels
+        :param cameraKey: Raytracer.getCameraKey() at the time of tracing
+        :param bvh: the BVH traced against
+        :param reflectivity: (numObjects,) array of the materials' reflectivity
+        :param reflectionDepth: (numObjects,) array of the materials' reflection depth
+        :param minContribution: the Raytracer's mMinContribution
+        :return: N/A
+        """
+
+        self.mWidth = width
+        self.mHeight = height
+        self.mCameraKey = cameraKey
+        self.mBVH = bvh
+        self.mReflectivity = reflectivity
+        self.mReflectionDepth = reflectionDepth
+        self.mMinContribution = minContribution
+
+        numPixels = width * height
+        self.mHit = np.zeros(numPixels, dtype=bool)
+        self.mObjectIndices = np.full(numPixels, -1)     # First hit object per pixel, -1 for none
+        self.mDistances = np.full(numPixels, np.inf)     # Distance from the camera to the first hit
+        self.mPositions = np.zeros((numPixels, 3))       # First hit point
+        self.mNormals = np.zeros((numPixels, 3))         # Surface normal at the first hit
+
+        self.mLayers = []                                # GBufferLayers, primary hits first
+
+    def matches(self, width, height, cameraKey, bvh, reflectivity, reflectionDepth, minContribution):
+        """
+        :return: True if tracing the frame again would give the same GBuffer
+        """
+
+        return self.mWidth == width and self.mHeight == height and self.mCameraKey == cameraKey \
+               and self.mBVH is bvh and self.mMinContribution == minContribution \
+               and np.array_equal(self.mReflectivity, reflectivity) \
+               and np.array_equal(self.mReflectionDepth, reflectionDepth)
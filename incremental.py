@@ -0,0 +1,179 @@
+import math
+import numpy as np
+from bvh import BIG_INVERSE
+from shading import TraceContext, findOccluder
+
+
+def raysHitBox(rays, minPt, maxPt):
+    """
+    Vectorized slab test of recorded rays against a box
+    :param rays: (N, 7) array of origin, direction and the distance along each ray that mattered
+    :param minPt: minimum corner of the box
+    :param maxPt: maximum corner of the box
+    :return: True if any of the rays passes through the box within its distance
+    """
+
+    if not len(rays):
+        return False
+
+    origins = rays[:, 0:3]
+    directions = rays[:, 3:6]
+    with np.errstate(divide="ignore"):
+        invDirections = np.where(directions != 0, 1 / directions, np.copysign(BIG_INVERSE, directions))
+
+    t1 = (np.array([minPt[0], minPt[1], minPt[2]]) - origins) * invDirections
+    t2 = (np.array([maxPt[0], maxPt[1], maxPt[2]]) - origins) * invDirections
+    tNear = np.maximum(np.minimum(t1, t2).max(axis=1), 0)
+    tFar = np.minimum(np.maximum(t1, t2).min(axis=1), rays[:, 6])
+
+    return bool(np.any(tNear <= tFar))
+
+
+class RecordingTraceContext(TraceContext):
+
+    def __init__(self, scene):
+        """
+        A TraceContext that remembers every ray it traced and every object that decided a result,
+        which is what IncrementalRenderer needs to tell whether a change can reach a tile
+        :param scene: a SceneSnapshot
+        :return: N/A
+        """
+
+        TraceContext.__init__(self, scene)
+        self.mRays = []           # (origin xyz, direction xyz, distance that mattered) per ray
+        self.mTouched = set()     # Objects hit, or found blocking a shadow ray
+
+    def recordRay(self, ray, maxDist):
+        origin = ray.mOrigin
+        direction = ray.mDirection
+        self.mRays.append((origin.mX, origin.mY, origin.mZ, direction.mX, direction.mY, direction.mZ, maxDist))
+
+    def rayCast(self, ray, isShadow=False, light=None):
+        result = TraceContext.rayCast(self, ray, isShadow, light)
+
+        if isShadow and light:
+            self.recordRay(ray, (light.mPos - ray.mOrigin).magnitude())
+        else:
+            # Nothing past the closest hit can change what this ray sees
+            self.recordRay(ray, result.mIntersectionDistances[0] if result else math.inf)
+
+        if result:
+            self.mTouched.add(result.mHitObject)
+        return result
+
+    def isOccluded(self, ray, maxDist, light=None):
+        self.recordRay(ray, maxDist)
+
+        occluder = findOccluder(self.mScene, ray, maxDist, self.mLastOccluders.get(light))
+        if occluder is None:
+            return False
+
+        if light is not None:
+            self.mLastOccluders[light] = occluder
+        # Unwrap the stats proxy, if any, so the real object is recorded
+        self.mTouched.add(getattr(occluder, "mObject", occluder))
+        return True
+
+
+class IncrementalRenderer(object):
+
+    def __init__(self, raytracer, tileSize=16):
+        """
+        Re-renders only the tiles an object change can reach, for scene editing with a fixed camera.
+
+        Every tile keeps the rays it traced last time (primary, reflection and shadow, each cut off
+        where it stopped mattering) and the objects that decided its colors. After an object changes,
+        a tile needs tracing again if that object was among its deciding objects (where it was), or
+        if any of its rays passes through the object's new bounds (where it is now, including the
+        shadows it now casts and where it now shows up in reflections). Objects without bounds,
+        camera moves and light changes make the whole frame dirty.
+
+        Objects added to or removed from mObjects are noticed by render(). Objects changed in place
+        (moved, resized, given a new material) need markObjectChanged.
+        :param raytracer: the Raytracer to render with, its frame buffer and surface are updated
+        :param tileSize: width and height of the tiles in pixels
+        :return: N/A
+        """
+
+        self.mRaytracer = raytracer
+        self.mTiles = raytracer.getTiles(tileSize)
+
+        self.mTileRays = {}       # Tile -> (N, 7) array of the rays it traced, see raysHitBox
+        self.mTileTouched = {}    # Tile -> set of objects that decided its colors
+        self.mDirty = set(self.mTiles)
+
+        self.mKnownObjects = set()
+        self.mCameraKey = None
+        self.mShadingKey = None
+
+    def markAllDirty(self):
+        """
+        Makes the next render trace every tile, e.g. after a light was changed in place
+        :return: None
+        """
+
+        self.mDirty = set(self.mTiles)
+
+    def markObjectChanged(self, obj):
+        """
+        Call after changing an object in place. Marks the tiles it can affect dirty, and the BVH too.
+        :param obj: the changed object
+        :return: None
+        """
+
+        self.mRaytracer.markObjectsDirty()
+        self.markObjectTiles(obj)
+
+    def markObjectTiles(self, obj):
+        """
+        Marks the tiles obj affected last render, or could affect now, dirty
+        :param obj: an object of the scene, or one just removed from it
+        :return: None
+        """
+
+        bounds = obj.getBounds()
+        if bounds is None:
+            self.markAllDirty()
+            return
+
+        for tile in self.mTiles:
+            if tile in self.mDirty:
+                continue
+            if obj in self.mTileTouched[tile] or raysHitBox(self.mTileRays[tile], *bounds):
+                self.mDirty.add(tile)
+
+    def render(self):
+        """
+        Traces the dirty tiles into the frame buffer and presents them. The first call traces all of them.
+        :return: the list of tiles traced
+        """
+
+        RT = self.mRaytracer
+        snapshot = RT.getSnapshot()
+
+        cameraKey = RT.getCameraKey()
+        shadingKey = (snapshot.mLights, snapshot.mSceneAmbient.mData, snapshot.mBGColor, snapshot.mMinContribution)
+        if cameraKey != self.mCameraKey or shadingKey != self.mShadingKey:
+            self.markAllDirty()
+            self.mCameraKey = cameraKey
+            self.mShadingKey = shadingKey
+
+        objects = set(RT.mObjects)
+        if objects != self.mKnownObjects:
+            for obj in objects.symmetric_difference(self.mKnownObjects):
+                self.markObjectTiles(obj)
+            self.mKnownObjects = objects
+
+        traced = [tile for tile in self.mTiles if tile in self.mDirty]
+        for tile in traced:
+            context = RecordingTraceContext(snapshot)
+            if RT.mStats is not None:
+                RT.mStats.attach(context)
+
+            RT.presentTile(tile, RT.renderTile(*tile, context=context))
+            self.mTileRays[tile] = np.array(context.mRays, dtype=float).reshape(-1, 7)
+            self.mTileTouched[tile] = context.mTouched
+
+        self.mDirty = set()
+        RT.finishStatsFrame()
+        return traced
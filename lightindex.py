@@ -0,0 +1,61 @@
+from bvh import BVH
+
+
+class LightIndex(object):
+
+    def __init__(self, lights, maxLeafSize=2):
+        """
+        Spatial index over the lights of a scene. Lights with bounds (see Light.getBounds) go into a
+        BVH over their influence boxes, so shading a point only looks at the lights whose box holds it
+        plus the lights that reach everywhere.
+        :param lights: the scene's lights
+        :param maxLeafSize: passed on to the BVH
+        :return: N/A
+        """
+
+        self.mLights = tuple(lights)
+        self.mKeys = tuple(light.getInfluenceKey() for light in self.mLights)
+        self.mOrder = {light: i for i, light in enumerate(self.mLights)}
+
+        bounded = [light for light in self.mLights if light.getBounds() is not None]
+        self.mUnboundedLights = [light for light in self.mLights if light.getBounds() is None]
+        self.mBVH = BVH(bounded, maxLeafSize)
+
+    def matches(self, lights):
+        """
+        :param lights: the scene's lights
+        :return: True if an index built over them now would equal this one, lights moved in place included
+        """
+
+        return self.mLights == tuple(lights) and self.mKeys == tuple(light.getInfluenceKey() for light in lights)
+
+    def findLights(self, point):
+        """
+        :param point: a Vec3
+        :return: the lights that may reach point, in the order they are in the scene
+        """
+
+        if not len(self.mBVH):
+            return self.mLights
+
+        found = self.mBVH.findContaining((point.mX, point.mY, point.mZ))
+        if self.mUnboundedLights:
+            found.extend(self.mUnboundedLights)
+        found.sort(key=self.mOrder.__getitem__)
+        return found
+
+    def findLightsInBox(self, boxMin, boxMax):
+        """
+        :param boxMin: (x, y, z) minimum corner of a box around the points being shaded
+        :param boxMax: (x, y, z) maximum corner
+        :return: the lights that may reach some point in the box, in the order they are in the scene
+        """
+
+        if not len(self.mBVH):
+            return self.mLights
+
+        found = self.mBVH.findOverlapping(boxMin, boxMax)
+        if self.mUnboundedLights:
+            found.extend(self.mUnboundedLights)
+        found.sort(key=self.mOrder.__getitem__)
+        return found
@@ -8,6 +8,9 @@ class VectorN(object):
     Used to make a Vector Object of any dimension. Will later be extended with
     the ability to use arithmetic operations on VectorN objects.
     """
+
+    __slots__ = ("mData", "mDim")
+
     def __init__(self, param):
         """
         :param param: Can be either an int or a sequence type object, or a VectorN
@@ -359,6 +362,192 @@ class VectorN(object):
         return VectorN(pairwiseList)
 
 
+class Vec3(VectorN):
+    """
+    A fixed size 3D vector for the raytracer's hot paths. The components live in slots rather than
+    a list, and arithmetic assumes the other operand is also a Vec3 (or a scaler) instead of
+    checking types and dimensions. It is still a VectorN, so the two mix in either order.
+    """
+
+    __slots__ = ("mX", "mY", "mZ")
+
+    mDim = 3
+
+    def __init__(self, x=0.0, y=0.0, z=0.0):
+        """
+        :param x: the x component, assumed to already be a float (or int)
+        :param y: the y component
+        :param z: the z component
+        :return: N/A
+        """
+
+        self.mX = x
+        self.mY = y
+        self.mZ = z
+
+    @property
+    def mData(self):
+        """
+        :return: a new list of the components, for code written against VectorN
+        """
+
+        return [self.mX, self.mY, self.mZ]
+
+    def __reduce__(self):
+        return Vec3, (self.mX, self.mY, self.mZ)
+
+    def __str__(self):
+        return "<Vector3: " + str(self.mX) + ", " + str(self.mY) + ", " + str(self.mZ) + ">"
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        yield self.mX
+        yield self.mY
+        yield self.mZ
+
+    def __getitem__(self, item):
+        return (self.mX, self.mY, self.mZ)[item]
+
+    def __setitem__(self, key, value):
+        if key == 0 or key == -3:
+            self.mX = float(value)
+        elif key == 1 or key == -2:
+            self.mY = float(value)
+        elif key == 2 or key == -1:
+            self.mZ = float(value)
+        else:
+            raise IndexError("Vec3 index out of range")
+
+    def __eq__(self, other):
+        if not isinstance(other, VectorN) or len(other) != 3:
+            return False
+
+        return self.mX == other[0] and self.mY == other[1] and self.mZ == other[2]
+
+    __hash__ = None
+
+    def __add__(self, other):
+        try:
+            return Vec3(self.mX + other.mX, self.mY + other.mY, self.mZ + other.mZ)
+        except AttributeError:
+            return VectorN.__add__(self, other)
+
+    def __radd__(self, other):
+        return self + other
+
+    def __sub__(self, other):
+        try:
+            return Vec3(self.mX - other.mX, self.mY - other.mY, self.mZ - other.mZ)
+        except AttributeError:
+            return VectorN.__sub__(self, other)
+
+    def __rsub__(self, other):
+        return VectorN.__rsub__(self, other)
+
+    def __mul__(self, scaler):
+        return Vec3(self.mX * scaler, self.mY * scaler, self.mZ * scaler)
+
+    def __rmul__(self, scaler):
+        return Vec3(self.mX * scaler, self.mY * scaler, self.mZ * scaler)
+
+    def __truediv__(self, scaler):
+        return Vec3(self.mX / scaler, self.mY / scaler, self.mZ / scaler)
+
+    def __neg__(self):
+        return Vec3(-self.mX, -self.mY, -self.mZ)
+
+    def copy(self):
+        return Vec3(self.mX, self.mY, self.mZ)
+
+    def iTuple(self):
+        return int(self.mX), int(self.mY), int(self.mZ)
+
+    def isZero(self):
+        return self.mX == 0.0 and self.mY == 0.0 and self.mZ == 0.0
+
+    def magnitude(self):
+        return (self.mX * self.mX + self.mY * self.mY + self.mZ * self.mZ) ** .5
+
+    def magnitudeSquared(self):
+        return self.mX * self.mX + self.mY * self.mY + self.mZ * self.mZ
+
+    def normalized_copy(self):
+        magnitude = (self.mX * self.mX + self.mY * self.mY + self.mZ * self.mZ) ** .5
+        if magnitude == 0.0:
+            return Vec3(self.mX, self.mY, self.mZ)
+
+        return Vec3(self.mX / magnitude, self.mY / magnitude, self.mZ / magnitude)
+
+    def dot(self, otherVector):
+        try:
+            return self.mX * otherVector.mX + self.mY * otherVector.mY + self.mZ * otherVector.mZ
+        except AttributeError:
+            return VectorN.dot(self, otherVector)
+
+    def cross(self, otherVector3):
+        return Vec3(self.mY * otherVector3[2] - self.mZ * otherVector3[1],
+                    self.mZ * otherVector3[0] - self.mX * otherVector3[2],
+                    self.mX * otherVector3[1] - self.mY * otherVector3[0])
+
+    def pairwise(self, otherVector):
+        try:
+            return Vec3(self.mX * otherVector.mX, self.mY * otherVector.mY, self.mZ * otherVector.mZ)
+        except AttributeError:
+            return VectorN.pairwise(self, otherVector)
+
+
+def toVec3(param):
+    """
+    Converts any 3 element sequence (a VectorN, tuple, list...) into a new Vec3 of floats
+    :param param: the sequence to convert
+    :return: a Vec3
+    """
+
+    if len(param) != 3:
+        raise Exception(TypeError("Can only make a Vec3 from 3 elements, got " + str(len(param))))
+
+    return Vec3(float(param[0]), float(param[1]), float(param[2]))
+
+
+def benchmarkVec3(iterations=20000):
+    """
+    Times a shading-style expression (the body of Raytracer.getColorOfHit for one light) with
+    VectorN and with Vec3, and measures the memory each vector the expression creates takes
+    :param iterations: how many times to evaluate the expression
+    :return: None, results are printed
+    """
+
+    import sys, timeit, tracemalloc
+
+    for vectorType, make in ((VectorN, lambda *v: VectorN(v)), (Vec3, Vec3)):
+        point = make(1.0, 2.0, 3.0)
+        normal = make(0.0, 1.0, 0.0)
+        lightPos = make(0.0, 55.0, 0.0)
+        color = make(.5, 1.0, 1.0)
+        toCam = make(0.0, 0.0, -1.0)
+
+        def shade():
+            lightVector = (lightPos - point).normalized_copy()
+            diffuse = lightVector.dot(normal)
+            reflection = 2*(normal*diffuse) - lightVector
+            return diffuse * color.pairwise(color) + reflection.dot(toCam) * color
+
+        tracemalloc.start()
+        result = shade()
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        vectorBytes = sys.getsizeof(result)
+        if vectorType is VectorN:
+            vectorBytes += sys.getsizeof(result.mData)
+
+        seconds = min(timeit.repeat(shade, number=iterations, repeat=3))
+        print("%-7s %6.2f us per shade, %3d bytes per vector, %5d bytes peak for one shade" %
+              (vectorType.__name__, seconds / iterations * 1e6, vectorBytes, allocated))
+
+
 if __name__ == "__main__":
     # # Note: By adding this if statement, we'll only execute the following code
     # # if running this module directly (F5 in Idle, or the play button in
@@ -394,3 +583,6 @@ if __name__ == "__main__":
     w = VectorN((-5555, 40065, -.00523))
 
     print(v.cross(w))
+    print(toVec3(v).cross(toVec3(w)))
+
+    benchmarkVec3()
@@ -0,0 +1,597 @@
+"""
+Triangle meshes, loaded from Wavefront OBJ files into a (V, 3) vertex array and a (T, 3) index array.
+
+    vertices, indices = loadOBJ("bunny.obj")
+    RT.mObjects.append(TriangleMesh(vertices, indices, Material(VectorN((.8, .8, .8)))))
+
+A TriangleMesh is one object to the Raytracer, with its own BVH over its triangles kept as flat arrays
+(node boxes, child indices and triangle ranges) rather than node objects. Triangles are shaded flat with
+the normal given by their winding, counter-clockwise seen from outside as in OBJ files.
+"""
+import math
+import numpy as np
+from math3d import Vec3
+from objects3d import RayHitResult, makeRayHitResult
+from bvh import inverseDirection, inverseDirectionBatch, packetBoxEntry
+
+# Rays closer to parallel with a triangle than this (the Moller-Trumbore determinant) miss it
+PARALLEL_EPSILON = 1e-12
+# rayHitBatch tests subtrees of at most this many triangles whole, rather than walking down to their leaves,
+# while the packet reaching them times their triangle count stays within BATCH_LEAF_TESTS
+BATCH_LEAF_SIZE = 128
+BATCH_LEAF_TESTS = 1 << 20
+
+
+def loadOBJ(path):
+    """
+    Reads the vertices and faces of a Wavefront OBJ file. Faces with more than three corners are split
+    into a fan of triangles. Texture coordinates, normals, groups and materials are ignored.
+    :param path: the .obj file
+    :return: (vertices, indices), a (V, 3) float array and a (T, 3) int array indexing it
+    """
+
+    vertices = []
+    faces = []
+
+    with open(path) as f:
+        for line in f:
+            if line.startswith("v "):
+                x, y, z = line.split()[1:4]
+                vertices.append((float(x), float(y), float(z)))
+            elif line.startswith("f "):
+                corners = []
+                for token in line.split()[1:]:
+                    index = int(token.split("/")[0])
+                    # Negative indices count back from the last vertex read so far
+                    corners.append(index - 1 if index > 0 else len(vertices) + index)
+                for i in range(1, len(corners) - 1):
+                    faces.append((corners[0], corners[i], corners[i + 1]))
+
+    return np.array(vertices, dtype=float).reshape(-1, 3), np.array(faces, dtype=np.int64).reshape(-1, 3)
+
+
+def saveOBJ(path, vertices, indices):
+    """
+    Writes vertices and triangles as a Wavefront OBJ file
+    :param path: the .obj file to write
+    :param vertices: (V, 3) float array
+    :param indices: (T, 3) int array indexing vertices
+    :return: None
+    """
+
+    with open(path, "w") as f:
+        for x, y, z in np.asarray(vertices).tolist():
+            f.write("v %r %r %r\n" % (x, y, z))
+        for a, b, c in (np.asarray(indices) + 1).tolist():
+            f.write("f %d %d %d\n" % (a, b, c))
+
+
+def makeTorus(majorRadius, minorRadius, rings, sides):
+    """
+    A torus round the Y axis, centered on the origin
+    :param majorRadius: distance from the center to the middle of the tube
+    :param minorRadius: radius of the tube
+    :param rings: segments round the Y axis
+    :param sides: segments round the tube
+    :return: (vertices, indices) as loadOBJ returns them, 2 * rings * sides triangles
+    """
+
+    theta = 2 * math.pi * np.arange(rings) / rings
+    phi = 2 * math.pi * np.arange(sides) / sides
+    theta, phi = np.meshgrid(theta, phi, indexing="ij")
+
+    radius = majorRadius + minorRadius * np.cos(phi)
+    vertices = np.stack((radius * np.cos(theta), minorRadius * np.sin(phi), radius * np.sin(theta)), axis=-1).reshape(-1, 3)
+
+    i, j = np.meshgrid(np.arange(rings), np.arange(sides), indexing="ij")
+    a = i * sides + j
+    b = (i + 1) % rings * sides + j
+    c = (i + 1) % rings * sides + (j + 1) % sides
+    d = i * sides + (j + 1) % sides
+    indices = np.concatenate((np.stack((a, d, c), axis=-1).reshape(-1, 3), np.stack((a, c, b), axis=-1).reshape(-1, 3)))
+    return vertices, indices
+
+
+def buildTriangleBVH(triMin, triMax, centroids, maxLeafSize):
+    """
+    Builds a BVH over triangles top down, splitting each node at the median centroid along the axis
+    the centroids spread furthest over
+    :param triMin: (T, 3) array of the triangles' minimum corners
+    :param triMax: (T, 3) array of the triangles' maximum corners
+    :param centroids: (T, 3) array of the triangles' centroids
+    :param maxLeafSize: nodes with at most this many triangles become leaves
+    :return: (nodeMin, nodeMax, nodeAxis, nodeLeft, nodeRight, nodeStart, nodeCount, order) arrays, leaf
+             triangles being order[nodeStart:nodeStart + nodeCount], all empty when there are no triangles
+    """
+
+    nodeMin = []
+    nodeMax = []
+    nodeAxis = []       # Axis the children were split along, left holding the lower half
+    nodeLeft = []       # -1 for leaves
+    nodeRight = []
+    nodeStart = []
+    nodeCount = []      # 0 for interior nodes
+    order = []
+    numOrdered = 0
+
+    def addNode(items):
+        nodeMin.append(triMin[items].min(axis=0))
+        nodeMax.append(triMax[items].max(axis=0))
+        nodeAxis.append(0)
+        nodeLeft.append(-1)
+        nodeRight.append(-1)
+        nodeStart.append(0)
+        nodeCount.append(0)
+        return len(nodeMin) - 1
+
+    if not len(triMin):
+        empty = np.zeros(0, dtype=np.int64)
+        return np.zeros((0, 3)), np.zeros((0, 3)), empty, empty, empty, empty, empty, empty
+
+    items = np.arange(len(triMin))
+    stack = [(addNode(items), items)]
+    while stack:
+        node, items = stack.pop()
+
+        if len(items) > maxLeafSize:
+            points = centroids[items]
+            extent = points.max(axis=0) - points.min(axis=0)
+            axis = int(np.argmax(extent))
+
+            if extent[axis] > 0:
+                half = len(items) // 2
+                split = np.argpartition(points[:, axis], half)
+                left = items[split[:half]]
+                right = items[split[half:]]
+
+                nodeAxis[node] = axis
+                nodeLeft[node] = addNode(left)
+                nodeRight[node] = addNode(right)
+                stack.append((nodeRight[node], right))
+                stack.append((nodeLeft[node], left))
+                continue
+
+        nodeStart[node] = numOrdered
+        nodeCount[node] = len(items)
+        order.append(items)
+        numOrdered += len(items)
+
+    return (np.array(nodeMin).reshape(-1, 3), np.array(nodeMax).reshape(-1, 3), np.array(nodeAxis),
+            np.array(nodeLeft), np.array(nodeRight), np.array(nodeStart), np.array(nodeCount),
+            np.concatenate(order) if order else np.zeros(0, dtype=np.int64))
+
+
+class TriangleMesh(object):
+
+    def __init__(self, vertices, indices, material, maxLeafSize=8):
+        """
+        A mesh of triangles sharing one material
+        :param vertices: (V, 3) array of vertex positions
+        :param indices: (T, 3) array of vertex indices, one row per triangle
+        :param material: a Material
+        :param maxLeafSize: most triangles in a leaf of the mesh's BVH
+        :return: N/A
+        """
+
+        self.mVertices = np.array(vertices, dtype=float).reshape(-1, 3)
+        self.mIndices = np.array(indices, dtype=np.int64).reshape(-1, 3)
+        self.mMaterial = material
+        self.mMaxLeafSize = maxLeafSize
+        self.precompute()
+
+    def __len__(self):
+        return len(self.mIndices)
+
+    def precompute(self):
+        """
+        Builds the BVH and the per triangle data the intersection routines need from mVertices and
+        mIndices. Call again after changing either in place.
+        :return: None
+        """
+
+        corners = self.mVertices[self.mIndices]
+        edge1 = corners[:, 1] - corners[:, 0]
+        edge2 = corners[:, 2] - corners[:, 0]
+        normals = np.cross(edge1, edge2)
+        length = np.linalg.norm(normals, axis=1)
+
+        # Triangles without area can't be hit, leave them out
+        kept = np.flatnonzero(length > 0)
+        keptCorners = corners[kept]
+
+        (self.mNodeMin, self.mNodeMax, self.mNodeAxis, self.mNodeLeft, self.mNodeRight,
+         self.mNodeStart, self.mNodeCount, order) = buildTriangleBVH(keptCorners.min(axis=1), keptCorners.max(axis=1),
+                                                                     keptCorners.mean(axis=1), self.mMaxLeafSize)
+
+        # The triangles under each node, a contiguous range of the leaf order as left subtrees are ordered first
+        self.mNodeSpanStart = self.mNodeStart.copy()
+        self.mNodeSpanCount = self.mNodeCount.copy()
+        for node, left, right in reversed(list(zip(range(len(self.mNodeLeft)), self.mNodeLeft.tolist(), self.mNodeRight.tolist()))):
+            if left >= 0:
+                self.mNodeSpanStart[node] = self.mNodeSpanStart[left]
+                self.mNodeSpanCount[node] = self.mNodeSpanCount[left] + self.mNodeSpanCount[right]
+
+        # Triangle data in leaf order, so every leaf is a contiguous range
+        order = kept[order]
+        self.mTriangles = order                       # Index into mIndices of each triangle below
+        self.mV0 = corners[order, 0]
+        self.mEdge1 = edge1[order]
+        self.mEdge2 = edge2[order]
+        self.mFaceNormals = normals[order] / length[order, np.newaxis]
+        # The same by component, (3, T), for hitTrianglesBatch
+        self.mV0Columns = np.ascontiguousarray(self.mV0.T)
+        self.mEdge1Columns = np.ascontiguousarray(self.mEdge1.T)
+        self.mEdge2Columns = np.ascontiguousarray(self.mEdge2.T)
+
+        # For getNormalBatch: barycentric coordinate terms and a size to scale distances outside a triangle by
+        self.mEdgeDots = np.stack((np.einsum("ij,ij->i", self.mEdge1, self.mEdge1),
+                                   np.einsum("ij,ij->i", self.mEdge1, self.mEdge2),
+                                   np.einsum("ij,ij->i", self.mEdge2, self.mEdge2)), axis=1)
+        self.mTriangleSizes = np.sqrt(np.maximum(self.mEdgeDots[:, 0], self.mEdgeDots[:, 2]))
+
+        if len(order):
+            size = np.linalg.norm(self.mNodeMax[0] - self.mNodeMin[0])
+        else:
+            size = 0.0
+        self.mTolerance = 1e-7 * size + 1e-9
+
+        # Python lists of the same data for the one ray at a time routines, made on first use
+        self.mScalarData = None
+
+    def __getstate__(self):
+        """
+        Pickles everything but the Python lists, which are made again when needed
+        """
+
+        state = self.__dict__.copy()
+        state["mScalarData"] = None
+        return state
+
+    def getScalarData(self):
+        """
+        :return: (nodes, triangles): a tuple per node of its box, split axis, children, first triangle and
+                 triangle count, and a tuple per triangle of its first corner and two edges, as Python floats
+        """
+
+        if self.mScalarData is None:
+            nodes = [tuple(node) for node in zip(*(array.tolist() for array in
+                     (self.mNodeMin[:, 0], self.mNodeMin[:, 1], self.mNodeMin[:, 2],
+                      self.mNodeMax[:, 0], self.mNodeMax[:, 1], self.mNodeMax[:, 2],
+                      self.mNodeAxis, self.mNodeLeft, self.mNodeRight, self.mNodeStart, self.mNodeCount)))]
+            triangles = [tuple(row) for row in np.hstack((self.mV0, self.mEdge1, self.mEdge2)).tolist()]
+            self.mScalarData = nodes, triangles
+
+        return self.mScalarData
+
+    def getBounds(self):
+        """
+        :return: (minPt, maxPt) of the box enclosing every triangle, None for a mesh without any
+        """
+
+        if not len(self.mTriangles):
+            return None
+        return Vec3(*self.mNodeMin[0].tolist()), Vec3(*self.mNodeMax[0].tolist())
+
+    def getFaceNormal(self, triangle):
+        """
+        :param triangle: index into the leaf ordered triangle data, as intersect returns it
+        :return: the triangle's normal as a Vec3
+        """
+
+        return Vec3(*self.mFaceNormals[triangle].tolist())
+
+    def intersect(self, R, tMax=math.inf, anyHit=False):
+        """
+        Walks the mesh's BVH, nearer child first, testing the triangles of the leaves it reaches with
+        the Moller-Trumbore test
+        :param R: a Ray
+        :param tMax: only hits closer than this count
+        :param anyHit: stop at the first hit found rather than the closest
+        :return: (distance, triangle) of the hit, triangle as for getFaceNormal, or None
+        """
+
+        if not len(self.mTriangles):
+            return None
+
+        nodes, triangles = self.getScalarData()
+        origin = R.mOrigin
+        direction = R.mDirection
+        ox, oy, oz = origin.mX, origin.mY, origin.mZ
+        dx, dy, dz = direction.mX, direction.mY, direction.mZ
+        ix, iy, iz = inverseDirection(direction)
+        signs = (dx > 0, dy > 0, dz > 0)
+
+        bestDist = tMax
+        bestTriangle = -1
+        stack = [0]
+        while stack:
+            minX, minY, minZ, maxX, maxY, maxZ, axis, left, right, start, count = nodes[stack.pop()]
+
+            t1 = (minX - ox) * ix
+            t2 = (maxX - ox) * ix
+            tNear, tFar = (t1, t2) if t1 < t2 else (t2, t1)
+            t1 = (minY - oy) * iy
+            t2 = (maxY - oy) * iy
+            if t1 > t2:
+                t1, t2 = t2, t1
+            if t1 > tNear:
+                tNear = t1
+            if t2 < tFar:
+                tFar = t2
+            t1 = (minZ - oz) * iz
+            t2 = (maxZ - oz) * iz
+            if t1 > t2:
+                t1, t2 = t2, t1
+            if t1 > tNear:
+                tNear = t1
+            if t2 < tFar:
+                tFar = t2
+            if tNear > tFar or tFar < 0 or tNear >= bestDist:
+                continue
+
+            if not count:
+                # Push the far child first so the near one is searched first
+                if signs[axis]:
+                    stack.append(right)
+                    stack.append(left)
+                else:
+                    stack.append(left)
+                    stack.append(right)
+                continue
+
+            for triangle in range(start, start + count):
+                ax, ay, az, e1x, e1y, e1z, e2x, e2y, e2z = triangles[triangle]
+                px = dy * e2z - dz * e2y
+                py = dz * e2x - dx * e2z
+                pz = dx * e2y - dy * e2x
+                det = e1x * px + e1y * py + e1z * pz
+                if -PARALLEL_EPSILON < det < PARALLEL_EPSILON:
+                    continue
+
+                invDet = 1.0 / det
+                tx = ox - ax
+                ty = oy - ay
+                tz = oz - az
+                u = (tx * px + ty * py + tz * pz) * invDet
+                if u < 0.0 or u > 1.0:
+                    continue
+
+                qx = ty * e1z - tz * e1y
+                qy = tz * e1x - tx * e1z
+                qz = tx * e1y - ty * e1x
+                v = (dx * qx + dy * qy + dz * qz) * invDet
+                if v < 0.0 or u + v > 1.0:
+                    continue
+
+                t = (e2x * qx + e2y * qy + e2z * qz) * invDet
+                if 0.0 < t < bestDist:
+                    bestDist = t
+                    bestTriangle = triangle
+                    if anyHit:
+                        return bestDist, bestTriangle
+
+        if bestTriangle < 0:
+            return None
+        return bestDist, bestTriangle
+
+    def getNormal(self, point):
+        """
+        Gets the normal at a point, that of the triangle the point lies on
+        :param point: Point (VectorN) on the mesh
+        :return: a normalized Vec3
+        """
+
+        return Vec3(*self.getNormalBatch(np.array([point.mData], dtype=float))[0].tolist())
+
+    def hitDistances(self, R):
+        """
+        :param R: a Ray
+        :return: tuple holding the distance along R to the nearest triangle hit, empty for a miss
+        """
+
+        hit = self.intersect(R)
+        return (hit[0],) if hit is not None else ()
+
+    def rayHit(self, R):
+        """
+        :param R: a Ray
+        :return: a RayHitResult holding the nearest triangle hit and its normal, or None
+        """
+
+        hit = self.intersect(R)
+        if hit is None:
+            return None
+
+        result = RayHitResult(R, self)
+        result.appendIntersection(hit[0], self.getFaceNormal(hit[1]))
+        return result
+
+    def closestHit(self, R, tMax=math.inf):
+        """
+        Closest-hit test, see BVH.findClosestHit
+        :param R: a Ray
+        :param tMax: distance of the best hit found so far, only closer hits count
+        :return: the distance along R to the nearest triangle closer than tMax, or None
+        """
+
+        hit = self.intersect(R, tMax)
+        return hit[0] if hit is not None else None
+
+    def getHitResult(self, R, dist):
+        """
+        Builds the hit record of a closestHit winner, finding the triangle again for its normal
+        :param R: the Ray
+        :param dist: the distance closestHit returned
+        :return: a RayHitResult holding that one intersection
+        """
+
+        hit = self.intersect(R, math.nextafter(dist, math.inf))
+        if hit is None:
+            return makeRayHitResult(R, self, (dist,))
+
+        result = RayHitResult(R, self)
+        result.appendIntersection(dist, self.getFaceNormal(hit[1]))
+        return result
+
+    def occludes(self, R, maxDist):
+        """
+        Any-hit test for shadow rays, stops at the first triangle found
+        :param R: a Ray
+        :param maxDist: only hits at or closer than this count
+        :return: True if some triangle is hit no further than maxDist along R
+        """
+
+        return self.intersect(R, math.nextafter(maxDist, math.inf), True) is not None
+
+    def hitTrianglesBatch(self, origins, directions, start, count):
+        """
+        Moller-Trumbore test of every ray against a range of the leaf ordered triangles
+        :param origins: (N, 3) array of ray origins
+        :param directions: (N, 3) array of normalized ray directions
+        :param start: first triangle
+        :param count: number of triangles
+        :return: (N, count) array of hit distances, inf for misses
+        """
+
+        triangles = slice(start, start + count)
+        ax, ay, az = self.mV0Columns[:, triangles]
+        e1x, e1y, e1z = self.mEdge1Columns[:, triangles]
+        e2x, e2y, e2z = self.mEdge2Columns[:, triangles]
+        dx, dy, dz = directions.T[:, :, np.newaxis]
+        ox, oy, oz = origins.T[:, :, np.newaxis]
+
+        # Written out per component, np.cross costs more than the arithmetic on arrays this small
+        px = dy * e2z - dz * e2y
+        py = dz * e2x - dx * e2z
+        pz = dx * e2y - dy * e2x
+        det = e1x * px + e1y * py + e1z * pz
+        parallel = np.abs(det) < PARALLEL_EPSILON
+        invDet = 1.0 / np.where(parallel, 1.0, det)
+
+        tx = ox - ax
+        ty = oy - ay
+        tz = oz - az
+        u = (tx * px + ty * py + tz * pz) * invDet
+        qx = ty * e1z - tz * e1y
+        qy = tz * e1x - tx * e1z
+        qz = tx * e1y - ty * e1x
+        v = (dx * qx + dy * qy + dz * qz) * invDet
+        t = (e2x * qx + e2y * qy + e2z * qz) * invDet
+
+        hit = ~parallel & (u >= 0) & (u <= 1) & (v >= 0) & (u + v <= 1) & (t > 0)
+        return np.where(hit, t, np.inf)
+
+    def rayHitBatch(self, origins, directions, parts=None):
+        """
+        Array version of rayHit. The rays go down the mesh's BVH together, dropping out of the packet
+        below the nodes they miss, and each leaf tests all of its rays against all of its triangles at once.
+        Small subtrees count as leaves here, see BATCH_LEAF_SIZE, as a node costs more than a few triangles.
+        :param origins: (N, 3) array of ray origins
+        :param directions: (N, 3) array of normalized ray directions
+        :param parts: optional (N,) int array, set to the triangle (as for getFaceNormal) each ray hits
+                      where it hits, and left alone where it misses
+        :return: (N,) array of the nearest hit distance along each ray, inf where it misses
+        """
+
+        bestDist = np.full(len(origins), np.inf)
+        if not len(self.mTriangles) or not len(origins):
+            return bestDist
+
+        origins = np.broadcast_to(origins, directions.shape)
+        invDirs = inverseDirectionBatch(directions)
+
+        stack = [(0, np.arange(len(origins)))]
+        while stack:
+            node, rays = stack.pop()
+            entry = packetBoxEntry(self.mNodeMin[node], self.mNodeMax[node], origins[rays], invDirs[rays], bestDist[rays])
+            rays = rays[entry < bestDist[rays]]
+            if not len(rays):
+                continue
+
+            count = self.mNodeSpanCount[node]
+            if self.mNodeCount[node] or (count <= BATCH_LEAF_SIZE and len(rays) * count <= BATCH_LEAF_TESTS):
+                start = self.mNodeSpanStart[node]
+                dist = self.hitTrianglesBatch(origins[rays], directions[rays], start, count)
+                nearest = np.argmin(dist, axis=1)
+                dist = dist[np.arange(len(rays)), nearest]
+                closer = dist < bestDist[rays]
+                bestDist[rays[closer]] = dist[closer]
+                if parts is not None:
+                    parts[rays[closer]] = start + nearest[closer]
+                continue
+
+            # Most of the packet searches the nearer child first
+            left = self.mNodeLeft[node]
+            right = self.mNodeRight[node]
+            if directions[rays, self.mNodeAxis[node]].sum() > 0:
+                stack.append((right, rays))
+                stack.append((left, rays))
+            else:
+                stack.append((left, rays))
+                stack.append((right, rays))
+
+        return bestDist
+
+    def getNormalBatch(self, points, directions=None, parts=None):
+        """
+        Array version of getNormal. Given the triangles rayHitBatch found, the normals are theirs. Otherwise
+        the points go down the BVH together to the leaves whose boxes hold them, and each takes the normal
+        of the nearest triangle there, which can be either one where two triangles meet.
+        :param points: (N, 3) array of points on the mesh
+        :param directions: unused, see AABB.getNormalBatch
+        :param parts: optional (N,) array of the triangles hit, as rayHitBatch sets them, -1 where not known
+        :return: (N, 3) array of normals
+        """
+
+        normals = np.zeros(points.shape)
+        if not len(self.mTriangles) or not len(points):
+            return normals
+
+        searched = np.arange(len(points))
+        if parts is not None:
+            known = parts >= 0
+            normals[known] = self.mFaceNormals[parts[known]]
+            searched = searched[~known]
+            if not len(searched):
+                return normals
+
+        bestScore = np.full(len(points), np.inf)
+        tolerance = self.mTolerance
+
+        stack = [(0, searched)]
+        while stack:
+            node, inside = stack.pop()
+            nodePoints = points[inside]
+            inside = inside[np.all((nodePoints >= self.mNodeMin[node] - tolerance) &
+                                   (nodePoints <= self.mNodeMax[node] + tolerance), axis=1)]
+            if not len(inside):
+                continue
+
+            count = self.mNodeCount[node]
+            if not count:
+                stack.append((self.mNodeRight[node], inside))
+                stack.append((self.mNodeLeft[node], inside))
+                continue
+
+            triangles = slice(self.mNodeStart[node], self.mNodeStart[node] + count)
+            toPoint = points[inside][:, np.newaxis, :] - self.mV0[triangles]
+            planeDist = np.abs(np.einsum("ijk,jk->ij", toPoint, self.mFaceNormals[triangles]))
+
+            # Barycentric coordinates of the points projected onto each triangle's plane
+            dot11, dot12, dot22 = self.mEdgeDots[triangles].T
+            d1 = np.einsum("ijk,jk->ij", toPoint, self.mEdge1[triangles])
+            d2 = np.einsum("ijk,jk->ij", toPoint, self.mEdge2[triangles])
+            denominator = dot11 * dot22 - dot12 * dot12
+            v = (dot22 * d1 - dot12 * d2) / denominator
+            w = (dot11 * d2 - dot12 * d1) / denominator
+            outside = np.maximum(np.maximum(-v, -w), np.maximum(v + w - 1, 0))
+
+            # Roughly the distance from each point to each triangle
+            score = planeDist + outside * self.mTriangleSizes[triangles]
+            nearest = np.argmin(score, axis=1)
+            nearestScore = score[np.arange(len(inside)), nearest]
+            closer = nearestScore < bestScore[inside]
+            bestScore[inside[closer]] = nearestScore[closer]
+            normals[inside[closer]] = self.mFaceNormals[self.mNodeStart[node] + nearest[closer]]
+
+        return normals
@@ -1,29 +1,66 @@
 import math3d
-from math3d import VectorN
+from math3d import VectorN, Vec3, toVec3
 import pygame, math
+import numpy as np
 
 drawThickness = 3
 FULL_INTENSITY = 1.00
 NO_INTENSITY = 0.00
 
 class Material(object):
-    def __init__(self, diffuseColor, specularColor=VectorN((1,1,1)), hardness=18):
-        self.mAmbient = diffuseColor.pairwise(VectorN((.3,.3,.3)))
-        self.mDiffuse = diffuseColor
-        self.mSpecular = specularColor
+    def __init__(self, diffuseColor, specularColor=VectorN((1,1,1)), hardness=18, reflectivity=0.5, reflectionDepth=1):
+        """
+        :param diffuseColor: VectorN color, components 0-1
+        :param specularColor: VectorN color of the highlights
+        :param hardness: specular exponent, higher is a tighter highlight
+        :param reflectivity: share of the color that comes from the reflection, 0 for matte surfaces
+        :param reflectionDepth: how many reflection bounces may follow a hit on this material
+        :return: N/A
+        """
+
+        self.setDiffuse(diffuseColor)
+        self.mSpecular = toVec3(specularColor)
 
         self.mHardness = hardness
+        self.mReflectivity = reflectivity
+        self.mReflectionDepth = reflectionDepth
+
+    def setDiffuse(self, diffuseColor):
+        """
+        Changes the diffuse color, and the ambient color that follows it
+        :param diffuseColor: VectorN color, components 0-1
+        :return: None
+        """
+
+        self.mDiffuse = toVec3(diffuseColor)
+        self.mAmbient = self.mDiffuse.pairwise(Vec3(.3, .3, .3))
 
     def getPygameColor(self):
         return (255 * self.mDiffuse).iTuple()
 
 
 class RayHitResult(object):
+
+    __slots__ = ("mRay", "mHitObject", "mIntersectionPoints", "mIntersectionDistances", "mIntersectionNormals")
+
     def __init__(self, ray, obj):
         self.mRay = ray                   # The ray involved in the collision
         self.mHitObject = obj             # The other object in the collision
-        self.mIntersectionPoints = []     # The intersection points on the primitive and ray
+        self.mIntersectionPoints = []     # The intersection points, None until asked for with getPoint
         self.mIntersectionDistances = []  # The distances along the ray to each of the intersection points.
+        self.mIntersectionNormals = []    # Normals known at intersection time, or None to ask the object
+
+    def getPoint(self, index=0):
+        """
+        Gets an intersection point, working it out from its distance the first time it is asked for
+        :param index: an optional paramater specifying which point to get
+        :return: a Vector3 object
+        """
+
+        point = self.mIntersectionPoints[index]
+        if point is None:
+            point = self.mIntersectionPoints[index] = self.mRay.getPoint(self.mIntersectionDistances[index])
+        return point
 
     def getNormal(self, index=0):
         """
@@ -32,26 +69,61 @@ class RayHitResult(object):
         :return: a Vector3 object
         """
 
-        if self.mHitObject.mIsAABB:
-            point = self.mIntersectionPoints[index] - .001*self.mRay.mDirection
-            return self.mHitObject.getNormal(point)
-        else:
-            return self.mHitObject.getNormal(self.mIntersectionPoints[index])
+        normal = self.mIntersectionNormals[index]
+        if normal is None:
+            return self.mHitObject.getNormal(self.getPoint(index))
+        return normal
+
+    def singleHit(self, index):
+        """
+        :param index: which intersection to keep
+        :return: a new RayHitResult holding only that intersection, this one is left as it is
+        """
 
-    def appendIntersection(self, dist):
-        P = self.mRay.getPoint(dist)
-        self.mIntersectionPoints.append(P)
+        result = RayHitResult(self.mRay, self.mHitObject)
+        result.mIntersectionPoints.append(self.mIntersectionPoints[index])
+        result.mIntersectionDistances.append(self.mIntersectionDistances[index])
+        result.mIntersectionNormals.append(self.mIntersectionNormals[index])
+        return result
+
+    def appendIntersection(self, dist, normal=None):
+        self.mIntersectionPoints.append(None)
         self.mIntersectionDistances.append(dist)
+        self.mIntersectionNormals.append(normal)
+
+
+def makeRayHitResult(R, obj, distances):
+    """
+    :param R: the Ray
+    :param obj: the object it hit
+    :param distances: distances along R from the object's hitDistances
+    :return: a RayHitResult holding them, or None if there are none
+    """
+
+    if not distances:
+        return None
+
+    result = RayHitResult(R, obj)
+    for dist in distances:
+        result.appendIntersection(dist)
+    return result
 
 
 class Ray(object):
+
+    __slots__ = ("mOrigin", "mDirection")
+
     def __init__(self, origin, direction, isNormalized=False):
-        self.mOrigin = origin.copy()
+        # Vec3s are treated as values by the tracer, so only other vector types get copied
+        self.mOrigin = origin if type(origin) is Vec3 else toVec3(origin)
+
+        if type(direction) is not Vec3:
+            direction = toVec3(direction)
 
         if not isNormalized:
             self.mDirection = direction.normalized_copy()
         else:
-            self.mDirection = direction.copy()
+            self.mDirection = direction
 
     def pygameRender(self, surf, name=None, font=None):
         maxDist = surf.get_width() + surf.get_height()
@@ -73,12 +145,20 @@ class Ray(object):
 
 class Sphere(object):
     def __init__(self, center, radius, material):
-        self.mCenter = center.copy()
+        self.mCenter = toVec3(center)
         self.mRadius = radius
-        self.mRadiusSq = radius ** 2
         self.mMaterial = material
+        self.precompute()
+
+    def precompute(self):
+        """
+        Caches what the intersection routines need from mCenter and mRadius.
+        Call again after changing either in place.
+        :return: None
+        """
 
-        self.mIsAABB = False
+        self.mCenterXYZ = (self.mCenter.mX, self.mCenter.mY, self.mCenter.mZ)
+        self.mRadiusSq = self.mRadius ** 2
 
     def pygameRender(self, surf, name=None, font=None):
         global drawThickness
@@ -98,36 +178,153 @@ class Sphere(object):
 
         return (point - self.mCenter) / self.mRadius
 
-    def rayHit(self, R):
-        toCenter = self.mCenter - R.mOrigin     # Vector from ray origin to sphere center
-        projDist = toCenter.dot(R.mDirection)   # [scalar] Distance along ray to get closest to sphere center
-        closestDistSq = toCenter.dot(toCenter) - projDist * projDist
+    def getBounds(self):
+        """
+        :return: (minPt, maxPt) of the box enclosing the sphere
+        """
+
+        radius = Vec3(self.mRadius, self.mRadius, self.mRadius)
+        return self.mCenter - radius, self.mCenter + radius
+
+    def hitDistances(self, R):
+        """
+        :param R: a Ray
+        :return: tuple of the distances along R to the intersections in front of it, nearest first, empty for a miss
+        """
+
+        cx, cy, cz = self.mCenterXYZ
+        origin = R.mOrigin
+        direction = R.mDirection
+        tx = cx - origin.mX                     # Vector from ray origin to sphere center
+        ty = cy - origin.mY
+        tz = cz - origin.mZ
+        projDist = tx * direction.mX + ty * direction.mY + tz * direction.mZ   # Distance along ray to get closest to sphere center
+        toCenterSq = tx * tx + ty * ty + tz * tz
+        closestDistSq = toCenterSq - projDist * projDist
         if closestDistSq >= self.mRadiusSq:
             # No hit!
-            return None
+            return ()
         f = (self.mRadiusSq - closestDistSq) ** 0.5
 
-        result = RayHitResult(R, self)
-        if toCenter.magnitudeSquared() > self.mRadiusSq:
+        if toCenterSq > self.mRadiusSq:
             # The Ray originates outside of the sphere
             if projDist - f > 0:
-                result.appendIntersection(projDist - f)
+                return projDist - f, projDist + f
             if projDist + f > 0:
-                result.appendIntersection(projDist + f)
+                return projDist + f,
+            return ()
+
+        # The Ray originates inside the sphere.
+        return projDist + f,
+
+    def rayHit(self, R):
+        return makeRayHitResult(R, self, self.hitDistances(R))
+
+    def closestHit(self, R, tMax=math.inf):
+        """
+        Closest-hit test, see BVH.findClosestHit
+        :param R: a Ray
+        :param tMax: distance of the best hit found so far, only closer hits count
+        :return: the distance along R to the nearest intersection closer than tMax, or None
+        """
+
+        cx, cy, cz = self.mCenterXYZ
+        origin = R.mOrigin
+        direction = R.mDirection
+        tx = cx - origin.mX
+        ty = cy - origin.mY
+        tz = cz - origin.mZ
+        projDist = tx * direction.mX + ty * direction.mY + tz * direction.mZ
+        if projDist - self.mRadius >= tMax:
+            # Even the nearest point of the sphere along the ray is too far
+            return None
+
+        toCenterSq = tx * tx + ty * ty + tz * tz
+        closestDistSq = toCenterSq - projDist * projDist
+        if closestDistSq >= self.mRadiusSq:
+            return None
+        f = (self.mRadiusSq - closestDistSq) ** 0.5
+
+        if toCenterSq > self.mRadiusSq and projDist - f > 0:
+            t = projDist - f
+        elif toCenterSq <= self.mRadiusSq or projDist + f > 0:
+            t = projDist + f
         else:
-            # The Ray originates inside the sphere.
-            result.appendIntersection(projDist + f)
+            return None
 
-        return result
+        return t if t < tMax else None
+
+    def getHitResult(self, R, dist):
+        """
+        Builds the hit record of a closestHit winner
+        :param R: the Ray
+        :param dist: the distance closestHit returned
+        :return: a RayHitResult holding that one intersection
+        """
+
+        return makeRayHitResult(R, self, (dist,))
+
+    def occludes(self, R, maxDist):
+        """
+        Any-hit test for shadow rays, builds no RayHitResult
+        :param R: a Ray
+        :param maxDist: only hits at or closer than this count
+        :return: True if rayHit would report a distance no greater than maxDist
+        """
+
+        distances = self.hitDistances(R)
+        return bool(distances) and distances[0] <= maxDist
+
+    def rayHitBatch(self, origins, directions, parts=None):
+        """
+        Array version of rayHit
+        :param origins: (N, 3) array of ray origins
+        :param directions: (N, 3) array of normalized ray directions
+        :param parts: unused, see TriangleMesh.rayHitBatch
+        :return: (N,) array of the nearest hit distance along each ray, inf where it misses
+        """
+
+        toCenter = np.array(self.mCenter.mData) - origins
+        projDist = np.einsum("ij,ij->i", toCenter, directions)
+        toCenterSq = np.einsum("ij,ij->i", toCenter, toCenter)
+        closestDistSq = toCenterSq - projDist * projDist
+
+        hit = closestDistSq < self.mRadiusSq
+        f = np.sqrt(np.where(hit, self.mRadiusSq - closestDistSq, 0.0))
+
+        near = projDist - f
+        far = projDist + f
+        outside = toCenterSq > self.mRadiusSq
+
+        dist = np.where(outside & (near > 0), near, np.where(far > 0, far, np.inf))
+        return np.where(hit, dist, np.inf)
+
+    def getNormalBatch(self, points, directions=None, parts=None):
+        """
+        Array version of getNormal
+        :param points: (N, 3) array of points on the sphere
+        :param directions: unused, see AABB.getNormalBatch
+        :param parts: unused, see TriangleMesh.getNormalBatch
+        :return: (N, 3) array of normals
+        """
+
+        return (points - np.array(self.mCenter.mData)) / self.mRadius
 
 
 class Plane(object):
     def __init__(self, normal, dvalue, material):
-        self.mNormal = normal.normalized_copy()
+        self.mNormal = toVec3(normal).normalized_copy()
         self.mD = dvalue
         self.mMaterial = material
+        self.precompute()
 
-        self.mIsAABB = False
+    def precompute(self):
+        """
+        Caches what the intersection routines need from mNormal. Call again after changing it in place.
+        :return: None
+        """
+
+        self.mNormalXYZ = (self.mNormal.mX, self.mNormal.mY, self.mNormal.mZ)
 
     def pygameRender(self, surf, name=None, font=None):
         global drawThickness
@@ -158,43 +355,131 @@ class Plane(object):
 
         return self.mNormal
 
-    def rayHit(self, R):
-        den = R.mDirection.dot(self.mNormal)
+    def getBounds(self):
+        """
+        :return: None, planes are unbounded
+        """
+
+        return None
+
+    def hitDistance(self, R):
+        """
+        :param R: a Ray
+        :return: the distance along R to the plane, or None if it is parallel to R or behind it
+        """
+
+        nx, ny, nz = self.mNormalXYZ
+        direction = R.mDirection
+        den = direction.mX * nx + direction.mY * ny + direction.mZ * nz
         if den == 0.0:
             # Ray is parallel to plane.  No hit.
             return None
-        num = self.mD - R.mOrigin.dot(self.mNormal)
-        t = num / den
+        origin = R.mOrigin
+        t = (self.mD - (origin.mX * nx + origin.mY * ny + origin.mZ * nz)) / den
         if t < 0:
             # A "backwards" hit -- ignore
             return None
+        return t
+
+    def hitDistances(self, R):
+        """
+        :param R: a Ray
+        :return: tuple of the distance along R to the plane, empty for a miss
+        """
+
+        t = self.hitDistance(R)
+        return () if t is None else (t,)
+
+    def rayHit(self, R):
+        return makeRayHitResult(R, self, self.hitDistances(R))
+
+    def closestHit(self, R, tMax=math.inf):
+        """
+        Closest-hit test, see BVH.findClosestHit
+        :param R: a Ray
+        :param tMax: distance of the best hit found so far, only closer hits count
+        :return: the distance along R to the plane if closer than tMax, or None
+        """
+
+        t = self.hitDistance(R)
+        return t if t is not None and t < tMax else None
+
+    def getHitResult(self, R, dist):
+        """
+        Builds the hit record of a closestHit winner
+        :param R: the Ray
+        :param dist: the distance closestHit returned
+        :return: a RayHitResult holding that one intersection
+        """
+
         result = RayHitResult(R, self)
-        result.appendIntersection(t)
+        result.appendIntersection(dist, self.mNormal)
         return result
 
+    def occludes(self, R, maxDist):
+        """
+        Any-hit test for shadow rays, builds no RayHitResult
+        :param R: a Ray
+        :param maxDist: only hits at or closer than this count
+        :return: True if rayHit would report a distance no greater than maxDist
+        """
+
+        t = self.hitDistance(R)
+        return t is not None and t <= maxDist
+
+    def rayHitBatch(self, origins, directions, parts=None):
+        """
+        Array version of rayHit
+        :param origins: (N, 3) array of ray origins
+        :param directions: (N, 3) array of normalized ray directions
+        :param parts: unused, see TriangleMesh.rayHitBatch
+        :return: (N,) array of hit distances, inf where the ray is parallel or the plane is behind it
+        """
+
+        normal = np.array(self.mNormal.mData)
+        den = directions @ normal
+        num = self.mD - origins @ normal
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            t = num / den
+
+        return np.where((den != 0.0) & (t >= 0), t, np.inf)
+
+    def getNormalBatch(self, points, directions=None, parts=None):
+        """
+        Array version of getNormal
+        :param points: (N, 3) array of points on the plane
+        :param directions: unused, see AABB.getNormalBatch
+        :param parts: unused, see TriangleMesh.getNormalBatch
+        :return: (N, 3) array of normals
+        """
+
+        return np.broadcast_to(np.array(self.mNormal.mData), points.shape)
+
 
 class AABB(object):
     def __init__(self, ptA, ptB, material):
-        self.mMinPt = ptA.copy()
-        self.mMaxPt = ptB.copy()
-        for i in range(ptA.mDim):
+        self.mMinPt = toVec3(ptA)
+        self.mMaxPt = toVec3(ptB)
+        for i in range(3):
             if ptB[i] < self.mMinPt[i]:
                 self.mMinPt[i] = ptB[i]
             if ptA[i] > self.mMaxPt[i]:
                 self.mMaxPt[i] = ptA[i]
         self.mMaterial = material
-        normals = (math3d.VectorN((-1,0,0)), math3d.VectorN((1,0,0)), \
-                   math3d.VectorN((0,-1,0)), math3d.VectorN((0,1,0)), \
-                   math3d.VectorN((0,0,-1)), math3d.VectorN((0,0,1)))
-        self.mPlanes = []
-        for i in range(6):
-            if i % 2 == 0:
-                p = self.mMinPt
-            else:
-                p = self.mMaxPt
-            self.mPlanes.append(Plane(normals[i], normals[i].dot(p), material))
+        self.mFaceNormals = (Vec3(-1.0, 0.0, 0.0), Vec3(1.0, 0.0, 0.0), \
+                             Vec3(0.0, -1.0, 0.0), Vec3(0.0, 1.0, 0.0), \
+                             Vec3(0.0, 0.0, -1.0), Vec3(0.0, 0.0, 1.0))
+        self.precompute()
+
+    def precompute(self):
+        """
+        Caches what the intersection routines need from mMinPt and mMaxPt.
+        Call again after changing either in place.
+        :return: None
+        """
 
-        self.mIsAABB = True
+        self.mSlabs = ((self.mMinPt.mX, self.mMaxPt.mX), (self.mMinPt.mY, self.mMaxPt.mY), (self.mMinPt.mZ, self.mMaxPt.mZ))
 
     def pygameRender(self, surf, name=None, font=None):
         global drawThickness
@@ -210,63 +495,236 @@ class AABB(object):
     def getNormal(self, point):
         """
         Gets the normal at a point
-        The point is assumed to be on the box
+        The point is assumed to be on the box, the face whose plane it lies closest to is used
         :param point: Point (VectorN) on object to calculate the normal
         :return: a normalized VectorN
         """
 
-        if   point[0] <= self.mMinPt[0]:
-            return self.mPlanes[0].mNormal
-        elif point[0] >= self.mMaxPt[0]:
-            return self.mPlanes[1].mNormal
-        elif point[1] <= self.mMinPt[1]:
-            return self.mPlanes[2].mNormal
-        elif point[1] >= self.mMaxPt[1]:
-            return self.mPlanes[3].mNormal
-        elif point[2] <= self.mMinPt[2]:
-            return self.mPlanes[4].mNormal
-        else:
-            return self.mPlanes[5].mNormal
+        bestFace = 0
+        bestDist = abs(point[0] - self.mMinPt[0])
+        for i in range(1, 6):
+            bound = self.mMaxPt if i % 2 else self.mMinPt
+            dist = abs(point[i // 2] - bound[i // 2])
+            if dist < bestDist:
+                bestFace = i
+                bestDist = dist
+
+        return self.mFaceNormals[bestFace]
+
+    def getBounds(self):
+        """
+        :return: (minPt, maxPt) of the box itself
+        """
+
+        return self.mMinPt, self.mMaxPt
+
+    def slabTest(self, R, maxDist=math.inf):
+        """
+        Slab test: intersect the ray with the three pairs of parallel planes and keep the
+        overlap of the three [entry, exit] intervals.
+        :param R: a Ray
+        :param maxDist: gives up as soon as the entry is known to be further than this
+        :return: (tNear, tFar, nearFace, farFace) with faces indexing mFaceNormals, or None for a miss
+        """
+
+        tNear = -math.inf
+        tFar = math.inf
+        nearFace = farFace = 0
+        origin = R.mOrigin
+        direction = R.mDirection
+        axis = 0
+
+        for o, d, (lo, hi) in zip((origin.mX, origin.mY, origin.mZ), (direction.mX, direction.mY, direction.mZ), self.mSlabs):
+            if d == 0.0:
+                # Parallel to this slab, either always inside it or never
+                if o < lo or o > hi:
+                    return None
+                axis += 1
+                continue
+
+            invDir = 1.0 / d
+            # Entering through the min face when travelling in +axis, the max face otherwise
+            if invDir >= 0:
+                t1 = (lo - o) * invDir
+                t2 = (hi - o) * invDir
+                entryFace = 2 * axis
+            else:
+                t1 = (hi - o) * invDir
+                t2 = (lo - o) * invDir
+                entryFace = 2 * axis + 1
+
+            if t1 > tNear:
+                tNear = t1
+                nearFace = entryFace
+            if t2 < tFar:
+                tFar = t2
+                farFace = entryFace ^ 1
+
+            if tNear > tFar or tFar < 0 or tNear > maxDist:
+                return None
+            axis += 1
+
+        return tNear, tFar, nearFace, farFace
+
+    def hitDistances(self, R):
+        """
+        :param R: a Ray
+        :return: tuple of the entry (if in front of the ray) and exit distances along R, empty for a miss
+        """
+
+        slab = self.slabTest(R)
+        if slab is None:
+            return ()
+        tNear, tFar, nearFace, farFace = slab
+        return (tNear, tFar) if tNear >= 0 else (tFar,)
 
     def rayHit(self, R):
-        hitDistances = []
-        for i in range(6):
-            planeResult = self.mPlanes[i].rayHit(R)
-            if planeResult:
-                # We hit that bounding plane.  Now see if we hit within the boundaries
-                # of the plane.  Hint: if we hit a PLANE, we have exactly one hit (and
-                # so one thing in result.mIntersectionDistances
-                currentDimension = i // 2
-                inBounds = True
-                hitPoint = planeResult.mIntersectionPoints[0]
-                hitDist = planeResult.mIntersectionDistances[0]
-                for j in range(3):
-                    if j == currentDimension:
-                        continue
-                    if hitPoint[j] < self.mMinPt[j] or hitPoint[j] > self.mMaxPt[j]:
-                        inBounds = False
-                        break
-                if inBounds:
-                    hitDistances.append(hitDist)
-        # If hitDistances is empty, no hit.
-        if len(hitDistances) == 0:
-            result = None
-        else:
-            result = RayHitResult(R, self)
-            for t in hitDistances:
-                result.appendIntersection(t)
+        """
+        :param R: a Ray
+        :return: a RayHitResult holding the entry (if in front of the ray) and exit hits, or None
+        """
+
+        slab = self.slabTest(R)
+        if slab is None:
+            return None
+        tNear, tFar, nearFace, farFace = slab
+
+        result = RayHitResult(R, self)
+        if tNear >= 0:
+            result.appendIntersection(tNear, self.mFaceNormals[nearFace])
+        result.appendIntersection(tFar, self.mFaceNormals[farFace])
+        return result
+
+    def closestHit(self, R, tMax=math.inf):
+        """
+        Closest-hit test, see BVH.findClosestHit. The slab test stops as soon as the entry is beyond tMax.
+        :param R: a Ray
+        :param tMax: distance of the best hit found so far, only closer hits count
+        :return: the distance along R to the entry (or exit, from inside) if closer than tMax, or None
+        """
+
+        slab = self.slabTest(R, tMax)
+        if slab is None:
+            return None
+        tNear, tFar, nearFace, farFace = slab
+        t = tNear if tNear >= 0 else tFar
+        return t if t < tMax else None
+
+    def getHitResult(self, R, dist):
+        """
+        Builds the hit record of a closestHit winner, with the normal of the face the slab test crossed
+        :param R: the Ray
+        :param dist: the distance closestHit returned
+        :return: a RayHitResult holding that one intersection
+        """
+
+        tNear, tFar, nearFace, farFace = self.slabTest(R)
+        result = RayHitResult(R, self)
+        result.appendIntersection(dist, self.mFaceNormals[nearFace if dist == tNear else farFace])
         return result
 
+    def occludes(self, R, maxDist):
+        """
+        Any-hit test for shadow rays, the slab test without building a RayHitResult
+        :param R: a Ray
+        :param maxDist: only hits at or closer than this count
+        :return: True if rayHit would report a distance no greater than maxDist
+        """
+
+        slab = self.slabTest(R, maxDist)
+        if slab is None:
+            return False
+        tNear, tFar, nearFace, farFace = slab
+        return (tNear if tNear >= 0 else tFar) <= maxDist
+
+    def rayHitBatch(self, origins, directions, parts=None):
+        """
+        Array version of rayHit, using the slab test
+        :param origins: (N, 3) array of ray origins
+        :param directions: (N, 3) array of normalized ray directions
+        :param parts: unused, see TriangleMesh.rayHitBatch
+        :return: (N,) array of the nearest hit distance along each ray, inf where it misses
+        """
+
+        minPt = np.array(self.mMinPt.mData)
+        maxPt = np.array(self.mMaxPt.mData)
+
+        # A ray parallel to a slab is always inside it or never, even when it starts on one of the
+        # slab's planes (where dividing would give 0 * inf = NaN)
+        parallel = directions == 0
+        outside = parallel & ((origins < minPt) | (origins > maxPt))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            invDir = 1.0 / directions
+            t1 = (minPt - origins) * invDir
+            t2 = (maxPt - origins) * invDir
+
+        tNear = np.where(parallel, -np.inf, np.minimum(t1, t2)).max(axis=1)
+        tFar = np.where(parallel, np.inf, np.maximum(t1, t2)).min(axis=1)
+
+        hit = (tNear <= tFar) & (tFar >= 0) & ~outside.any(axis=1)
+        return np.where(hit, np.where(tNear >= 0, tNear, tFar), np.inf)
+
+    def getNormalBatch(self, points, directions=None, parts=None):
+        """
+        Array version of getNormal, picks the face whose plane each point lies closest to
+        :param points: (N, 3) array of points on the box
+        :param directions: optional (N, 3) array of the directions of the rays that hit the points. Then the
+                           face is the one the slab test crosses, as in getHitResult, so points on an edge get
+                           the same normal as on the one ray at a time path
+        :param parts: unused, see TriangleMesh.getNormalBatch
+        :return: (N, 3) array of normals
+        """
+
+        minPt = np.array(self.mMinPt.mData)
+        maxPt = np.array(self.mMaxPt.mData)
+        rows = np.arange(len(points))
+        normals = np.zeros(points.shape)
+
+        if directions is None:
+            faceDist = np.abs(np.stack((points - minPt, points - maxPt), axis=2)).reshape(len(points), 6)
+            face = np.argmin(faceDist, axis=1)
+            normals[rows, face // 2] = np.where(face % 2 == 0, -1.0, 1.0)
+            return normals
+
+        # Slab distances measured from the hit point, the entry face is the latest one crossed going in
+        # and the exit face the first one crossed going out, whichever the point lies on
+        parallel = directions == 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            invDir = 1.0 / directions
+            t1 = (minPt - points) * invDir
+            t2 = (maxPt - points) * invDir
+        tEntry = np.where(parallel, -np.inf, np.minimum(t1, t2))
+        tExit = np.where(parallel, np.inf, np.maximum(t1, t2))
+
+        entryAxis = np.argmax(tEntry, axis=1)
+        exitAxis = np.argmin(tExit, axis=1)
+        isEntry = np.abs(tEntry[rows, entryAxis]) <= np.abs(tExit[rows, exitAxis])
+        axis = np.where(isEntry, entryAxis, exitAxis)
+
+        sign = np.sign(directions[rows, axis])
+        normals[rows, axis] = np.where(isEntry, -sign, sign)
+        return normals
+
 
 class CylinderY(object):
     def __init__(self, basePos, height, radius, material):
-        self.mBase = basePos
+        self.mBase = toVec3(basePos)
         self.mHeight = height
         self.mRadius = radius
-        self.mRadiusSq = radius ** 2
         self.mMaterial = material
+        self.precompute()
 
-        self.mIsAABB = False
+    def precompute(self):
+        """
+        Caches what the intersection routines need from mBase, mHeight and mRadius, the cap
+        heights standing in for the two cap planes. Call again after changing any of them in place.
+        :return: None
+        """
+
+        self.mBaseXZ = (self.mBase.mX, self.mBase.mZ)
+        self.mBaseY = self.mBase.mY
+        self.mTopY = self.mBase.mY + self.mHeight
+        self.mRadiusSq = self.mRadius ** 2
 
     def pygameRender(self, surf, name=None, font=None):
         color = self.mMaterial.getPygameColor()
@@ -286,101 +744,285 @@ class CylinderY(object):
 
         if point[1] <= self.mBase[1]:
             # The point is on the bottom plane
-            return VectorN((0, -1, 0))
+            return Vec3(0.0, -1.0, 0.0)
 
         elif point[1] >= self.mBase[1] + self.mHeight:
             # The point is on the top plane
-            return VectorN((0, 1, 0))
+            return Vec3(0.0, 1.0, 0.0)
 
         else:
             # The point is now assumed to be on the cylindrical portion
-            return (point - VectorN((self.mBase[0], point[1], self.mBase[2]))) / self.mRadius
+            return Vec3((point[0] - self.mBase.mX) / self.mRadius, 0.0, (point[2] - self.mBase.mZ) / self.mRadius)
 
-    def rayHit(self, R):
-        Ox = R.mOrigin[0]
-        Oz = R.mOrigin[2]
-        Dx = R.mDirection[0]
-        Dz = R.mDirection[2]
-        Bx = self.mBase[0]
-        Bz = self.mBase[2]
+    def getBounds(self):
+        """
+        :return: (minPt, maxPt) of the box enclosing the cylinder
+        """
+
+        minPt = Vec3(self.mBase.mX - self.mRadius, self.mBase.mY, self.mBase.mZ - self.mRadius)
+        maxPt = Vec3(self.mBase.mX + self.mRadius, self.mBase.mY + self.mHeight, self.mBase.mZ + self.mRadius)
+        return minPt, maxPt
+
+    def hitDistances(self, R, maxDist=math.inf, anyHit=False):
+        """
+        Tests the sides and then both caps, working relative to the base so no points are built
+        :param R: a Ray
+        :param maxDist: only hits at or closer than this count
+        :param anyHit: if True, return as soon as one hit is found
+        :return: tuple of the distances along R to the intersections in front of it, empty for a miss
+        """
+
+        Bx, Bz = self.mBaseXZ
+        origin = R.mOrigin
+        direction = R.mDirection
+        Ox = origin.mX - Bx
+        Oy = origin.mY
+        Oz = origin.mZ - Bz
+        Dx = direction.mX
+        Dy = direction.mY
+        Dz = direction.mZ
+        baseY = self.mBaseY
+        topY = self.mTopY
         epsilon = 0.0001
 
         # Check the sides of the cylinder
-        a = Dx ** 2 + Dz ** 2
-        b = 2 * (-Bx * Dx - Bz * Dz + Ox * Dx + Oz * Dz)
-        c = -2 * Bx * Ox - 2 * Bz * Oz + Bx ** 2 + Bz ** 2 + Ox ** 2 + Oz ** 2 - self.mRadiusSq
-        inner = b ** 2 - 4 * a * c
+        a = Dx * Dx + Dz * Dz
+        b = 2 * (Ox * Dx + Oz * Dz)
+        c = Ox * Ox + Oz * Oz - self.mRadiusSq
+        inner = b * b - 4 * a * c
         den = 2 * a
         if inner < 0 or den < epsilon:
-            return None
+            return ()
 
         inner **= 0.5
-
-        root1 = (-b + inner) / den
-        root2 = (-b - inner) / den
-        result = RayHitResult(R, self)
-        oneHit = False
-        if root1 > 0:
-            P1 = R.getPoint(root1)
-            if P1[1] >= self.mBase[1] - epsilon and P1[1] <= self.mBase[1] + self.mHeight + epsilon:
-                oneHit = True
-                result.appendIntersection(root1)
-        if root2 > 0:
-            P2 = R.getPoint(root2)
-            if P2[1] >= self.mBase[1] - epsilon and P2[1] <= self.mBase[1] + self.mHeight + epsilon:
-                oneHit = True
-                result.appendIntersection(root2)
+        hits = ()
+        for root in ((-b + inner) / den, (-b - inner) / den):
+            if 0 < root <= maxDist and baseY - epsilon <= Oy + root * Dy <= topY + epsilon:
+                hits += (root,)
+                if anyHit:
+                    return hits
 
         # Now check the top / bottom of the cylinder
-        planeT = Plane(math3d.VectorN((0,1,0)), self.mBase[1] + self.mHeight, self.mMaterial)
-        planeB = Plane(math3d.VectorN((0,-1,0)), -self.mBase[1], self.mMaterial)
-        resultT = planeT.rayHit(R)
-        if resultT:
-            P = resultT.mIntersectionPoints[0]
-            if (P[0] - Bx) ** 2 + (P[2] - Bz) ** 2 < self.mRadiusSq:
-                result.appendIntersection(resultT.mIntersectionDistances[0])
-                oneHit = True
-        resultB = planeB.rayHit(R)
-        if resultB:
-            P = resultB.mIntersectionPoints[0]
-            if (P[0] - Bx) ** 2 + (P[2] - Bz) ** 2 < self.mRadiusSq:
-                result.appendIntersection(resultB.mIntersectionDistances[0])
-                oneHit = True
-
-        if oneHit:
-            return result
-        else:
+        if Dy != 0.0:
+            for capY in (topY, baseY):
+                t = (capY - Oy) / Dy
+                if 0 <= t <= maxDist:
+                    Px = Ox + t * Dx
+                    Pz = Oz + t * Dz
+                    if Px * Px + Pz * Pz < self.mRadiusSq:
+                        hits += (t,)
+                        if anyHit:
+                            return hits
+
+        return hits
+
+    def rayHit(self, R):
+        return makeRayHitResult(R, self, self.hitDistances(R))
+
+    def closestHit(self, R, tMax=math.inf):
+        """
+        Closest-hit test, see BVH.findClosestHit
+        :param R: a Ray
+        :param tMax: distance of the best hit found so far, only closer hits count
+        :return: the distance along R to the nearest side or cap intersection closer than tMax, or None
+        """
+
+        hits = self.hitDistances(R, tMax)
+        if not hits:
             return None
+        t = min(hits)
+        return t if t < tMax else None
+
+    def getHitResult(self, R, dist):
+        """
+        Builds the hit record of a closestHit winner
+        :param R: the Ray
+        :param dist: the distance closestHit returned
+        :return: a RayHitResult holding that one intersection
+        """
+
+        return makeRayHitResult(R, self, (dist,))
+
+    def occludes(self, R, maxDist):
+        """
+        Any-hit test for shadow rays, returns at the first side or cap hit found without building a RayHitResult
+        :param R: a Ray
+        :param maxDist: only hits at or closer than this count
+        :return: True if rayHit would report a distance no greater than maxDist
+        """
+
+        return bool(self.hitDistances(R, maxDist, True))
+
+    def rayHitBatch(self, origins, directions, parts=None):
+        """
+        Array version of rayHit, checking the sides and both caps
+        :param origins: (N, 3) array of ray origins
+        :param directions: (N, 3) array of normalized ray directions
+        :param parts: unused, see TriangleMesh.rayHitBatch
+        :return: (N,) array of the nearest hit distance along each ray, inf where it misses
+        """
+
+        epsilon = 0.0001
+        baseY = self.mBase[1]
+        topY = baseY + self.mHeight
+
+        Ox = origins[:, 0] - self.mBase[0]
+        Oz = origins[:, 2] - self.mBase[2]
+        Dx = directions[:, 0]
+        Dz = directions[:, 2]
+
+        a = Dx * Dx + Dz * Dz
+        b = 2 * (Ox * Dx + Oz * Dz)
+        c = Ox * Ox + Oz * Oz - self.mRadiusSq
+        inner = b * b - 4 * a * c
+        den = 2 * a
+        valid = (inner >= 0) & (den >= epsilon)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            root = np.sqrt(np.where(valid, inner, 0.0))
+            dist = np.full(len(origins), np.inf)
+
+            for t in ((-b + root) / den, (-b - root) / den):
+                y = origins[:, 1] + t * directions[:, 1]
+                ok = valid & (t > 0) & (y >= baseY - epsilon) & (y <= topY + epsilon)
+                dist = np.where(ok & (t < dist), t, dist)
+
+            for capY in (topY, baseY):
+                t = (capY - origins[:, 1]) / directions[:, 1]
+                Px = Ox + t * Dx
+                Pz = Oz + t * Dz
+                ok = valid & (directions[:, 1] != 0.0) & (t >= 0) & (Px * Px + Pz * Pz < self.mRadiusSq)
+                dist = np.where(ok & (t < dist), t, dist)
+
+        return dist
+
+    def getNormalBatch(self, points, directions=None, parts=None):
+        """
+        Array version of getNormal
+        :param points: (N, 3) array of points on the cylinder
+        :param directions: unused, see AABB.getNormalBatch
+        :param parts: unused, see TriangleMesh.getNormalBatch
+        :return: (N, 3) array of normals
+        """
+
+        baseY = self.mBase[1]
+        normals = np.zeros(points.shape)
+        normals[:, 0] = (points[:, 0] - self.mBase[0]) / self.mRadius
+        normals[:, 2] = (points[:, 2] - self.mBase[2]) / self.mRadius
+
+        bottom = points[:, 1] <= baseY
+        top = points[:, 1] >= baseY + self.mHeight
+        normals[bottom | top] = 0.0
+        normals[bottom, 1] = -1.0
+        normals[top, 1] = 1.0
+        return normals
 
 
 class Light(object):
 
-    def __init__(self, pos, diffuse, specular):
+    def __init__(self, pos, diffuse, specular, range=None):
         """
         This is the constructor for the point-light class
         :param pos: Position of the light
+        :param range: if given, the light fades out smoothly to nothing at this distance, see getAttenuation
         :return: N/A
         """
 
-        self.mPos = pos.copy()
-        self.mDiffuse = diffuse
-        self.mSpecular = specular
+        self.mPos = toVec3(pos)
+        self.mDiffuse = toVec3(diffuse)
+        self.mSpecular = toVec3(specular)
+        self.mRange = range
+
+
+    def getAttenuation(self, dist2):
+        """
+        Range falloff, (1 - (dist / mRange)^2)^2, which is 1 at the light and reaches 0 at mRange
+        :param dist2: squared distance from the light
+        :return: a float, FULL_INTENSITY if the light has no range
+        """
+
+        if self.mRange is None:
+            return FULL_INTENSITY
+
+        falloff = 1 - dist2 / (self.mRange * self.mRange)
+        return falloff * falloff if falloff > 0 else NO_INTENSITY
+
+    def getAttenuationBatch(self, dist2):
+        """
+        Array version of getAttenuation
+        :param dist2: (N,) array of squared distances from the light
+        :return: (N,) array of floats
+        """
+
+        if self.mRange is None:
+            return np.full(len(dist2), FULL_INTENSITY)
 
+        falloff = 1 - dist2 / (self.mRange * self.mRange)
+        return np.where(falloff > 0, falloff * falloff, NO_INTENSITY)
 
     def getIntensity(self, point):
         """
-        This will be inherited and modified, for now just returns VectorN((1,1,1))
-        :param point:
-        :return:
+        How strongly the light reaches point, before shadows
+        :param point: a Vec3
+        :return: a float, NO_INTENSITY if the light can't reach it at all
         """
 
-        return FULL_INTENSITY
+        if self.mRange is None:
+            return FULL_INTENSITY
+        return self.getAttenuation((point - self.mPos).magnitudeSquared())
+
+    def getIntensityBatch(self, points):
+        """
+        Array version of getIntensity
+        :param points: (N, 3) array of points
+        :return: (N,) array of intensities
+        """
+
+        if self.mRange is None:
+            return np.full(len(points), FULL_INTENSITY)
+
+        toPointVector = points - np.array(self.mPos.mData)
+        return self.getAttenuationBatch(np.einsum("ij,ij->i", toPointVector, toPointVector))
+
+    def getBounds(self):
+        """
+        :return: (minPt, maxPt) of a box holding every point getIntensity can be above zero at,
+                 or None if the light reaches everywhere
+        """
+
+        if self.mRange is None:
+            return None
+
+        extent = Vec3(self.mRange, self.mRange, self.mRange)
+        return self.mPos - extent, self.mPos + extent
+
+    def getInfluenceKey(self):
+        """
+        :return: a tuple that changes whenever getBounds would, see LightIndex
+        """
+
+        return self.mPos.mX, self.mPos.mY, self.mPos.mZ, self.mRange
 
 
 class Spotlight(Light):
 
-    def __init__(self, pos, diffuse, specular, innerAngle, outerAngle, direction, isNormalized=False):
-        Light.__init__(self, pos, diffuse, specular)
+    def __init__(self, pos, diffuse, specular, innerAngle, outerAngle, direction, isNormalized=False, range=None):
+        Light.__init__(self, pos, diffuse, specular, range)
+
+        self.setAngles(innerAngle, outerAngle)
+
+        if isNormalized:
+            self.mDirection = toVec3(direction)
+        else:
+            self.mDirection = toVec3(direction).normalized_copy()
+
+    def setAngles(self, innerAngle, outerAngle):
+        """
+        Changes the cone, in degrees across. Full intensity inside innerAngle, fading out to outerAngle.
+        :param innerAngle: angle of the fully lit cone
+        :param outerAngle: angle of the cone outside which nothing is lit
+        :return: None
+        """
 
         self.mInnerAngle = min(innerAngle, 179.99)
         self.mInnerHalfAngle = self.mInnerAngle/2
@@ -394,11 +1036,6 @@ class Spotlight(Light):
 
         self.mTangent2Difference = self.mOuterHalfAngleTangent2 - self.mInnerHalfAngleTangent2
 
-        if isNormalized:
-            self.mDirection = direction
-        else:
-            self.mDirection = direction.normalized_copy()
-
 
     def getIntensity(self, point):
 
@@ -417,9 +1054,67 @@ class Spotlight(Light):
             toPointTangent2 = toPointPerp2 / toPointParallel2
 
             if toPointTangent2 <= self.mInnerHalfAngleTangent2:
-                return FULL_INTENSITY
+                intensity = FULL_INTENSITY
             elif toPointTangent2 <= self.mOuterHalfAngleTangent2:
-                return 1 - (toPointTangent2 - self.mInnerHalfAngleTangent2)/self.mTangent2Difference
+                intensity = 1 - (toPointTangent2 - self.mInnerHalfAngleTangent2)/self.mTangent2Difference
             else:
                 return NO_INTENSITY
 
+            if self.mRange is None:
+                return intensity
+            return intensity * self.getAttenuation(toPointDist2)
+
+        return NO_INTENSITY
+
+    def getIntensityBatch(self, points):
+        """
+        Array version of getIntensity, points behind the light get NO_INTENSITY
+        :param points: (N, 3) array of points
+        :return: (N,) array of intensities
+        """
+
+        toPointVector = points - np.array(self.mPos.mData)
+        toPointParallel = toPointVector @ np.array(self.mDirection.mData)
+        toPointParallel2 = np.where(toPointParallel > 0, toPointParallel ** 2, 1.0)
+        toPointDist2 = np.einsum("ij,ij->i", toPointVector, toPointVector)
+        toPointTangent2 = (toPointDist2 - toPointParallel2) / toPointParallel2
+
+        falloff = 1 - (toPointTangent2 - self.mInnerHalfAngleTangent2) / self.mTangent2Difference
+        intensity = np.where(toPointTangent2 <= self.mInnerHalfAngleTangent2, FULL_INTENSITY,
+                             np.where(toPointTangent2 <= self.mOuterHalfAngleTangent2, falloff, NO_INTENSITY))
+
+        if self.mRange is not None:
+            intensity = intensity * self.getAttenuationBatch(toPointDist2)
+
+        return np.where(toPointParallel > 0, intensity, NO_INTENSITY)
+
+    def getBounds(self):
+        """
+        The box holding the lit part of the cone: no further than mRange from the light, and inside
+        the cone cut off at mRange along mDirection, whose far end is a disk
+        :return: (minPt, maxPt), or None if the light has no range
+        """
+
+        if self.mRange is None:
+            return None
+
+        pos = self.mPos.mData
+        direction = self.mDirection.mData
+        diskRadius = self.mRange * self.mOuterHalfAngleTangent
+
+        minPt = Vec3()
+        maxPt = Vec3()
+        for axis in range(3):
+            diskCenter = pos[axis] + direction[axis] * self.mRange
+            diskExtent = diskRadius * max(0.0, 1 - direction[axis] ** 2) ** 0.5
+            minPt[axis] = max(min(pos[axis], diskCenter - diskExtent), pos[axis] - self.mRange)
+            maxPt[axis] = min(max(pos[axis], diskCenter + diskExtent), pos[axis] + self.mRange)
+
+        return minPt, maxPt
+
+    def getInfluenceKey(self):
+        """
+        :return: a tuple that changes whenever getBounds would, see LightIndex
+        """
+
+        return Light.getInfluenceKey(self) + (self.mDirection.mX, self.mDirection.mY, self.mDirection.mZ, self.mOuterAngle)
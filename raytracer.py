@@ -1,6 +1,109 @@
-import pygame, math, threading
-from math3d import VectorN
+import pygame, math, threading, os, sys
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from math3d import VectorN, Vec3, toVec3
 from objects3d import *
+from bvh import BVH
+from stats import RenderStats, CountedObject
+from shading import SceneSnapshot, TraceContext
+from framebuffer import FrameBuffer, TONE_MAPS
+from gbuffer import GBuffer, GBufferLayer
+
+
+class ObjectList(list):
+    """
+    A list that bumps mVersion whenever it is changed, so the Raytracer knows when to rebuild its BVH
+    """
+
+    def __init__(self, *args):
+        list.__init__(self, *args)
+        self.mVersion = 0
+
+    def __setitem__(self, key, value):
+        list.__setitem__(self, key, value)
+        self.mVersion += 1
+
+    def __delitem__(self, key):
+        list.__delitem__(self, key)
+        self.mVersion += 1
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def append(self, item):
+        list.append(self, item)
+        self.mVersion += 1
+
+    def extend(self, items):
+        list.extend(self, items)
+        self.mVersion += 1
+
+    def insert(self, index, item):
+        list.insert(self, index, item)
+        self.mVersion += 1
+
+    def remove(self, item):
+        list.remove(self, item)
+        self.mVersion += 1
+
+    def pop(self, index=-1):
+        item = list.pop(self, index)
+        self.mVersion += 1
+        return item
+
+    def clear(self):
+        list.clear(self)
+        self.mVersion += 1
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self.mVersion += 1
+
+    def reverse(self):
+        list.reverse(self)
+        self.mVersion += 1
+
+
+# The Raytracer each render worker process received when it started, see renderParallel
+_workerRaytracer = None
+
+
+def _initRenderWorker(raytracer):
+    global _workerRaytracer
+    _workerRaytracer = raytracer
+    _workerRaytracer.getBVH()
+
+
+def _renderTileInWorker(tile):
+    return tile, _workerRaytracer.renderTile(*tile)
+
+
+def findEdgePixels(colors, threshold):
+    """
+    Finds the pixels that differ from the neighbour to their right or below by more than threshold. Only the
+    left or upper pixel of each such pair is marked, so an edge is supersampled once rather than from both sides.
+    A change of object between two pixels only counts when it shows in their colors.
+    :param colors: (height, width, 3) array of displayed colors, 0-1
+    :param threshold: pairs whose colors differ by more than this in any channel count as an edge
+    :return: (height, width) boolean array
+    """
+
+    edges = np.zeros(colors.shape[:2], dtype=bool)
+    edges[:, :-1] |= np.abs(colors[:, 1:] - colors[:, :-1]).max(axis=2) > threshold
+    edges[:-1] |= np.abs(colors[1:] - colors[:-1]).max(axis=2) > threshold
+    return edges
+
+
+def isGILEnabled():
+    """
+    :return: False only on a free-threaded CPython build running with the GIL off. Note that importing
+             an extension module that isn't marked free-threading safe turns the GIL back on.
+    """
+
+    isEnabled = getattr(sys, "_is_gil_enabled", None)
+    return isEnabled is None or isEnabled()
+
 
 class Raytracer(object):
 
@@ -12,34 +115,60 @@ class Raytracer(object):
         """
 
         self.mRenderSurface = renderSurface
-        self.mObjects = []
+        self.mObjects = ObjectList()
         self.mLights = []
         self.mBGColor = bgColor
-        self.mSceneAmbient = sceneAmbient
+        self.mSceneAmbient = toVec3(sceneAmbient)
+
+        # Acceleration structure over mObjects, rebuilt by getBVH when the list changes
+        self.mBVH = None
+        self.mUnboundedObjects = []
+        self.mBVHSource = None
+        # Indices into mObjects of the BVH's objects and of mUnboundedObjects, for the packet tracer
+        self.mBVHObjectIndices = np.zeros(0, dtype=int)
+        self.mUnboundedObjectIndices = []
+        self.mBVHVersion = -1
+
+        # The scene file mObjects was loaded from, see scenefile.py, and the list and version it gave
+        self.mSceneFile = None
+        self.mSceneFileSource = None
+        self.mSceneFileVersion = -1
+
+        # What the trace and shade path reads, and the TraceContext over it used from this thread
+        self.mSnapshot = None
+        self.mTraceContext = None
 
+        # RenderStats while enableStats is in effect, None otherwise
+        self.mStats = None
 
         # Pygame Screen Variables
         self.mPyWidth, self.mPyHeight = self.mRenderSurface.get_size()
 
         self.mPyAspectRatio = self.mPyWidth / self.mPyHeight
 
+        # Float colors are traced into this, and only tone mapped onto the surface in bulk
+        self.mFrameBuffer = FrameBuffer(self.mPyWidth, self.mPyHeight)
+
+        # What the last renderFrame traced, reused by relight
+        self.mGBuffer = None
+
 
         # Camera Variables
-        self.mCamX = VectorN((1, 0, 0))
-        self.mCamY = VectorN((0, 1, 0))
-        self.mCamZ = VectorN((0, 0, 1))
+        self.mCamX = Vec3(1.0, 0.0, 0.0)
+        self.mCamY = Vec3(0.0, 1.0, 0.0)
+        self.mCamZ = Vec3(0.0, 0.0, 1.0)
 
-        self.mCamPos = VectorN(3)
+        self.mCamPos = Vec3()
 
         self.mCamFOV = 45
         self.mCamNear = 1.0
-        self.mCamCOI = VectorN(3)
+        self.mCamCOI = Vec3()
 
-        self.mCamUp = VectorN((0, 1, 0))
+        self.mCamUp = Vec3(0.0, 1.0, 0.0)
 
 
         # Virtual ViewPlane Variables
-        self.mViewOrigin = VectorN(3)
+        self.mViewOrigin = Vec3()
 
         self.mViewHeight = self.mPyHeight + 0
         self.mHalfViewHeight = self.mViewHeight/2
@@ -50,7 +179,8 @@ class Raytracer(object):
         self.mVirtualPyWidthRatio = self.mViewWidth / self.mPyWidth
         self.mVirtualPyHeightRatio = self.mViewHeight / self.mPyHeight
 
-        self.mFinalLightComponent = VectorN(3)
+        # Reflection bounces stop once they would add less than this to a color channel (1/255 is one 8 bit step)
+        self.mMinContribution = 1 / 255
 
 
         #Tween variables, these are mostly offsets
@@ -60,9 +190,9 @@ class Raytracer(object):
         self.mCurTweenFrame = 0
         self.mNumTweenFrames = 0
 
-        self.mTweenCamPos = VectorN(3)
-        self.mTweenCamCOI = VectorN(3)
-        self.mTweenCamUp = VectorN(3)
+        self.mTweenCamPos = Vec3()
+        self.mTweenCamCOI = Vec3()
+        self.mTweenCamUp = Vec3()
         self.mTweenCamFOV = 0
         self.mTweenCamNear = 0
 
@@ -80,14 +210,14 @@ class Raytracer(object):
         :return: None
         """
 
-        self.mCamPos = camPos
+        self.mCamPos = toVec3(camPos)
         self.mCamFOV = camFOV
         self.mCamNear = camNear
-        self.mCamCOI = camCOI
+        self.mCamCOI = toVec3(camCOI)
 
         self.mCamZ = (self.mCamCOI - self.mCamPos).normalized_copy()
 
-        self.mCamX = camUp.cross(self.mCamZ).normalized_copy()
+        self.mCamX = toVec3(camUp).cross(self.mCamZ).normalized_copy()
         self.mCamY = self.mCamZ.cross(self.mCamX).normalized_copy()
 
         self.mHalfViewHeight = math.tan(math.radians(self.mCamFOV/2)) * self.mCamNear
@@ -124,13 +254,13 @@ class Raytracer(object):
         self.mNumTweenFrames = numFrames
 
         if camPos:
-            self.mTweenCamPos = camPos - self.mCamPos
+            self.mTweenCamPos = toVec3(camPos) - self.mCamPos
 
         if camCOI:
-            self.mTweenCamCOI = camCOI - self.mCamCOI
+            self.mTweenCamCOI = toVec3(camCOI) - self.mCamCOI
 
         if camUP:
-            self.mTweenCamUp = camUP - self.mCamUp
+            self.mTweenCamUp = toVec3(camUP) - self.mCamUp
 
         if camFOV:
             self.mTweenCamFOV = camFOV - self.mCamFOV
@@ -175,8 +305,10 @@ class Raytracer(object):
         cosAngle = math.cos(angle)
         sinAngle = math.sin(angle)
 
-        self.mCamPos[0] = self.mCamPos[0]*cosAngle - self.mCamPos[2]*sinAngle
-        self.mCamPos[2] = self.mCamPos[0]*sinAngle + self.mCamPos[2]*cosAngle
+        x = self.mCamPos[0]
+        z = self.mCamPos[2]
+        self.mCamPos[0] = x*cosAngle - z*sinAngle
+        self.mCamPos[2] = x*sinAngle + z*cosAngle
 
         self.setCamera(self.mCamPos, self.mCamCOI, self.mCamUp, self.mCamFOV, self.mCamNear)
 
@@ -186,7 +318,7 @@ class Raytracer(object):
         This function contverts a pygame pixel position (ix, iy) into a Virtual View Plane Position
         :param ix: the X Position of the point
         :param iy: the Y Position of the point
-        :return: a 3D VectorN, representing the world space position of the 2D input point.
+        :return: a Vec3, representing the world space position of the 2D input point.
         """
 
         virtualPixel = self.mViewOrigin \
@@ -196,157 +328,927 @@ class Raytracer(object):
         return virtualPixel
 
 
-    def rayCast(self, ray, isShadow=False, light=None):
+    def setRenderSurface(self, renderSurface):
         """
-        This casts ray into the world, testing it on every object in the mObjects list
-        :param ray:
-        :return:
+        Points the raytracer at another surface of the same size, e.g. in a worker process where the
+        pickled raytracer arrived without one
+        :param renderSurface: a pygame.Surface object
+        :return: None
         """
 
-        if light:
-            lightDist2 = (light.mPos - ray.mOrigin).magnitudeSquared()
+        if renderSurface.get_size() != (self.mPyWidth, self.mPyHeight):
+            raise ValueError("render surface must be %dx%d" % (self.mPyWidth, self.mPyHeight))
 
-        resultList = []
+        self.mRenderSurface = renderSurface
 
-        # First create the list
-        for Object in self.mObjects:
-            result = Object.rayHit(ray)
 
-            if result:
-                if isShadow and light:
-                    for distance in result.mIntersectionDistances:
-                        if distance*distance <= lightDist2:
-                            return result
-                else:
-                    resultList.append(result)
+    def getCameraKey(self):
+        """
+        :return: a tuple that changes whenever the camera does, to tell whether cached traces still apply
+        """
 
+        return self.mCamPos.mData, self.mViewOrigin.mData, self.mCamX.mData, self.mCamY.mData, \
+               self.mVirtualPyWidthRatio, self.mVirtualPyHeightRatio
 
-        # Next find the smallest distance, assuming there were results
-        if len(resultList) == 0 or len(resultList[-1].mIntersectionDistances) == 0:
-            return None
 
-        # If is light got this far, it should return None.
-        if isShadow and light:
+    def getBVH(self):
+        """
+        Returns the BVH over the bounded objects in mObjects, rebuilding it if the list has changed.
+        Objects without bounds (Planes) are kept in mUnboundedObjects and tested separately. Objects
+        loaded from a scene file use the tree stored in it, with stats off.
+
+        Objects moved in place (rather than added or removed) aren't noticed, call markObjectsDirty.
+        :return: a BVH
+        """
+
+        if not isinstance(self.mObjects, ObjectList):
+            self.mObjects = ObjectList(self.mObjects)
+
+        if self.mBVH is None or self.mBVHSource is not self.mObjects or self.mBVHVersion != self.mObjects.mVersion:
+            # A scene file's objects come with their tree, see scenefile.SceneObjectList.getStoredBVH
+            stored = self.mObjects.getStoredBVH() if self.isFromSceneFile() and self.mStats is None else None
+            if stored is not None:
+                self.mBVH, self.mBVHObjectIndices, self.mUnboundedObjectIndices = stored
+                self.mUnboundedObjects = [self.mObjects[i] for i in self.mUnboundedObjectIndices]
+            else:
+                self.buildBVH()
+
+            self.mBVHSource = self.mObjects
+            self.mBVHVersion = self.mObjects.mVersion
+
+        return self.mBVH
+
+
+    def buildBVH(self):
+        """
+        Builds mBVH over the bounded objects in mObjects, wrapping them for counting while stats are on,
+        and collects the unbounded ones. Use getBVH, which only calls this when something changed.
+        :return: None
+        """
+
+        bounded = []
+        self.mUnboundedObjects = []
+        self.mUnboundedObjectIndices = []
+        objectIndices = {}
+        for i, Object in enumerate(self.mObjects):
+            objectIndices[id(Object)] = i
+            if self.mStats is not None:
+                Object = CountedObject(Object, self.mStats)
+
+            if Object.getBounds() is None:
+                self.mUnboundedObjects.append(Object)
+                self.mUnboundedObjectIndices.append(i)
+            else:
+                bounded.append(Object)
+
+        self.mBVH = BVH(bounded)
+        self.mBVHObjectIndices = np.array([objectIndices[id(getattr(Object, "mObject", Object))]
+                                           for Object in self.mBVH.mObjects], dtype=int)
+
+
+    def isFromSceneFile(self):
+        """
+        :return: True if mObjects is still the SceneObjectList loaded from mSceneFile, unchanged since
+        """
+
+        return self.mSceneFileSource is self.mObjects and self.mSceneFileVersion == self.mObjects.mVersion
+
+
+    def enableStats(self):
+        """
+        Starts collecting render statistics. Counting is done by wrappers installed on the TraceContext
+        and removed by disableStats, so the render loop pays nothing for it while stats are off.
+
+        Stats are not gathered inside renderParallel's worker processes. With renderThreaded on a
+        free-threaded build the intersection counts can come out slightly low, as the threads share them.
+        :return: the RenderStats being filled
+        """
+
+        if self.mStats is None:
+            self.mStats = RenderStats()
+            self.mTraceContext = None
+            self.markObjectsDirty()
+
+        return self.mStats
+
+
+    def disableStats(self):
+        """
+        Stops collecting render statistics and removes the wrappers
+        :return: the RenderStats that was being filled, or None
+        """
+
+        stats = self.mStats
+        if stats is not None:
+            self.mStats = None
+            self.mTraceContext = None
+            self.markObjectsDirty()
+
+        return stats
+
+
+    def finishStatsFrame(self):
+        """
+        Called when a frame is complete, files the counters away as that frame's summary
+        :return: the frame summary dict, or None if stats are off
+        """
+
+        if self.mStats is None:
             return None
 
-        distIndex = 0
+        return self.mStats.finishFrame()
+
+
+    def markObjectsDirty(self):
+        """
+        Forces the BVH to be rebuilt on the next rayCast, for when objects (or their materials) are
+        changed in place, and updates the objects' precomputed intersection data. Objects loaded from a
+        scene file are all built, the file's stored BVH is dropped and worker processes are then sent
+        the objects rather than the file's path.
+        :return: None
+        """
+
+        for Object in self.mObjects:
+            Object.precompute()
+
+        self.mBVH = None
+        self.mSceneFileSource = None
+
 
-        curReturnResult = resultList[-1]
+    def getSnapshot(self):
+        """
+        Returns a SceneSnapshot of the objects, lights and shading settings, taking a new one if any of
+        them has changed since the last. Like getBVH, objects changed in place need markObjectsDirty.
+        :return: a SceneSnapshot
+        """
 
-        for result in resultList:
-            for i in range(len(result.mIntersectionDistances)):
-                if result.mIntersectionDistances[i] < curReturnResult.mIntersectionDistances[distIndex]:
-                    distIndex = i
-                    curReturnResult = result
+        bvh = self.getBVH()
+        snapshot = self.mSnapshot
+        bgColor = tuple(c / 255 for c in self.mBGColor)
+        if snapshot is None or not snapshot.matches(bvh, self.mLights, self.mSceneAmbient, bgColor, self.mMinContribution):
+            snapshot = SceneSnapshot(bvh, self.mUnboundedObjects, self.mLights, self.mSceneAmbient,
+                                     bgColor, self.mMinContribution)
+            self.mSnapshot = snapshot
 
+        return snapshot
+
+
+    def getTraceContext(self):
+        """
+        Returns the TraceContext this thread's renders go through, a new one whenever getSnapshot
+        returns a new snapshot. While stats are on they are attached to it.
+        :return: a TraceContext
+        """
 
-        # Convert the filled hit result into just holding the smallest distance.
-        curReturnResult.mIntersectionPoints = [curReturnResult.mIntersectionPoints[distIndex]]
-        curReturnResult.mIntersectionDistances = [curReturnResult.mIntersectionDistances[distIndex]]
+        snapshot = self.getSnapshot()
+        context = self.mTraceContext
+        if context is None or context.mScene is not snapshot:
+            context = TraceContext(snapshot)
+            if self.mStats is not None:
+                self.mStats.attach(context)
+            self.mTraceContext = context
 
-        return curReturnResult
+        return context
+
+
+    def rayCast(self, ray, isShadow=False, light=None):
+        """
+        This casts ray into the world, see TraceContext.rayCast
+        :param ray: the Ray to cast
+        :param isShadow: if True (with light), return the first object found between the ray origin and light
+        :param light: the Light the shadow ray is heading towards
+        :return: a new RayHitResult holding only the closest hit, or None
+        """
+
+        return self.getTraceContext().rayCast(ray, isShadow, light)
+
+
+    def isOccluded(self, ray, maxDist, light=None):
+        """
+        Shadow query: is anything along ray within maxDist? See TraceContext.isOccluded
+        :param ray: the shadow Ray
+        :param maxDist: distance from the ray origin to the light
+        :param light: the Light being tested, used to key the last-occluder cache
+        :return: True if the ray is blocked
+        """
+
+        return self.getTraceContext().isOccluded(ray, maxDist, light)
 
 
     def getColorOfHit(self, hitData):
         """
         This returns the color of the result passed in, no special effects right now
-        If hitData is None, jut returns the background color
+        If hitData is None, returns None
 
         :param hitData: a RayHitResult Object, or None
-        :return: A tuple of integers
+        :return: a Vec3 color
         """
 
         if hitData:
-            # return hitData.mHitObject.mMaterial.getPygameColor()
+            return self.getTraceContext().getColorOfHit(hitData)
+
+
+    def getColorOfHitRecursive(self, hitData):
+        """
+        Shades a hit along with its reflections, see TraceContext.getColorOfHitRecursive
+        :param hitData: a RayHitResult Object, or None
+        :return: a tuple of floats, not yet tone mapped
+        """
+
+        return self.getTraceContext().getColorOfHitRecursive(hitData)
+
+
+    def renderOneLine(self, iy):
+        """
+        This renders the world onto one line of the frame buffer, then presents the line
+
+        :param iy: the y value of the line
+        :return: None
+        """
 
-            ambient = hitData.mHitObject.mMaterial.mAmbient.pairwise(self.mSceneAmbient)
+        context = self.getTraceContext()
+        self.mFrameBuffer.mPixels[iy] = [self.getPixelColor(x, iy, context) for x in range(0, self.mPyWidth)]
+        self.mFrameBuffer.present(self.mRenderSurface, 0, iy, self.mPyWidth, 1)
 
-            if len(self.mLights):
-                objNormal = hitData.getNormal()
-                vectorToCam = -hitData.mRay.mDirection
+        if iy == self.mPyHeight - 1:
+            self.finishStatsFrame()
 
-                for light in self.mLights:
-                    lightVector = (light.mPos - (hitData.mIntersectionPoints[0])).normalized_copy()
-                    # Check collisions for shadow here
 
-                    if self.rayCast(Ray(hitData.mIntersectionPoints[0] + objNormal*.001, lightVector, isNormalized=True), isShadow=True, light=light):
+    def getPixelColor(self, ix, iy, context=None):
+        """
+        Traces the primary ray through one pixel
+        :param ix: the X Position of the pixel
+        :param iy: the Y Position of the pixel
+        :param context: the TraceContext to trace with, defaults to getTraceContext()
+        :return: a tuple of floats, not yet tone mapped
+        """
+
+        if context is None:
+            context = self.getTraceContext()
+
+        direction = self.calculatePixelPos(ix, iy) - self.mCamPos
+        return context.getColorOfHitRecursive(context.rayCast(Ray(self.mCamPos, direction)))
+
+
+    def renderProgressive(self, startSpacing=8):
+        """
+        Renders the frame coarse to fine. The first pass traces every startSpacing-th pixel in both
+        directions and fills the block below and right of it with its color, then each pass halves the
+        spacing until every pixel is traced. Pixels traced by an earlier pass are never traced again.
+
+        This is a generator, it yields after every row of every pass so the caller can update the
+        display in between, e.g. by calling next() on it once per frame. The blocks of each row are
+        presented together just before it yields.
+        :param startSpacing: spacing of the first pass, a power of two
+        :return: a generator yielding (spacing, iy) after each row
+        """
+
+        spacing = startSpacing
+        while spacing >= 1:
+            coarser = spacing * 2
+
+            for iy in range(0, self.mPyHeight, spacing):
+                rowTracedBefore = spacing < startSpacing and iy % coarser == 0
+                context = self.getTraceContext()
+                pixels = self.mFrameBuffer.mPixels
+
+                for ix in range(0, self.mPyWidth, spacing):
+                    if rowTracedBefore and ix % coarser == 0:
+                        # Traced at a coarser spacing, its block already holds its color
                         continue
 
+                    pixels[iy:iy + spacing, ix:ix + spacing] = self.getPixelColor(ix, iy, context)
+
+                self.mFrameBuffer.present(self.mRenderSurface, 0, iy, self.mPyWidth, min(spacing, self.mPyHeight - iy))
+                yield spacing, iy
+
+            spacing //= 2
+
+        self.finishStatsFrame()
+
+
+    def renderAdaptive(self, threshold=0.1, gridSize=2, seed=1803, tileSize=16):
+        """
+        Anti-aliased render that only supersamples where it is needed. Every pixel is traced once,
+        as renderPackets does. Then each pixel whose displayed color differs from the neighbour to its
+        right or below by more than threshold (see findEdgePixels) gets jittered samples from a
+        gridSize x gridSize grid spread over it, and is set to the average of those and its first sample.
+        The extra samples of all the edge pixels are traced together as one batch per round.
+
+        The diagonal cells of the grid are sampled first. If they hit the same object as the first
+        sample and agree with it in color, the edge runs past the pixel rather than through it, and
+        the rest of the grid is skipped.
+        :param threshold: color difference (0-1, after tone mapping) that counts as an edge
+        :param gridSize: the edge pixels get up to gridSize^2 stratified samples on top of the first one
+        :param seed: seeds the jitter, so the same frame renders the same way every time
+        :param tileSize: width and height of the tiles the first pass is traced in
+        :return: the number of pixels supersampled
+        """
+
+        reflectionArrays = self.getReflectionArrays()
+        lightIndex = self.getSnapshot().mLightIndex
+        pixels = self.mFrameBuffer.mPixels
+        objectIds = np.full((self.mPyHeight, self.mPyWidth), -1)
+
+        for tile in self.getTiles(tileSize):
+            x, y, width, height = tile
+            gbuffer = self.traceGBuffer(tile, True, reflectionArrays)
+            pixels[y:y + height, x:x + width] = self.shadeGBuffer(gbuffer, True, lightIndex).reshape(height, width, 3)
+            objectIds[y:y + height, x:x + width] = gbuffer.mObjectIndices.reshape(height, width)
+
+        toneMap = TONE_MAPS[self.mFrameBuffer.mToneMap]
+        exposure = self.mFrameBuffer.mExposure
+        edgeY, edgeX = np.nonzero(findEdgePixels(toneMap(pixels * exposure), threshold))
+
+        sums = pixels[edgeY, edgeX]
+        numSamples = np.ones(len(edgeY))
+        lowest = toneMap(sums * exposure)
+        highest = lowest.copy()
+        sameObject = np.ones(len(edgeY), dtype=bool)
+
+        diagonal = [(i, i) for i in range(gridSize)]
+        offDiagonal = [(sx, sy) for sy in range(gridSize) for sx in range(gridSize) if sx != sy]
+
+        rng = np.random.default_rng(seed)
+        pending = np.arange(len(edgeY))
+        for cells in (diagonal, offDiagonal):
+            if not len(pending) or not cells:
+                break
+
+            # One sample somewhere in each cell of every pending pixel, the pixel spanning -0.5 to 0.5 round its center
+            cellX, cellY = np.array(cells, dtype=float).T
+            jitter = rng.random((2, len(cells), len(pending)))
+            px = edgeX[pending] - .5 + (cellX[:, np.newaxis] + jitter[0]) / gridSize
+            py = edgeY[pending] - .5 + (cellY[:, np.newaxis] + jitter[1]) / gridSize
+
+            gbuffer = self.traceGBuffer(packets=True, reflectionArrays=reflectionArrays, samples=(px.ravel(), py.ravel()))
+            colors = self.shadeGBuffer(gbuffer, True, lightIndex).reshape(len(cells), len(pending), 3)
+            hitIds = gbuffer.mObjectIndices.reshape(len(cells), len(pending))
+
+            displayed = toneMap(colors * exposure)
+            sums[pending] += colors.sum(axis=0)
+            numSamples[pending] += len(cells)
+            lowest[pending] = np.minimum(lowest[pending], displayed.min(axis=0))
+            highest[pending] = np.maximum(highest[pending], displayed.max(axis=0))
+            sameObject[pending] &= (hitIds == objectIds[edgeY[pending], edgeX[pending]]).all(axis=0)
+
+            agree = sameObject[pending] & ((highest[pending] - lowest[pending]).max(axis=1) <= threshold)
+            pending = pending[~agree]
+
+        pixels[edgeY, edgeX] = sums / numSamples[:, np.newaxis]
+
+        self.mFrameBuffer.present(self.mRenderSurface)
+        self.finishStatsFrame()
+        return len(edgeY)
+
+
+    def renderTile(self, x, y, width, height, context=None):
+        """
+        Traces a rectangle of pixels without touching the frame buffer or render surface
+        :param x: left edge of the tile
+        :param y: top edge of the tile
+        :param width: width of the tile in pixels
+        :param height: height of the tile in pixels
+        :param context: the TraceContext to trace with, defaults to getTraceContext()
+        :return: a (height, width, 3) float array of the tile's colors
+        """
+
+        if context is None:
+            context = self.getTraceContext()
+
+        return np.array([[self.getPixelColor(ix, iy, context) for ix in range(x, x + width)]
+                         for iy in range(y, y + height)], dtype=float).reshape(height, width, 3)
+
+
+    def presentTile(self, tile, colors):
+        """
+        Stores a tile traced by renderTile in the frame buffer and presents it
+        :param tile: the (x, y, width, height) of the tile
+        :param colors: the array renderTile returned
+        :return: None
+        """
+
+        x, y, width, height = tile
+        self.mFrameBuffer.mPixels[y:y + height, x:x + width] = colors
+        self.mFrameBuffer.present(self.mRenderSurface, x, y, width, height)
+
+
+    def __getstate__(self):
+        """
+        Pickles everything but the render surface, so the scene can be sent to worker processes
+        """
+
+        state = self.__dict__.copy()
+        state["mRenderSurface"] = None
+        state["mGBuffer"] = None
+        state["mSnapshot"] = None
+        state["mTraceContext"] = None
+
+        # Stats and the counting BVH stay behind
+        if self.mStats is not None:
+            state["mStats"] = None
+            state["mBVH"] = None
+            state["mUnboundedObjects"] = []
+
+        # Objects still as they were loaded are read from the scene file on the other side instead
+        if self.isFromSceneFile():
+            state["mObjects"] = None
+            state["mBVH"] = None
+            state["mUnboundedObjects"] = []
+            state["mBVHObjectIndices"] = np.zeros(0, dtype=int)
+            state["mBVHSource"] = None
+            state["mSceneFileSource"] = None
+
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+        if self.mObjects is None:
+            from scenefile import SceneFile
+            self.mObjects = SceneFile(self.mSceneFile).getObjects()
+            self.mSceneFileSource = self.mObjects
+            self.mSceneFileVersion = self.mObjects.mVersion
+
+
+    def renderParallel(self, numWorkers=None, tileSize=16):
+        """
+        Renders the frame across a pool of processes. The scene is sent to each worker once when the
+        pool starts; after that only tile rectangles go out and pixel bytes come back. Tiles are small
+        and handed out one at a time to whichever worker is free, so tiles crossing expensive objects
+        don't leave the other workers idle.
+        :param numWorkers: number of processes, defaults to the number of CPUs
+        :param tileSize: width and height of the tiles in pixels
+        :return: None
+        """
+
+        if numWorkers is None:
+            numWorkers = os.cpu_count() or 1
+
+        tiles = self.getTiles(tileSize)
+
+        with ProcessPoolExecutor(max_workers=numWorkers, initializer=_initRenderWorker, initargs=(self,)) as executor:
+            futures = [executor.submit(_renderTileInWorker, tile) for tile in tiles]
+
+            for future in as_completed(futures):
+                self.presentTile(*future.result())
+
+        self.finishStatsFrame()
+
+
+    def getTiles(self, tileSize):
+        """
+        :param tileSize: width and height of the tiles in pixels
+        :return: a list of (x, y, width, height) tiles covering the frame, row by row
+        """
+
+        tiles = []
+        for y in range(0, self.mPyHeight, tileSize):
+            for x in range(0, self.mPyWidth, tileSize):
+                tiles.append((x, y, min(tileSize, self.mPyWidth - x), min(tileSize, self.mPyHeight - y)))
+
+        return tiles
+
+
+    def renderThreaded(self, numWorkers=None, tileSize=16, fallback=True):
+        """
+        Renders the frame across a pool of threads sharing one SceneSnapshot. Each tile is traced
+        through its own TraceContext, so the threads share nothing they write to, and the finished
+        tiles are blitted from this thread.
+
+        Threads only run Python in parallel on a free-threaded build with the GIL off. Otherwise,
+        with fallback set, the frame is handed to renderParallel's processes instead.
+        :param numWorkers: number of threads, defaults to the number of CPUs
+        :param tileSize: width and height of the tiles in pixels
+        :param fallback: use renderParallel when the GIL is enabled
+        :return: None
+        """
+
+        if fallback and isGILEnabled():
+            self.renderParallel(numWorkers, tileSize)
+            return
+
+        if numWorkers is None:
+            numWorkers = os.cpu_count() or 1
+
+        snapshot = self.getSnapshot()
+        stats = self.mStats
+
+        def renderTileInThread(tile):
+            context = TraceContext(snapshot)
+            tileStats = None
+            if stats is not None:
+                tileStats = RenderStats()
+                tileStats.attach(context)
+            return tile, self.renderTile(*tile, context=context), tileStats
+
+        with ThreadPoolExecutor(max_workers=numWorkers) as executor:
+            futures = [executor.submit(renderTileInThread, tile) for tile in self.getTiles(tileSize)]
+
+            for future in as_completed(futures):
+                tile, colors, tileStats = future.result()
+                self.presentTile(tile, colors)
+                if tileStats is not None:
+                    stats.merge(tileStats)
+
+        self.finishStatsFrame()
+
+
+    def calculatePixelPosBatch(self, ix, iy):
+        """
+        Array version of calculatePixelPos
+        :param ix: array of X positions
+        :param iy: array of Y positions, the same shape as ix
+        :return: an array of shape ix.shape + (3,) holding the world space positions
+        """
+
+        ix = np.asarray(ix, dtype=float)[..., np.newaxis]
+        iy = np.asarray(iy, dtype=float)[..., np.newaxis]
+
+        return np.array(self.mViewOrigin.mData) \
+               + self.mVirtualPyWidthRatio*ix * np.array(self.mCamX.mData) \
+               - self.mVirtualPyHeightRatio*iy * np.array(self.mCamY.mData)
+
+
+    def rayCastBatch(self, origins, directions):
+        """
+        Array version of rayCast, finds the closest object along every ray at once
+        :param origins: (N, 3) array of ray origins
+        :param directions: (N, 3) array of normalized ray directions
+        :return: (distances, objectIndices, parts), inf and -1 where a ray hits nothing. parts is the part of
+                 the object hit as its rayHitBatch reports it, e.g. a mesh's triangle, -1 for other objects
+        """
+
+        bestDist = np.full(len(origins), np.inf)
+        bestObject = np.full(len(origins), -1)
+        bestPart = np.full(len(origins), -1)
+        parts = np.empty(len(origins), dtype=int)
+
+        for i, Object in enumerate(self.mObjects):
+            parts.fill(-1)
+            dist = Object.rayHitBatch(origins, directions, parts)
+            closer = dist < bestDist
+            bestDist[closer] = dist[closer]
+            bestObject[closer] = i
+            bestPart[closer] = parts[closer]
+
+            if self.mStats is not None:
+                self.mStats.countTest(type(Object).__name__, False, len(origins), int(np.count_nonzero(dist < np.inf)))
+
+        return bestDist, bestObject, bestPart
+
+
+    def isOccludedBatch(self, origins, directions, maxDist2):
+        """
+        Array version of the shadow test in rayCast, True where any object is closer than the light
+        :param origins: (N, 3) array of shadow ray origins
+        :param directions: (N, 3) array of normalized directions towards the light
+        :param maxDist2: (N,) array of squared distances to the light
+        :return: (N,) boolean array
+        """
+
+        occluded = np.zeros(len(origins), dtype=bool)
 
-                    # Check Light intensity if spotlight here
-                    lightPortion = VectorN(3)
+        for Object in self.mObjects:
+            dist = Object.rayHitBatch(origins, directions)
+            blocked = dist * dist <= maxDist2
+            occluded |= blocked
 
-                    lightIntensity = light.getIntensity(hitData.mIntersectionPoints[0])
-                    if lightIntensity:
+            if self.mStats is not None:
+                self.mStats.countTest(type(Object).__name__, False, len(origins), int(np.count_nonzero(blocked)))
 
-                        # Check Diffuse light
-                        diffuseStrength = lightVector.dot(objNormal)
-                        # print(diffuseStrength, lightVector, objNormal)
+        return occluded
 
-                        if diffuseStrength > 0:
-                            lightPortion += diffuseStrength * (light.mDiffuse.pairwise(hitData.mHitObject.mMaterial.mDiffuse))
 
-                        # Check Specular
-                        lightVectorParallel = objNormal * diffuseStrength
-                        reflectionVector = 2*lightVectorParallel - lightVector
+    def rayCastPacket(self, origins, directions):
+        """
+        rayCastBatch for a coherent packet of rays, e.g. the primary rays of a small tile: the packet is
+        walked down the BVH together (see BVH.findClosestHitPacket) rather than tested against every object
+        :param origins: (N, 3) array of ray origins
+        :param directions: (N, 3) array of normalized ray directions
+        :return: (distances, objectIndices, parts) as rayCastBatch returns them
+        """
 
-                        specularStrength = reflectionVector.dot(vectorToCam)
+        bvh = self.getBVH()
+        bestDist = np.full(len(origins), np.inf)
+        bestObject = np.full(len(origins), -1)
+        bestPart = np.full(len(origins), -1)
 
-                        if specularStrength > 0:
-                            # print(specularStrength)
-                            lightPortion += specularStrength**hitData.mHitObject.mMaterial.mHardness * (light.mSpecular.pairwise(hitData.mHitObject.mMaterial.mSpecular))
+        for i, Object in zip(self.mUnboundedObjectIndices, self.mUnboundedObjects):
+            parts = np.full(len(origins), -1)
+            dist = Object.rayHitBatch(origins, directions, parts)
+            closer = dist < bestDist
+            bestDist[closer] = dist[closer]
+            bestObject[closer] = i
+            bestPart[closer] = parts[closer]
 
-                        ambient += lightPortion*lightIntensity
+        dist, positions, parts = bvh.findClosestHitPacket(origins, directions, bestDist)
+        hit = positions >= 0
+        bestDist[hit] = dist[hit]
+        bestObject[hit] = self.mBVHObjectIndices[positions[hit]]
+        bestPart[hit] = parts[hit]
 
-            return ambient
+        return bestDist, bestObject, bestPart
 
 
-    def getColorOfHitRecursive(self, hitData, recursionDepth=5):
+    def isOccludedPacket(self, origins, directions, maxDist2):
+        """
+        isOccludedBatch for a packet of shadow rays towards one light, walked down the BVH together
+        :param origins: (N, 3) array of shadow ray origins
+        :param directions: (N, 3) array of normalized directions towards the light
+        :param maxDist2: (N,) array of squared distances to the light
+        :return: (N,) boolean array
+        """
 
-        if not hitData:
-            if recursionDepth == 5:
-                return self.mBGColor
+        bvh = self.getBVH()
+        occluded = bvh.findOccludedPacket(origins, directions, np.sqrt(maxDist2))
 
+        for Object in self.mUnboundedObjects:
+            rays = np.flatnonzero(~occluded)
+            if not len(rays):
+                break
+            dist = Object.rayHitBatch(origins[rays], directions[rays])
+            occluded[rays[dist * dist <= maxDist2[rays]]] = True
+
+        return occluded
+
+
+    def getNormalBatch(self, points, objectIndices, directions=None, parts=None):
+        """
+        :param points: (N, 3) array of hit points
+        :param objectIndices: (N,) array of indices into mObjects
+        :param directions: optional (N, 3) array of the directions of the rays that hit the points
+        :param parts: optional (N,) array of the parts hit, as rayCastBatch returns them
+        :return: (N, 3) array of the surface normals at the points
+        """
+
+        normals = np.zeros(points.shape)
+
+        for i in np.unique(objectIndices).tolist():
+            mask = objectIndices == i
+            normals[mask] = self.mObjects[i].getNormalBatch(points[mask],
+                                                            None if directions is None else directions[mask],
+                                                            None if parts is None else parts[mask])
+
+        return normals
+
+
+    def getColorOfHitBatch(self, points, directions, objectIndices, normals=None, packets=False, lightIndex=None):
+        """
+        Array version of getColorOfHit, applies ambient, shadows and Phong shading to every hit
+        :param points: (N, 3) array of hit points
+        :param directions: (N, 3) array of the directions of the rays that hit them
+        :param objectIndices: (N,) array of indices into mObjects
+        :param normals: (N, 3) array of the normals at the points, if already known
+        :param packets: cast each light's shadow rays as one packet with isOccludedPacket
+        :param lightIndex: a LightIndex over mLights, to only visit the lights that reach the points' bounding box
+        :return: ((N, 3) array of float colors, (N, 3) array of normals)
+        """
+
+        if normals is None:
+            normals = self.getNormalBatch(points, objectIndices, directions)
+
+        ambient = np.zeros(points.shape)
+        diffuse = np.zeros(points.shape)
+        specular = np.zeros(points.shape)
+        hardness = np.zeros(len(points))
+        sceneAmbient = np.array(self.mSceneAmbient.mData)
+
+        for i in np.unique(objectIndices).tolist():
+            mask = objectIndices == i
+            material = self.mObjects[i].mMaterial
+            ambient[mask] = np.array(material.mAmbient.mData) * sceneAmbient
+            diffuse[mask] = material.mDiffuse.mData
+            specular[mask] = material.mSpecular.mData
+            hardness[mask] = material.mHardness
+
+        color = ambient
+        vectorToCam = -directions
+        shadowOrigins = points + normals*.001
+        isOccluded = self.isOccludedPacket if packets else self.isOccludedBatch
+
+        lights = self.mLights
+        if lightIndex is not None and len(points):
+            lights = lightIndex.findLightsInBox(points.min(axis=0).tolist(), points.max(axis=0).tolist())
+
+        for light in lights:
+            # Only points inside the light's bounds, and then inside its cone and range, are shaded by it
+            # and get a shadow ray
+            bounds = light.getBounds()
+            if bounds is None:
+                reached = np.arange(len(points))
             else:
-                return VectorN(3)
+                minPt, maxPt = bounds
+                reached = np.flatnonzero(np.all((points >= minPt.mData) & (points <= maxPt.mData), axis=1))
+
+            lightIntensity = light.getIntensityBatch(points[reached])
+            lit = lightIntensity > 0
+            reached = reached[lit]
+            lightIntensity = lightIntensity[lit]
+            if not len(reached):
+                continue
+
+            lightPos = np.array(light.mPos.mData)
+            lightVector = lightPos - points[reached]
+            lightLength = np.linalg.norm(lightVector, axis=1, keepdims=True)
+            lightVector = np.divide(lightVector, lightLength, out=np.zeros(lightVector.shape), where=lightLength > 0)
 
+            if self.mStats is not None:
+                self.mStats.mShadowRays += len(reached)
 
+            toLight = lightPos - shadowOrigins[reached]
+            occluded = isOccluded(shadowOrigins[reached], lightVector, np.einsum("ij,ij->i", toLight, toLight))
+            lightIntensity[occluded] = NO_INTENSITY
 
-        if recursionDepth == 5:
-            self.mFinalLightComponent = self.getColorOfHit(hitData)
+            pointNormals = normals[reached]
+            diffuseStrength = np.einsum("ij,ij->i", lightVector, pointNormals)
+            lightPortion = np.where(diffuseStrength[:, np.newaxis] > 0,
+                                    diffuseStrength[:, np.newaxis] * np.array(light.mDiffuse.mData) * diffuse[reached], 0.0)
 
-        objNormal = hitData.getNormal()
-        vectorToCam = -hitData.mRay.mDirection
+            reflectionVector = 2*pointNormals*diffuseStrength[:, np.newaxis] - lightVector
+            specularStrength = np.einsum("ij,ij->i", reflectionVector, vectorToCam[reached])
+            specularPower = np.where(specularStrength > 0, np.maximum(specularStrength, 0) ** hardness[reached], 0.0)
+            lightPortion += specularPower[:, np.newaxis] * np.array(light.mSpecular.mData) * specular[reached]
 
-        refectionVectorParallel = vectorToCam.dot(objNormal)*objNormal
-        reflectionVector = 2*refectionVectorParallel - vectorToCam
+            color[reached] += lightPortion * lightIntensity[:, np.newaxis]
 
-        self.mFinalLightComponent = .5*self.mFinalLightComponent + \
-                                    .5*self.getColorOfHitRecursive(self.rayCast(
-                                        Ray(hitData.mIntersectionPoints[0]+objNormal*.001, reflectionVector))
-                                                                   , recursionDepth=recursionDepth-1)
+        return color, normals
 
-        if recursionDepth == 5:
-            self.mFinalLightComponent[0] = min(1, self.mFinalLightComponent[0])
-            self.mFinalLightComponent[1] = min(1, self.mFinalLightComponent[1])
-            self.mFinalLightComponent[2] = min(1, self.mFinalLightComponent[2])
 
-            return (self.mFinalLightComponent*255).iTuple()
+    def getReflectionArrays(self):
+        """
+        :return: (reflectivity, reflectionDepth), arrays of those material settings for every object in mObjects
+        """
 
+        if self.isFromSceneFile():
+            return self.mObjects.getReflectionArrays()
+
+        return (np.array([obj.mMaterial.mReflectivity for obj in self.mObjects], dtype=float),
+                np.array([obj.mMaterial.mReflectionDepth for obj in self.mObjects]))
+
+
+    def traceGBuffer(self, tile=None, packets=False, reflectionArrays=None, samples=None):
+        """
+        Traces the primary rays of every pixel and all of their reflection bounces as NumPy array
+        operations, without shading anything. Reflections follow getColorOfHitRecursive: every bounce
+        is traced for the rays still worth following, until none are left.
+        :param tile: (x, y, width, height) to trace just that rectangle, defaults to the whole frame
+        :param packets: cast the rays with rayCastPacket instead of rayCastBatch
+        :param reflectionArrays: getReflectionArrays(), if already known
+        :param samples: (px, py) arrays of view plane positions in pixel units, fractions allowed, to trace
+                        instead of a tile
+        :return: a GBuffer, the size of the tile, or a single row of the samples
+        """
+
+        if samples is not None:
+            px, py = samples
+            width, height = len(px), 1
         else:
-            return self.getColorOfHit(hitData)
+            x, y, width, height = tile if tile is not None else (0, 0, self.mPyWidth, self.mPyHeight)
+            iy, ix = np.mgrid[y:y + height, x:x + width]
+            px, py = ix.ravel(), iy.ravel()
+        camPos = np.array(self.mCamPos.mData)
+
+        directions = self.calculatePixelPosBatch(px, py) - camPos
+        directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+        origins = np.broadcast_to(camPos, directions.shape)
+
+        reflectivity, reflectionDepth = reflectionArrays if reflectionArrays is not None else self.getReflectionArrays()
+        gbuffer = GBuffer(width, height, self.getCameraKey(), self.getBVH(),
+                          reflectivity, reflectionDepth, self.mMinContribution)
+
+        castRays = self.rayCastPacket if packets else self.rayCastBatch
+        dist, objectIndices, parts = castRays(origins, directions)
+        hit = objectIndices >= 0
+
+        if self.mStats is not None:
+            self.mStats.mPrimaryRays += len(directions)
+
+        pixels = np.flatnonzero(hit)
+        hitDirections = directions[hit]
+        points = origins[hit] + dist[hit, np.newaxis] * hitDirections
+        hitIndices = objectIndices[hit]
+        normals = self.getNormalBatch(points, hitIndices, hitDirections, parts[hit])
+        weight = np.ones(len(pixels))
+        bounces = 0
+
+        gbuffer.mHit = hit
+        gbuffer.mObjectIndices = objectIndices
+        gbuffer.mDistances = dist
+        gbuffer.mPositions[hit] = points
+        gbuffer.mNormals[hit] = normals
+
+        while len(pixels):
+            hitReflectivity = reflectivity[hitIndices]
+            bounce = (bounces < reflectionDepth[hitIndices]) & (weight*hitReflectivity >= self.mMinContribution)
+            keep = np.where(bounce, 1 - hitReflectivity, 1.0) * weight
+            gbuffer.mLayers.append(GBufferLayer(pixels, points, hitDirections, hitIndices, normals, keep))
+
+            if not bounce.any():
+                break
+
+            pixels = pixels[bounce]
+            weight = weight[bounce] * hitReflectivity[bounce]
+            bounceNormals = normals[bounce]
+            bounceDirections = hitDirections[bounce]
+            bounces += 1
+
+            reflectDirections = bounceDirections - 2*np.einsum("ij,ij->i", bounceDirections, bounceNormals)[:, np.newaxis]*bounceNormals
+            reflectOrigins = points[bounce] + bounceNormals*.001
+            reflectDist, reflectIndices, reflectParts = castRays(reflectOrigins, reflectDirections)
+            reflectHit = reflectIndices >= 0
+
+            if self.mStats is not None:
+                self.mStats.mReflectionRays += len(reflectDirections)
+
+            pixels = pixels[reflectHit]
+            weight = weight[reflectHit]
+            hitDirections = reflectDirections[reflectHit]
+            points = reflectOrigins[reflectHit] + reflectDist[reflectHit, np.newaxis]*hitDirections
+            hitIndices = reflectIndices[reflectHit]
+            normals = self.getNormalBatch(points, hitIndices, hitDirections, reflectParts[reflectHit])
+
+        return gbuffer
+
+
+    def shadeGBuffer(self, gbuffer, packets=False, lightIndex=None):
+        """
+        Shades every hit of a GBuffer with the current lights and material colors, shadow rays included
+        :param gbuffer: a GBuffer from traceGBuffer
+        :param packets: cast the shadow rays with isOccludedPacket, see getColorOfHitBatch
+        :param lightIndex: passed on to getColorOfHitBatch
+        :return: (width * height, 3) array of float colors, row by row
+        """
 
+        colors = np.zeros((len(gbuffer.mHit), 3))
+        colors[~gbuffer.mHit] = np.array(self.mBGColor) / 255
 
-    def renderOneLine(self, iy):
+        for layer in gbuffer.mLayers:
+            surfaceColor = self.getColorOfHitBatch(layer.mPoints, layer.mDirections, layer.mObjectIndices,
+                                                   layer.mNormals, packets, lightIndex)[0]
+            colors[layer.mPixels] += layer.mWeights[:, np.newaxis] * surfaceColor
+
+        return colors
+
+
+    def renderFrame(self):
+        """
+        This renders the whole frame at once, tracing every pixel as NumPy array operations
+        rather than one Python call per pixel, and writes it to the render surface in one go.
+        What was traced is kept in mGBuffer for relight.
+        :return: None
         """
-        This renders the world onto one line of the pygame window
 
-        :param iy: the y value of the line
+        self.mGBuffer = self.traceGBuffer()
+        colors = self.shadeGBuffer(self.mGBuffer)
+
+        self.mFrameBuffer.mPixels[:] = colors.reshape(self.mPyHeight, self.mPyWidth, 3)
+        self.mFrameBuffer.present(self.mRenderSurface)
+
+        self.finishStatsFrame()
+
+
+    def renderPackets(self, tileSize=16):
+        """
+        Renders the frame as small tiles of coherent rays. Each tile's primary rays, reflection rays and
+        the shadow rays towards each light are traced as packets that go down the BVH together, so a
+        node's box is tested once for the whole packet and the packet only splits where its rays diverge.
+        Each tile is only shaded by the lights whose bounds reach it.
+        :param tileSize: width and height of the tiles in pixels
         :return: None
         """
 
-        for x in range(0, self.mPyWidth):
-            direction = self.calculatePixelPos(x, iy) - self.mCamPos
-            color = self.getColorOfHitRecursive(self.rayCast(Ray(self.mCamPos, direction)))
+        reflectionArrays = self.getReflectionArrays()
+        lightIndex = self.getSnapshot().mLightIndex
+
+        for tile in self.getTiles(tileSize):
+            x, y, width, height = tile
+            colors = self.shadeGBuffer(self.traceGBuffer(tile, True, reflectionArrays), True, lightIndex)
+            self.mFrameBuffer.mPixels[y:y + height, x:x + width] = colors.reshape(height, width, 3)
+
+        self.mFrameBuffer.present(self.mRenderSurface)
+        self.finishStatsFrame()
+
+
+    def relight(self):
+        """
+        Renders the frame again after lights or material colors changed, reusing the hits the last
+        renderFrame traced so only shading and shadow rays are run. If the camera, geometry or
+        reflection settings changed since, or there was no renderFrame yet, this is renderFrame.
+        :return: True if the cached hits were reused
+        """
+
+        gbuffer = self.mGBuffer
+        reflectivity, reflectionDepth = self.getReflectionArrays()
+        if gbuffer is None or not gbuffer.matches(self.mPyWidth, self.mPyHeight, self.getCameraKey(), self.getBVH(),
+                                                  reflectivity, reflectionDepth, self.mMinContribution):
+            self.renderFrame()
+            return False
+
+        colors = self.shadeGBuffer(gbuffer)
+        self.mFrameBuffer.mPixels[:] = colors.reshape(self.mPyHeight, self.mPyWidth, 3)
+        self.mFrameBuffer.present(self.mRenderSurface)
 
-            self.mRenderSurface.set_at((x, iy), color)
+        self.finishStatsFrame()
+        return True
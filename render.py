@@ -0,0 +1,159 @@
+"""
+Offline renderer: renders a scene into an off-screen surface and saves it as a PNG,
+no window or video driver needed.
+
+    python render.py -o out.png --width 1920 --height 1080 --mode parallel --workers 8
+    python render.py -o frames/shot.png --tween 24 --frames 0:24
+"""
+import os
+
+# Surfaces and image saving don't need a display, make sure pygame never looks for one
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import argparse, sys, time
+import pygame
+import raytracer, scenes, scenefile
+from stats import formatFrameSummary
+from framebuffer import TONE_MAPS
+
+MODES = ("line", "progressive", "frame", "parallel", "threads", "adaptive", "packets")
+
+
+def renderOnce(RT, mode, numWorkers):
+    """
+    Renders RT's current camera into its surface
+    :param RT: a Raytracer
+    :param mode: one of MODES
+    :param numWorkers: process or thread count for the parallel and threads modes
+    :return: None
+    """
+
+    if mode == "line":
+        for iy in range(RT.mPyHeight):
+            RT.renderOneLine(iy)
+    elif mode == "progressive":
+        for step in RT.renderProgressive():
+            pass
+    elif mode == "frame":
+        RT.renderFrame()
+    elif mode == "threads":
+        RT.renderThreaded(numWorkers)
+    elif mode == "adaptive":
+        RT.renderAdaptive()
+    elif mode == "packets":
+        RT.renderPackets()
+    else:
+        RT.renderParallel(numWorkers)
+
+
+def frameFileName(output, frame, numFrames):
+    """
+    :param output: the --output path
+    :param frame: the tween frame being saved
+    :param numFrames: how many frames are being rendered in total
+    :return: output itself for a single frame, otherwise output with the frame number before the extension
+    """
+
+    if numFrames == 1:
+        return output
+
+    root, ext = os.path.splitext(output)
+    return "%s_%04d%s" % (root, frame, ext or ".png")
+
+
+def parseFrameRange(text):
+    """
+    :param text: "START:END" (END exclusive) or a single frame number
+    :return: a range
+    """
+
+    if ":" in text:
+        start, end = text.split(":")
+        return range(int(start), int(end))
+    return range(int(text), int(text) + 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render a scene to PNG without a display.")
+    parser.add_argument("-o", "--output", default="render.png", help="PNG file to write")
+    parser.add_argument("--scene", default="default", choices=sorted(scenes.SCENES), help="scene to render")
+    parser.add_argument("--scene-file", metavar="PATH", help="render a scene file (see scenefile.py) instead of --scene")
+    parser.add_argument("--obj", metavar="PATH", help="render a Wavefront OBJ mesh in the mesh scene instead of its torus")
+    parser.add_argument("--save-scene", metavar="PATH", help="write the scene to a scene file before rendering")
+    parser.add_argument("--width", type=int, default=300)
+    parser.add_argument("--height", type=int, default=200)
+    parser.add_argument("--mode", default="frame", choices=MODES,
+                        help="line: one scanline at a time, progressive: coarse to fine, "
+                             "frame: whole frame as arrays, parallel: tiles over worker processes, "
+                             "threads: tiles over threads on free-threaded builds, else as parallel, "
+                             "adaptive: anti-aliased, supersampling only the pixels on edges, "
+                             "packets: 16x16 tiles of rays traced down the BVH together")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes or threads for --mode parallel/threads, defaults to the CPU count")
+    parser.add_argument("--tween", type=int, default=0, metavar="N",
+                        help="set up the scene's camera tween over N frames")
+    parser.add_argument("--frames", type=parseFrameRange, default=None, metavar="START:END",
+                        help="tween frames to render (END exclusive), defaults to all of them")
+    parser.add_argument("--tone-map", default="clamp", choices=sorted(TONE_MAPS),
+                        help="how traced colors brighter than white are brought into range")
+    parser.add_argument("--exposure", type=float, default=1.0, help="colors are scaled by this before tone mapping")
+    parser.add_argument("--stats", action="store_true",
+                        help="collect ray and intersection counts and print a summary per frame")
+    args = parser.parse_args(argv)
+    wallStart = time.perf_counter()
+
+    if args.tween:
+        # Tweens belong to the named scenes, a scene or OBJ file has none
+        if args.scene_file or args.obj:
+            parser.error("--tween can't be used with --scene-file or --obj")
+        if args.scene not in scenes.TWEENS:
+            parser.error("scene %r has no camera tween" % args.scene)
+
+    surface = pygame.Surface((args.width, args.height))
+    RT = raytracer.Raytracer(surface)
+    if args.scene_file:
+        scenefile.loadScene(RT, args.scene_file)
+    elif args.obj:
+        scenes.buildMeshScene(RT, args.obj)
+    else:
+        scenes.SCENES[args.scene](RT)
+    if args.save_scene:
+        scenefile.saveScene(RT, args.save_scene)
+    RT.mFrameBuffer.mToneMap = args.tone_map
+    RT.mFrameBuffer.mExposure = args.exposure
+    if args.stats:
+        RT.enableStats()
+
+    if args.tween:
+        scenes.TWEENS[args.scene](RT, args.tween)
+
+    frames = args.frames if args.frames is not None else range(args.tween + 1)
+    if not frames or frames[0] < 0 or frames[-1] > args.tween:
+        parser.error("--frames must lie within 0:%d, use --tween to render more frames" % (args.tween + 1))
+
+    currentFrame = 0
+    totalSeconds = 0.0
+    for frame in frames:
+        while currentFrame < frame:
+            RT.updateTween()
+            currentFrame += 1
+
+        start = time.perf_counter()
+        renderOnce(RT, args.mode, args.workers)
+        seconds = time.perf_counter() - start
+        totalSeconds += seconds
+
+        fileName = frameFileName(args.output, frame, len(frames))
+        pygame.image.save(surface, fileName)
+        print("frame %d: %.3f s -> %s" % (frame, seconds, fileName))
+        if args.stats and RT.mStats.mFrames:
+            print(formatFrameSummary(RT.mStats.mFrames[-1]))
+
+    primaryRays = args.width * args.height * len(frames)
+    print("%d frame(s), %.3f s wall time, %.3f s rendering, %.0f primary rays/s" %
+          (len(frames), time.perf_counter() - wallStart, totalSeconds,
+           primaryRays / totalSeconds if totalSeconds else 0.0))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,571 @@
+"""
+Binary scene files: one typed array per primitive kind, plus the materials, lights, camera and the BVH.
+
+    saveScene(RT, "city.scn")
+    scene = SceneFile("city.scn")          # memory-maps the arrays, nothing is read yet
+    scene.loadInto(RT)                     # sets up the objects and lights, sets the camera
+
+Loading doesn't make the objects or read the arrays. RT.mObjects is a SceneObjectList, building each
+object from its row the first time it's read, and RT's BVH is the tree stored in the file, read a
+chunk of nodes at a time as rays walk it. Only the objects in the leaves rays reach get built.
+
+Layout: the 8 byte MAGIC, a little endian uint32 header length, a JSON header naming every array with
+its dtype, shape and byte offset, then the raw arrays, each starting on an ALIGNMENT byte boundary.
+
+Every primitive row ends with the index of its row in "materials". A mesh's row points at its vertices in
+"meshVertices" and its triangles in "meshIndices", which hold every mesh's one after another.
+"""
+import bisect, json, math, struct
+import numpy as np
+from math3d import Vec3
+from objects3d import *
+from bvh import BVH
+from mesh import TriangleMesh
+from raytracer import ObjectList
+
+MAGIC = b"PGRTSCN\x00"
+VERSION = 3
+# Arrays start on multiples of this many bytes, so the mapped views are aligned
+ALIGNMENT = 64
+
+# Columns of each array, the float64 layout of one row. A light's range is NaN when it has none.
+# Columns added in later versions go at the end, and are NaN when reading older files.
+COLUMNS = {
+    "materials": ("diffuseR", "diffuseG", "diffuseB", "specularR", "specularG", "specularB",
+                  "hardness", "reflectivity", "reflectionDepth"),
+    "spheres": ("x", "y", "z", "radius", "material"),
+    "planes": ("normalX", "normalY", "normalZ", "d", "material"),
+    "aabbs": ("minX", "minY", "minZ", "maxX", "maxY", "maxZ", "material"),
+    "cylinders": ("baseX", "baseY", "baseZ", "height", "radius", "material"),
+    "meshes": ("numVertices", "numTriangles", "maxLeafSize", "firstVertex", "firstTriangle", "material"),
+    "meshVertices": ("x", "y", "z"),
+    # Vertex numbers within the triangle's own mesh
+    "meshIndices": ("a", "b", "c"),
+    "lights": ("x", "y", "z", "diffuseR", "diffuseG", "diffuseB", "specularR", "specularG", "specularB", "range"),
+    "spotlights": ("x", "y", "z", "diffuseR", "diffuseG", "diffuseB", "specularR", "specularG", "specularB",
+                   "innerAngle", "outerAngle", "directionX", "directionY", "directionZ", "range"),
+    "camera": ("posX", "posY", "posZ", "coiX", "coiY", "coiZ", "upX", "upY", "upZ", "fov", "near"),
+    # The BVH over the bounded objects, one row per node; left and right are -1 for leaves
+    "bvhNodes": ("minX", "minY", "minZ", "maxX", "maxY", "maxZ", "left", "right", "start", "count"),
+    # Index in the loaded object list of each BVH position
+    "bvhObjects": ("object",),
+}
+
+# Rows converted to Python values at a time by ChunkedRows
+CHUNK_SIZE = 4096
+
+# Primitive classes by array name, in the order their objects are loaded
+PRIMITIVES = (("planes", Plane), ("spheres", Sphere), ("aabbs", AABB), ("cylinders", CylinderY), ("meshes", TriangleMesh))
+
+
+def getPrimitiveRow(obj):
+    """
+    :param obj: a Sphere, Plane, AABB, CylinderY or TriangleMesh
+    :return: (array name, row without the material column). A mesh's row also lacks where its vertices and
+             triangles start, which saveScene adds.
+    """
+
+    if isinstance(obj, Sphere):
+        return "spheres", tuple(obj.mCenter) + (obj.mRadius,)
+    if isinstance(obj, Plane):
+        return "planes", tuple(obj.mNormal) + (obj.mD,)
+    if isinstance(obj, AABB):
+        return "aabbs", tuple(obj.mMinPt) + tuple(obj.mMaxPt)
+    if isinstance(obj, CylinderY):
+        return "cylinders", tuple(obj.mBase) + (obj.mHeight, obj.mRadius)
+    if isinstance(obj, TriangleMesh):
+        return "meshes", (len(obj.mVertices), len(obj.mIndices), obj.mMaxLeafSize)
+
+    raise TypeError("Can't save a %s to a scene file" % type(obj).__name__)
+
+
+def writeSceneFile(path, arrays):
+    """
+    Writes named arrays in the scene file layout
+    :param path: file to write
+    :param arrays: dict of name -> 2D float64 array
+    :return: None
+    """
+
+    header = {"version": VERSION, "arrays": {}}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        header["arrays"][name] = {"dtype": "<f8", "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+
+    headerBytes = json.dumps(header).encode("utf-8")
+    dataStart = -(-(len(MAGIC) + 4 + len(headerBytes)) // ALIGNMENT) * ALIGNMENT
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(headerBytes)))
+        f.write(headerBytes)
+        for name, array in arrays.items():
+            f.seek(dataStart + header["arrays"][name]["offset"])
+            f.write(np.ascontiguousarray(array, dtype="<f8").tobytes())
+
+
+def saveScene(RT, path):
+    """
+    Saves a Raytracer's objects, lights and camera, and its BVH so loading doesn't need to build one
+    :param RT: the Raytracer
+    :param path: file to write
+    :return: None
+    """
+
+    materialIndices = {}
+    materials = []
+    rows = {name: [] for name, cls in PRIMITIVES}
+    objectRows = {}
+    meshVertices = []
+    meshIndices = []
+    numMeshVertices = numMeshTriangles = 0
+
+    for obj in RT.mObjects:
+        material = obj.mMaterial
+        if id(material) not in materialIndices:
+            materialIndices[id(material)] = len(materials)
+            materials.append(tuple(material.mDiffuse) + tuple(material.mSpecular) +
+                             (material.mHardness, material.mReflectivity, material.mReflectionDepth))
+
+        name, row = getPrimitiveRow(obj)
+        if name == "meshes":
+            row += (numMeshVertices, numMeshTriangles)
+            meshVertices.append(obj.mVertices)
+            meshIndices.append(obj.mIndices)
+            numMeshVertices += len(obj.mVertices)
+            numMeshTriangles += len(obj.mIndices)
+        objectRows[id(obj)] = (name, len(rows[name]))
+        rows[name].append(row + (materialIndices[id(material)],))
+
+    # Where each object lands in the loaded list, which holds the arrays one after another
+    starts = {}
+    numObjects = 0
+    for name, cls in PRIMITIVES:
+        starts[name] = numObjects
+        numObjects += len(rows[name])
+
+    bvh = RT.getBVH()
+    bvhObjects = []
+    for obj in bvh.mObjects:
+        name, row = objectRows[id(getattr(obj, "mObject", obj))]
+        bvhObjects.append(starts[name] + row)
+
+    lights = []
+    spotlights = []
+    for light in RT.mLights:
+        row = tuple(light.mPos) + tuple(light.mDiffuse) + tuple(light.mSpecular)
+        lightRange = math.nan if light.mRange is None else light.mRange
+        if isinstance(light, Spotlight):
+            spotlights.append(row + (light.mInnerAngle, light.mOuterAngle) + tuple(light.mDirection) + (lightRange,))
+        else:
+            lights.append(row + (lightRange,))
+
+    arrays = {"materials": materials, "lights": lights, "spotlights": spotlights}
+    arrays.update(rows)
+    arrays = {name: np.array(values, dtype=float).reshape(-1, len(COLUMNS[name])) for name, values in arrays.items()}
+    arrays["meshVertices"] = np.concatenate(meshVertices) if meshVertices else np.zeros((0, 3))
+    arrays["meshIndices"] = np.concatenate(meshIndices).astype(float) if meshIndices else np.zeros((0, 3))
+    arrays["camera"] = np.array([tuple(RT.mCamPos) + tuple(RT.mCamCOI) + tuple(RT.mCamUp) + (RT.mCamFOV, RT.mCamNear)])
+    arrays["bvhNodes"] = np.hstack([np.array(bvh.mNodeMin, dtype=float).reshape(-1, 3),
+                                    np.array(bvh.mNodeMax, dtype=float).reshape(-1, 3)] +
+                                   [np.array(values, dtype=float).reshape(-1, 1) for values in
+                                    (bvh.mNodeLeft, bvh.mNodeRight, bvh.mNodeStart, bvh.mNodeCount)])
+    arrays["bvhObjects"] = np.array(bvhObjects, dtype=float).reshape(-1, 1)
+
+    writeSceneFile(path, arrays)
+
+
+def loadScene(RT, path):
+    """
+    :param RT: a Raytracer
+    :param path: a scene file written by saveScene
+    :return: the SceneFile, after loading it into RT
+    """
+
+    scene = SceneFile(path)
+    scene.loadInto(RT)
+    return scene
+
+
+class SceneFile(object):
+
+    def __init__(self, path):
+        """
+        Opens a scene file, memory-mapping its arrays. Only the header is read here, the arrays are
+        paged in by the OS as they are used, so opening takes the same time whatever the scene's size.
+        :param path: the file to open
+        :return: N/A
+        """
+
+        self.mPath = path
+        self.mArrays = {}
+
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not a scene file" % path)
+            headerLength, = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(headerLength).decode("utf-8"))
+
+        if header["version"] > VERSION:
+            raise ValueError("%s is scene file version %d, only %d is supported" % (path, header["version"], VERSION))
+
+        dataStart = -(-(len(MAGIC) + 4 + headerLength) // ALIGNMENT) * ALIGNMENT
+        for name, info in header["arrays"].items():
+            shape = tuple(info["shape"])
+            if shape[0] == 0:
+                self.mArrays[name] = np.zeros(shape)
+            else:
+                self.mArrays[name] = np.memmap(path, dtype=info["dtype"], mode="r",
+                                               offset=dataStart + info["offset"], shape=shape)
+
+    def getArray(self, name):
+        """
+        :param name: a key of COLUMNS
+        :return: the (rows, columns) array, empty if the file has none, with NaN for columns the file lacks
+        """
+
+        numColumns = len(COLUMNS[name])
+        if name not in self.mArrays:
+            return np.zeros((0, numColumns))
+
+        array = self.mArrays[name]
+        if array.shape[1] < numColumns:
+            # Written by an older version, without the last columns
+            array = np.hstack((array, np.full((len(array), numColumns - array.shape[1]), np.nan)))
+        return array
+
+    def __len__(self):
+        return sum(len(self.getArray(name)) for name, cls in PRIMITIVES)
+
+    def buildMaterials(self):
+        """
+        :return: a list of Materials, one per row of "materials"
+        """
+
+        return [Material(Vec3(dr, dg, db), Vec3(sr, sg, sb), hardness, reflectivity, int(reflectionDepth))
+                for dr, dg, db, sr, sg, sb, hardness, reflectivity, reflectionDepth in self.getArray("materials").tolist()]
+
+    def buildObjects(self):
+        """
+        Creates the scene objects, all of them at once. Rows are converted to Python floats a whole array
+        at a time and objects sharing a material row share one Material.
+        :return: a list of objects, planes first, then spheres, boxes, cylinders and meshes
+        """
+
+        materials = self.buildMaterials()
+        return [self.buildPrimitive(name, row, materials) for name, cls in PRIMITIVES for row in self.getArray(name).tolist()]
+
+    def buildPrimitive(self, name, row, materials):
+        """
+        :param name: the array the row is from, a name in PRIMITIVES
+        :param row: the row as a list of Python floats, material column included
+        :param materials: the file's Materials, from buildMaterials
+        :return: the object
+        """
+
+        material = materials[int(row[-1])]
+        if name == "planes":
+            x, y, z, d = row[:-1]
+            return Plane(Vec3(x, y, z), d, material)
+        if name == "spheres":
+            x, y, z, radius = row[:-1]
+            return Sphere(Vec3(x, y, z), radius, material)
+        if name == "aabbs":
+            x0, y0, z0, x1, y1, z1 = row[:-1]
+            return AABB(Vec3(x0, y0, z0), Vec3(x1, y1, z1), material)
+        if name == "cylinders":
+            x, y, z, height, radius = row[:-1]
+            return CylinderY(Vec3(x, y, z), height, radius, material)
+        if name == "meshes":
+            numVertices, numTriangles, maxLeafSize, firstVertex, firstTriangle = (int(value) for value in row[:-1])
+            vertices = self.getArray("meshVertices")[firstVertex:firstVertex + numVertices]
+            indices = self.getArray("meshIndices")[firstTriangle:firstTriangle + numTriangles]
+            return TriangleMesh(vertices, indices, material, maxLeafSize)
+
+        raise ValueError("Unknown primitive array %r" % name)
+
+    def getObjects(self):
+        """
+        :return: a SceneObjectList of the scene objects, none of them built yet
+        """
+
+        return SceneObjectList(self)
+
+    def buildLights(self):
+        """
+        :return: a list of Lights and Spotlights
+        """
+
+        lights = [Light(Vec3(x, y, z), Vec3(dr, dg, db), Vec3(sr, sg, sb), None if math.isnan(r) else r)
+                  for x, y, z, dr, dg, db, sr, sg, sb, r in self.getArray("lights").tolist()]
+
+        for x, y, z, dr, dg, db, sr, sg, sb, inner, outer, dx, dy, dz, r in self.getArray("spotlights").tolist():
+            lights.append(Spotlight(Vec3(x, y, z), Vec3(dr, dg, db), Vec3(sr, sg, sb), inner, outer,
+                                    Vec3(dx, dy, dz), True, None if math.isnan(r) else r))
+
+        return lights
+
+    def loadInto(self, RT):
+        """
+        Replaces RT's objects and lights with the file's and sets its camera. The objects are a
+        SceneObjectList, built as they're read. RT remembers the file, so until mObjects is changed (see
+        Raytracer.markObjectsDirty) its BVH is the one stored in the file, and worker processes it is sent
+        open the file themselves instead of unpickling the objects.
+        :param RT: a Raytracer
+        :return: None
+        """
+
+        RT.mObjects = self.getObjects()
+        RT.mLights = self.buildLights()
+
+        camera = self.getArray("camera")
+        if len(camera):
+            posX, posY, posZ, coiX, coiY, coiZ, upX, upY, upZ, fov, near = camera[0].tolist()
+            RT.mCamUp = Vec3(upX, upY, upZ)
+            RT.setCamera(Vec3(posX, posY, posZ), Vec3(coiX, coiY, coiZ), RT.mCamUp, fov, near)
+
+        RT.mSceneFile = self.mPath
+        RT.mSceneFileSource = RT.mObjects
+        RT.mSceneFileVersion = RT.mObjects.mVersion
+
+
+class ChunkedRows(object):
+
+    def __init__(self, array, dtype=float):
+        """
+        Read-only sequence of an array's rows as Python values, for code written against lists. Rows are
+        converted CHUNK_SIZE at a time the first time one of them is read, so a memory-mapped array is
+        only paged in where it is used.
+        :param array: a 2D array, whose rows are read as lists, or a 1D array, whose elements are read as scalars
+        :param dtype: type the values are converted to, e.g. int for indices stored as floats
+        :return: N/A
+        """
+
+        self.mArray = array
+        self.mDtype = dtype
+        self.mChunks = {}
+
+    def __len__(self):
+        return len(self.mArray)
+
+    def __getitem__(self, index):
+        chunkIndex, offset = divmod(index, CHUNK_SIZE)
+        chunk = self.mChunks.get(chunkIndex)
+        if chunk is None:
+            start = chunkIndex * CHUNK_SIZE
+            chunk = self.mChunks[chunkIndex] = self.mArray[start:start + CHUNK_SIZE].astype(self.mDtype).tolist()
+        return chunk[offset]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.mArray, dtype=dtype or self.mDtype)
+
+
+class LeafObjects(object):
+
+    def __init__(self, objects, order):
+        """
+        Read-only sequence of objects in a stored BVH's leaf order, read through from the loaded list
+        :param objects: a SceneObjectList
+        :param order: sequence of indices into objects, one per BVH position
+        :return: N/A
+        """
+
+        self.mObjects = objects
+        self.mOrder = order
+
+    def __len__(self):
+        return len(self.mOrder)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.mObjects[self.mOrder[i]] for i in range(*index.indices(len(self)))]
+        if not 0 <= index < len(self):
+            raise IndexError("BVH position out of range")
+        return self.mObjects[self.mOrder[index]]
+
+
+class SceneObjectList(ObjectList):
+    """
+    The objects of a SceneFile, each built from its row the first time it is read. Indexing builds only
+    what it returns and appending builds nothing; anything else that reads or moves the whole list
+    (iterating, searching, removing, sorting) builds every object first. Pickles as a plain ObjectList.
+    """
+
+    def __init__(self, scene):
+        ObjectList.__init__(self, [None] * len(scene))
+        self.mScene = scene
+        self.mMaterials = scene.buildMaterials()
+        self.mNumUnbuilt = len(self)
+        self.mReflectionArrays = None
+
+        # First index of each primitive array's objects
+        self.mStarts = []
+        numObjects = 0
+        for name, cls in PRIMITIVES:
+            self.mStarts.append(numObjects)
+            numObjects += len(scene.getArray(name))
+
+    def buildObject(self, index):
+        """
+        :param index: a non-negative index of an object not built yet
+        :return: the object, now stored in the list
+        """
+
+        kind = bisect.bisect_right(self.mStarts, index) - 1
+        name, cls = PRIMITIVES[kind]
+        obj = self.mScene.buildPrimitive(name, self.mScene.getArray(name)[index - self.mStarts[kind]].tolist(), self.mMaterials)
+        list.__setitem__(self, index, obj)
+        self.mNumUnbuilt -= 1
+        return obj
+
+    def buildAll(self):
+        """
+        Builds every object not built yet, a whole array's rows converted at a time
+        :return: None
+        """
+
+        if not self.mNumUnbuilt:
+            return
+
+        for (name, cls), start in zip(PRIMITIVES, self.mStarts):
+            for i, row in enumerate(self.mScene.getArray(name).tolist(), start):
+                if list.__getitem__(self, i) is None:
+                    list.__setitem__(self, i, self.mScene.buildPrimitive(name, row, self.mMaterials))
+
+        self.mNumUnbuilt = 0
+
+    def getNumBuilt(self):
+        """
+        :return: how many objects have been built
+        """
+
+        return len(self) - self.mNumUnbuilt
+
+    def getStoredBVH(self):
+        """
+        Makes a BVH over the file's stored tree. Node data is read through ChunkedRows and objects through
+        LeafObjects, so nothing is read or built until a ray visits it.
+        :return: (BVH, (N,) array of the index in this list of each BVH position, list of the indices of the
+                 unbounded objects), or None if the file has no stored tree
+        """
+
+        scene = self.mScene
+        if "bvhNodes" not in scene.mArrays or "bvhObjects" not in scene.mArrays:
+            return None
+
+        nodes = scene.getArray("bvhNodes")
+        order = scene.getArray("bvhObjects")[:, 0]
+        bvh = BVH(LeafObjects(self, ChunkedRows(order, int)), nodes=(
+            ChunkedRows(nodes[:, 0:3]), ChunkedRows(nodes[:, 3:6]), ChunkedRows(nodes[:, 6], int),
+            ChunkedRows(nodes[:, 7], int), ChunkedRows(nodes[:, 8], int), ChunkedRows(nodes[:, 9], int)))
+
+        # Planes are the only unbounded primitive that can be hit, and come first. Meshes without triangles
+        # are unbounded too but never hit, so can be left out.
+        return bvh, order.astype(int), list(range(len(scene.getArray("planes"))))
+
+    def getReflectionArrays(self):
+        """
+        Raytracer.getReflectionArrays worked out from the file's arrays, without building any objects
+        :return: (reflectivity, reflectionDepth) arrays, one entry per object
+        """
+
+        if self.mReflectionArrays is None:
+            materials = self.mScene.getArray("materials")
+            rows = np.concatenate([self.mScene.getArray(name)[:, -1] for name, cls in PRIMITIVES]).astype(int)
+            self.mReflectionArrays = (materials[rows, 7].astype(float), materials[rows, 8].astype(int))
+        return self.mReflectionArrays
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            for i in range(*index.indices(len(self))):
+                if list.__getitem__(self, i) is None:
+                    self.buildObject(i)
+            return list.__getitem__(self, index)
+
+        obj = list.__getitem__(self, index)
+        if obj is None:
+            obj = self.buildObject(index % len(self))
+        return obj
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            self.buildAll()
+        elif list.__getitem__(self, key) is None:
+            self.mNumUnbuilt -= 1
+        ObjectList.__setitem__(self, key, value)
+
+    def __iter__(self):
+        self.buildAll()
+        return list.__iter__(self)
+
+    def __reversed__(self):
+        self.buildAll()
+        return list.__reversed__(self)
+
+    def __contains__(self, item):
+        self.buildAll()
+        return list.__contains__(self, item)
+
+    def __eq__(self, other):
+        self.buildAll()
+        return list.__eq__(self, other)
+
+    def __ne__(self, other):
+        self.buildAll()
+        return list.__ne__(self, other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        self.buildAll()
+        return list.__repr__(self)
+
+    def __add__(self, other):
+        self.buildAll()
+        return list.__add__(self, other)
+
+    def __reduce_ex__(self, protocol):
+        self.buildAll()
+        return ObjectList, (list(list.__iter__(self)),), {"mVersion": self.mVersion}
+
+    def __delitem__(self, key):
+        self.buildAll()
+        ObjectList.__delitem__(self, key)
+
+    def index(self, *args):
+        self.buildAll()
+        return list.index(self, *args)
+
+    def count(self, item):
+        self.buildAll()
+        return list.count(self, item)
+
+    def copy(self):
+        self.buildAll()
+        return list.copy(self)
+
+    def insert(self, index, item):
+        self.buildAll()
+        ObjectList.insert(self, index, item)
+
+    def remove(self, item):
+        self.buildAll()
+        ObjectList.remove(self, item)
+
+    def pop(self, index=-1):
+        self.buildAll()
+        return ObjectList.pop(self, index)
+
+    def clear(self):
+        self.mNumUnbuilt = 0
+        ObjectList.clear(self)
+
+    def sort(self, *args, **kwargs):
+        self.buildAll()
+        ObjectList.sort(self, *args, **kwargs)
+
+    def reverse(self):
+        self.buildAll()
+        ObjectList.reverse(self)
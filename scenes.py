@@ -0,0 +1,187 @@
+import math
+from math3d import VectorN
+from objects3d import *
+from mesh import TriangleMesh, loadOBJ, makeTorus
+
+
+def buildDefaultScene(RT):
+    """
+    The scene main.py renders: a matte ground plane, a sphere, a box and a cylinder under one spotlight
+    :param RT: the Raytracer to fill, its camera is set too
+    :return: None
+    """
+
+    RT.mObjects.append(Plane(VectorN((0,1,0)), 0, Material(VectorN((1,1,0)), reflectivity=0)))
+    RT.mObjects.append(Sphere(VectorN((0,0,0)), 10, Material(VectorN((1,0,0)))))
+    RT.mObjects.append(AABB(VectorN((25,5,0)), VectorN((40,25,20)), Material(VectorN((0,1,0)))))
+    RT.mObjects.append(CylinderY(VectorN((-17,6,30)), 22.0, 15.0, Material(VectorN((0.7,0.7,1)))))
+
+    RT.mLights.append(Spotlight(VectorN((0, 55, 0)), VectorN((.5,1,1)), VectorN((1,1,1)), 30, 70, VectorN((0, -1, 0)), isNormalized=True))
+    # RT.mLights.append(Light(VectorN((-10,3,-20)), VectorN((1,1,1)), VectorN((1,1,1))))
+
+    RT.setCamera(VectorN((0, 3, -50)), VectorN((0, 0, 1)), VectorN((0, 1, 0)), 60.0, 1.0)
+
+
+def tweenDefaultScene(RT, numFrames):
+    """
+    Swings the default scene's camera round to look at the cylinder
+    :param RT: a Raytracer set up by buildDefaultScene
+    :param numFrames: how many frames the tween takes
+    :return: None
+    """
+
+    RT.setCameraTweenDest(numFrames, camCOI=VectorN((-17, 6, 30)))
+
+
+def buildSphereGridScene(RT, gridSize=8):
+    """
+    A dense gridSize^3 lattice of small spheres over a ground plane, lit by one point light
+    :param RT: the Raytracer to fill, its camera is set too
+    :param gridSize: spheres along each side of the lattice
+    :return: None
+    """
+
+    RT.mObjects.append(Plane(VectorN((0,1,0)), -2, Material(VectorN((.8,.8,.8)))))
+
+    spacing = 6.0
+    offset = (gridSize - 1) * spacing / 2
+    for i in range(gridSize):
+        for j in range(gridSize):
+            for k in range(gridSize):
+                color = VectorN((i / gridSize, j / gridSize, k / gridSize))
+                center = VectorN((i*spacing - offset, j*spacing, k*spacing - offset))
+                RT.mObjects.append(Sphere(center, 2.0, Material(color)))
+
+    RT.mLights.append(Light(VectorN((-40, 80, -60)), VectorN((1,1,1)), VectorN((1,1,1))))
+    RT.setCamera(VectorN((30, 40, -90)), VectorN((0, offset, 0)), VectorN((0, 1, 0)), 60.0, 1.0)
+
+
+def buildBoxScene(RT, numBoxes=20):
+    """
+    A numBoxes x numBoxes city block of AABBs of varying heights on a ground plane
+    :param RT: the Raytracer to fill, its camera is set too
+    :param numBoxes: boxes along each side of the block
+    :return: None
+    """
+
+    RT.mObjects.append(Plane(VectorN((0,1,0)), 0, Material(VectorN((.4,.4,.4)))))
+
+    spacing = 8.0
+    offset = numBoxes * spacing / 2
+    for i in range(numBoxes):
+        for k in range(numBoxes):
+            height = 4 + 20 * abs(math.sin(i * 1.7 + k * 0.9))
+            minPt = VectorN((i*spacing - offset, 0, k*spacing - offset))
+            maxPt = minPt + VectorN((5, height, 5))
+            RT.mObjects.append(AABB(minPt, maxPt, Material(VectorN((.3 + .7*(i % 3)/2, .6, .3 + .7*(k % 2))))))
+
+    RT.mLights.append(Light(VectorN((60, 120, -80)), VectorN((1,1,1)), VectorN((1,1,1))))
+    RT.setCamera(VectorN((0, 70, -110)), VectorN((0, 0, 0)), VectorN((0, 1, 0)), 60.0, 1.0)
+
+
+def buildManyLightsScene(RT, numLights=32, lightRange=None):
+    """
+    The default scene's objects under a ring of numLights coloured spotlights
+    :param RT: the Raytracer to fill, its camera is set too
+    :param numLights: how many spotlights in the ring
+    :param lightRange: attenuation range of the spotlights, None for none
+    :return: None
+    """
+
+    buildDefaultScene(RT)
+    RT.mLights[:] = []
+
+    for i in range(numLights):
+        angle = 2 * math.pi * i / numLights
+        pos = VectorN((60 * math.cos(angle), 40, 60 * math.sin(angle) + 10))
+        color = VectorN((.5 + .5*math.cos(angle), .5 + .5*math.sin(angle), .5)) / numLights * 4
+        direction = VectorN((0, 0, 10)) - pos
+        RT.mLights.append(Spotlight(pos, color, color, 20, 40, direction, range=lightRange))
+
+
+def buildStreetLightsScene(RT, gridSize=16, lightRange=30.0):
+    """
+    The default scene's objects under a gridSize x gridSize field of small downward spotlights,
+    each with an attenuation range, so any point is in reach of only a few of them
+    :param RT: the Raytracer to fill, its camera is set too
+    :param gridSize: spotlights along each side of the field
+    :param lightRange: attenuation range of the spotlights
+    :return: None
+    """
+
+    buildDefaultScene(RT)
+    RT.mLights[:] = []
+
+    spacing = 120.0 / gridSize
+    for i in range(gridSize):
+        for k in range(gridSize):
+            pos = VectorN((-60 + (i + .5) * spacing, 20, -30 + (k + .5) * spacing))
+            color = VectorN((.3 + .2*i/gridSize, .4, .3 + .2*k/gridSize))
+            RT.mLights.append(Spotlight(pos, color, color, 40, 60, VectorN((0, -1, 0)), isNormalized=True, range=lightRange))
+
+
+def buildReflectionScene(RT):
+    """
+    A tight cluster of spheres over a plane, so most rays bounce between them several times
+    :param RT: the Raytracer to fill, its camera is set too
+    :return: None
+    """
+
+    RT.mObjects.append(Plane(VectorN((0,1,0)), 0, Material(VectorN((.9,.9,.9)))))
+
+    for i in range(3):
+        for k in range(3):
+            for j in range(2):
+                center = VectorN(((i - 1) * 10.5, 5 + j * 10.5, (k - 1) * 10.5 + (5 if j else 0)))
+                RT.mObjects.append(Sphere(center, 5, Material(VectorN((.2 + .4*i, .9 - .3*k, .5 + .4*j)), hardness=60, reflectionDepth=4)))
+
+    RT.mLights.append(Light(VectorN((20, 60, -40)), VectorN((1,1,1)), VectorN((1,1,1))))
+    RT.setCamera(VectorN((5, 18, -32)), VectorN((0, 8, 0)), VectorN((0, 1, 0)), 60.0, 1.0)
+
+
+def buildMeshScene(RT, objPath=None, rings=250, sides=200):
+    """
+    A triangle mesh standing on a ground plane, by default a rings x sides torus (100k triangles at the
+    default size). An OBJ file is scaled to about 30 units across and stood on the plane.
+    :param RT: the Raytracer to fill, its camera is set too
+    :param objPath: a Wavefront OBJ file to show instead of the torus
+    :param rings: segments round the torus
+    :param sides: segments round the torus's tube
+    :return: None
+    """
+
+    RT.mObjects.append(Plane(VectorN((0,1,0)), 0, Material(VectorN((.6,.6,.6)), reflectivity=0)))
+
+    if objPath is None:
+        vertices, indices = makeTorus(12, 5, rings, sides)
+        # Stand it on edge, facing the camera
+        vertices = vertices[:, [0, 2, 1]] + (0, 17, 0)
+        indices = indices[:, ::-1]
+    else:
+        vertices, indices = loadOBJ(objPath)
+        low = vertices.min(axis=0)
+        high = vertices.max(axis=0)
+        vertices = (vertices - (low + high) / 2) * (30 / max((high - low).max(), 1e-9))
+        vertices[:, 1] -= vertices[:, 1].min()
+
+    RT.mObjects.append(TriangleMesh(vertices, indices, Material(VectorN((.9,.5,.3)), hardness=40, reflectivity=.2)))
+
+    RT.mLights.append(Light(VectorN((-30, 60, -50)), VectorN((1,1,1)), VectorN((1,1,1))))
+    RT.setCamera(VectorN((0, 25, -60)), VectorN((0, 14, 0)), VectorN((0, 1, 0)), 60.0, 1.0)
+
+
+# Scene builders by name, for the command line tools
+SCENES = {
+    "default": buildDefaultScene,
+    "spheregrid": buildSphereGridScene,
+    "boxes": buildBoxScene,
+    "manylights": buildManyLightsScene,
+    "streetlights": buildStreetLightsScene,
+    "reflections": buildReflectionScene,
+    "mesh": buildMeshScene,
+}
+
+# Camera tweens by scene name, for scenes that have one
+TWEENS = {
+    "default": tweenDefaultScene,
+}
@@ -0,0 +1,584 @@
+"""
+Render server: takes render jobs over HTTP on localhost, so other tools can ask for images without
+editing main.py. Jobs are queued and rendered one after another, each split into bands of rows over a
+pool of worker processes. Workers keep the scenes they have built, so another camera on the same
+scene only costs the render.
+
+    python server.py --port 8765 --workers 4
+
+    curl -d '{"scene": "default", "width": 320, "height": 240}' localhost:8765/render -o out.png
+    curl -d '{"scene": "boxes", "camera": {"camPos": [0, 40, -90], "camCOI": [0, 0, 0]}}' localhost:8765/jobs
+    curl localhost:8765/jobs/1/events                  # progress, one JSON object per line
+    curl localhost:8765/jobs/1/image -o out.png
+
+A job is a JSON object:
+    scene       a name from scenes.SCENES, or {"sceneFile": path} or {"obj": path}
+    camera      optional, any of setCamera's camPos, camCOI, camUp, camFOV and camNear,
+                the scene's own camera is used for the rest
+    width, height, toneMap, exposure, format ("png", "jpg", "bmp" or "tga"), packets (true to trace with
+                renderPackets' packet tracing)
+
+Finished images are cached by everything in the job that affects them, a scene or OBJ file's
+modification time and size included, so asking again for the same scene and camera is answered without
+rendering, and a job identical to one still in the queue joins it. Only the last FINISHED_JOBS finished
+jobs can be fetched by id, older ones answer 404.
+"""
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import argparse, asyncio, io, itertools, json, math, sys, time, traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import pygame
+import raytracer, scenes, scenefile
+from animation import getCameraState, setCameraState
+from framebuffer import FrameBuffer, TONE_MAPS
+
+# Rows per task handed to the workers
+BAND_HEIGHT = 16
+# Scenes each worker process keeps built, the least recently used is dropped past this
+WORKER_SCENES = 4
+# Finished images kept by the server
+CACHE_SIZE = 64
+# Finished jobs kept by the server for their status and image, the oldest is dropped past this
+FINISHED_JOBS = 256
+
+IMAGE_FORMATS = {"png": "image/png", "jpg": "image/jpeg", "bmp": "image/bmp", "tga": "image/x-tga"}
+CAMERA_FIELDS = ("camPos", "camCOI", "camUp", "camFOV", "camNear")
+
+# The Raytracers a worker process has built, by scene key and size, see getWorkerScene
+_workerScenes = OrderedDict()
+
+
+def buildScene(RT, scene):
+    """
+    Fills a Raytracer from a job's scene description
+    :param RT: a new Raytracer
+    :param scene: a name from scenes.SCENES, or a dict with a "sceneFile" or "obj" path
+    :return: None
+    """
+
+    if isinstance(scene, str):
+        scenes.SCENES[scene](RT)
+    elif "sceneFile" in scene:
+        scenefile.loadScene(RT, scene["sceneFile"])
+    else:
+        scenes.buildMeshScene(RT, scene["obj"])
+
+
+def getWorkerScene(sceneKey, scene, width, height):
+    """
+    :param sceneKey: the job's scene key, see RenderJob
+    :param scene: the job's scene description
+    :param width: width of the image
+    :param height: height of the image
+    :return: (this worker's Raytracer for the scene at that size, the scene's own camera state),
+             built on first use
+    """
+
+    key = (sceneKey, width, height)
+    entry = _workerScenes.get(key)
+    if entry is None:
+        RT = raytracer.Raytracer(pygame.Surface((width, height)))
+        buildScene(RT, scene)
+        RT.getBVH()
+        entry = _workerScenes[key] = RT, getCameraState(RT)
+        while len(_workerScenes) > WORKER_SCENES:
+            _workerScenes.popitem(last=False)
+
+    _workerScenes.move_to_end(key)
+    return entry
+
+
+def _renderBandInWorker(sceneKey, scene, camera, width, height, band, packets):
+    RT, sceneCamera = getWorkerScene(sceneKey, scene, width, height)
+    setCameraState(RT, getJobCamera(sceneCamera, camera))
+
+    lightIndex = RT.getSnapshot().mLightIndex if packets else None
+    colors = RT.shadeGBuffer(RT.traceGBuffer(band, packets), packets, lightIndex)
+    return band, colors.reshape(band[3], band[2], 3)
+
+
+def getSceneKey(scene):
+    """
+    :param scene: a job's scene description
+    :return: a string that is equal for two jobs only if their scenes build the same: the description,
+             and for a scene or OBJ file also the file's modification time and size, so a rewritten
+             file is loaded again
+    """
+
+    key = [scene]
+    if isinstance(scene, dict):
+        try:
+            stat = os.stat(next(iter(scene.values())))
+            key.append([stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            # Left for the worker to fail on, with the error in the job's status
+            key.append(None)
+
+    return json.dumps(key, sort_keys=True)
+
+
+def isNumber(value):
+    """
+    :param value: a decoded JSON value
+    :return: True for a finite number, JSON's true and false not counting
+    """
+
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def getJobCamera(sceneCamera, camera):
+    """
+    :param sceneCamera: the scene's own camera, from getCameraState
+    :param camera: the job's camera dict, any of CAMERA_FIELDS
+    :return: the camera state to render with
+    """
+
+    return tuple(camera.get(field, value) for field, value in zip(CAMERA_FIELDS, sceneCamera))
+
+
+def parseJob(request):
+    """
+    Checks a job's JSON and fills in its defaults
+    :param request: the decoded JSON object
+    :return: the job as a dict with every field set
+    """
+
+    if not isinstance(request, dict):
+        raise ValueError("a job must be a JSON object")
+
+    unknown = set(request) - {"scene", "camera", "width", "height", "toneMap", "exposure", "format", "packets"}
+    if unknown:
+        raise ValueError("unknown job fields: %s" % ", ".join(sorted(unknown)))
+
+    scene = request.get("scene", "default")
+    if isinstance(scene, str):
+        if scene not in scenes.SCENES:
+            raise ValueError("unknown scene %r, expected one of %s" % (scene, ", ".join(sorted(scenes.SCENES))))
+    elif not (isinstance(scene, dict) and len(scene) == 1 and isinstance(scene.get("sceneFile", scene.get("obj")), str)):
+        raise ValueError('scene must be a scene name, {"sceneFile": path} or {"obj": path}')
+
+    camera = request.get("camera", {})
+    if not isinstance(camera, dict) or set(camera) - set(CAMERA_FIELDS):
+        raise ValueError("camera must be an object with any of %s" % ", ".join(CAMERA_FIELDS))
+    for field in ("camPos", "camCOI", "camUp"):
+        value = camera.get(field, [0, 0, 0])
+        if not (isinstance(value, list) and len(value) == 3 and all(isNumber(x) for x in value)):
+            raise ValueError("camera %s must be a list of 3 numbers" % field)
+    for field in ("camFOV", "camNear"):
+        if not isNumber(camera.get(field, 1)):
+            raise ValueError("camera %s must be a number" % field)
+
+    size = request.get("width", 300), request.get("height", 200)
+    if not all(isNumber(value) and value == int(value) and 0 < value <= 8192 for value in size):
+        raise ValueError("width and height must be whole numbers between 1 and 8192")
+    exposure = request.get("exposure", 1.0)
+    if not isNumber(exposure):
+        raise ValueError("exposure must be a number")
+
+    job = {
+        "scene": scene,
+        "camera": camera,
+        "width": int(size[0]),
+        "height": int(size[1]),
+        "toneMap": request.get("toneMap", "clamp"),
+        "exposure": float(exposure),
+        "format": request.get("format", "png"),
+        "packets": bool(request.get("packets", False)),
+    }
+
+    if not (isinstance(job["toneMap"], str) and job["toneMap"] in TONE_MAPS):
+        raise ValueError("toneMap must be one of %s" % ", ".join(sorted(TONE_MAPS)))
+    if not (isinstance(job["format"], str) and job["format"] in IMAGE_FORMATS):
+        raise ValueError("format must be one of %s" % ", ".join(sorted(IMAGE_FORMATS)))
+
+    return job
+
+
+def encodeImage(frameBuffer, imageFormat):
+    """
+    :param frameBuffer: a FrameBuffer holding the finished image
+    :param imageFormat: a key of IMAGE_FORMATS
+    :return: the image file's bytes
+    """
+
+    surface = pygame.Surface((frameBuffer.mWidth, frameBuffer.mHeight))
+    frameBuffer.present(surface)
+
+    data = io.BytesIO()
+    pygame.image.save(surface, data, "image." + imageFormat)
+    return data.getvalue()
+
+
+class RenderJob(object):
+
+    def __init__(self, jobId, job):
+        """
+        A queued or finished render and its progress
+        :param jobId: the id the job is fetched by
+        :param job: the dict from parseJob
+        :return: N/A
+        """
+
+        self.mId = jobId
+        self.mJob = job
+        # Everything that decides the image, so equal keys give equal images
+        self.mSceneKey = getSceneKey(job["scene"])
+        self.mKey = json.dumps([job, self.mSceneKey], sort_keys=True)
+
+        self.mState = "queued"        # queued, rendering, done or failed
+        self.mProgress = 0.0
+        self.mCached = False
+        self.mImage = None
+        self.mError = None
+        self.mSeconds = 0.0
+        self.mChanged = asyncio.Condition()
+
+    def getStatus(self):
+        """
+        :return: a JSON-able dict of the job's state
+        """
+
+        status = {"job": self.mId, "state": self.mState, "progress": round(self.mProgress, 4), "cached": self.mCached}
+        if self.mState == "done":
+            status["image"] = "/jobs/%d/image" % self.mId
+            status["seconds"] = round(self.mSeconds, 3)
+        elif self.mState == "failed":
+            status["error"] = self.mError
+        return status
+
+    def isFinished(self):
+        return self.mState in ("done", "failed")
+
+    async def update(self, **fields):
+        """
+        Changes some of the job's members and wakes everything waiting on it
+        :param fields: member names without the "m" and their new values, e.g. state="done"
+        :return: None
+        """
+
+        for name, value in fields.items():
+            setattr(self, "m" + name[0].upper() + name[1:], value)
+
+        async with self.mChanged:
+            self.mChanged.notify_all()
+
+    async def waitForChange(self, status):
+        """
+        :param status: the last getStatus seen
+        :return: the next getStatus that differs from it
+        """
+
+        async with self.mChanged:
+            await self.mChanged.wait_for(lambda: self.getStatus() != status)
+        return self.getStatus()
+
+
+class RenderServer(object):
+
+    def __init__(self, numWorkers=None, cacheSize=CACHE_SIZE, finishedJobs=FINISHED_JOBS):
+        """
+        The job queue, worker pool and image cache behind the HTTP handlers
+        :param numWorkers: worker processes, defaults to the number of CPUs
+        :param cacheSize: finished images to keep
+        :param finishedJobs: finished jobs to keep fetchable by id
+        :return: N/A
+        """
+
+        self.mNumWorkers = numWorkers or os.cpu_count() or 1
+        self.mCacheSize = cacheSize
+        self.mNumFinishedJobs = finishedJobs
+        self.mExecutor = None
+        self.mQueue = None
+        self.mDispatcher = None
+        self.mJobs = {}                 # Queued, rendering and the last mNumFinishedJobs finished jobs by id
+        self.mFinishedJobIds = OrderedDict()
+        self.mJobIds = itertools.count(1)
+        self.mCache = OrderedDict()     # Image bytes by RenderJob.mKey
+        self.mPending = {}              # Queued or rendering jobs by key, so an identical job can join one
+
+    async def start(self):
+        self.mExecutor = ProcessPoolExecutor(max_workers=self.mNumWorkers)
+        self.mQueue = asyncio.Queue()
+        self.mDispatcher = asyncio.ensure_future(self.dispatchJobs())
+
+    async def stop(self):
+        self.mDispatcher.cancel()
+        self.mExecutor.shutdown(cancel_futures=True)
+
+    async def submit(self, request):
+        """
+        Queues a job, unless its image is cached or an identical job is already queued or rendering
+        :param request: the job's decoded JSON
+        :return: a RenderJob
+        """
+
+        job = RenderJob(0, parseJob(request))
+
+        pending = self.mPending.get(job.mKey)
+        if pending is not None:
+            return pending
+
+        job.mId = next(self.mJobIds)
+        self.mJobs[job.mId] = job
+
+        image = self.mCache.get(job.mKey)
+        if image is not None:
+            self.mCache.move_to_end(job.mKey)
+            await job.update(state="done", progress=1.0, cached=True, image=image)
+            self.finishJob(job)
+            return job
+
+        self.mPending[job.mKey] = job
+        await self.mQueue.put(job)
+        return job
+
+    async def dispatchJobs(self):
+        """
+        Renders queued jobs one at a time, each over the whole worker pool
+        :return: never
+        """
+
+        while True:
+            job = await self.mQueue.get()
+            try:
+                await self.renderJob(job)
+            except Exception as e:
+                await job.update(state="failed", error="%s: %s" % (type(e).__name__, e))
+            finally:
+                del self.mPending[job.mKey]
+                self.finishJob(job)
+
+    def finishJob(self, job):
+        """
+        Keeps a finished job fetchable by id, dropping the oldest finished jobs past mNumFinishedJobs. Requests
+        already holding a dropped job still get its status and image.
+        :param job: a RenderJob that has just finished
+        :return: None
+        """
+
+        self.mFinishedJobIds[job.mId] = None
+        while len(self.mFinishedJobIds) > self.mNumFinishedJobs:
+            jobId, _ = self.mFinishedJobIds.popitem(last=False)
+            del self.mJobs[jobId]
+
+    async def renderJob(self, job):
+        """
+        Splits a job into bands of rows, renders them on the workers and encodes the image
+        :param job: a RenderJob
+        :return: None
+        """
+
+        settings = job.mJob
+        width = settings["width"]
+        height = settings["height"]
+        frameBuffer = FrameBuffer(width, height, settings["toneMap"], settings["exposure"])
+        bands = [(0, y, width, min(BAND_HEIGHT, height - y)) for y in range(0, height, BAND_HEIGHT)]
+
+        start = time.perf_counter()
+        await job.update(state="rendering")
+
+        loop = asyncio.get_running_loop()
+        finished = 0
+
+        async def renderBand(band):
+            nonlocal finished
+            (x, y, bandWidth, bandHeight), colors = await loop.run_in_executor(
+                self.mExecutor, _renderBandInWorker, job.mSceneKey, settings["scene"], settings["camera"],
+                width, height, band, settings["packets"])
+            frameBuffer.mPixels[y:y + bandHeight, x:x + bandWidth] = colors
+            finished += 1
+            await job.update(progress=finished / len(bands))
+
+        tasks = [asyncio.ensure_future(renderBand(band)) for band in bands]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # One failed band fails the job. The other bands are cancelled, so those not started yet never
+            # run and the results of those already running are dropped, and gathered so none is left unawaited
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        image = encodeImage(frameBuffer, settings["format"])
+        self.mCache[job.mKey] = image
+        while len(self.mCache) > self.mCacheSize:
+            self.mCache.popitem(last=False)
+
+        await job.update(state="done", image=image, seconds=time.perf_counter() - start)
+
+    async def handleConnection(self, reader, writer):
+        """
+        Serves one HTTP request and closes the connection
+        """
+
+        try:
+            method, path, body = await readRequest(reader)
+            await self.route(writer, method, path, body)
+        except ValueError as e:
+            await writeResponse(writer, 400, {"error": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            traceback.print_exc()
+            try:
+                await writeResponse(writer, 500, {"error": "%s: %s" % (type(e).__name__, e)})
+            except ConnectionError:
+                pass
+        finally:
+            writer.close()
+
+    async def route(self, writer, method, path, body):
+        """
+        POST /render        queue a job and answer with its image once done
+        POST /jobs          queue a job and answer with its status straight away
+        GET  /jobs/ID       the job's status
+        GET  /jobs/ID/events  the job's status, then again every time it changes, until it finishes
+        GET  /jobs/ID/image   the job's image once done
+        """
+
+        parts = path.split("?")[0].strip("/").split("/")
+
+        if method == "POST" and parts in (["render"], ["jobs"]):
+            try:
+                request = json.loads(body or b"{}")
+            except json.JSONDecodeError as e:
+                raise ValueError("the body must be JSON: %s" % e)
+            job = await self.submit(request)
+            if parts == ["jobs"]:
+                await writeResponse(writer, 202, job.getStatus())
+            else:
+                await self.writeImage(writer, job)
+            return
+
+        if method == "GET" and len(parts) in (2, 3) and parts[0] == "jobs" and parts[1].isdigit():
+            job = self.mJobs.get(int(parts[1]))
+            if job is None:
+                await writeResponse(writer, 404, {"error": "no job %s" % parts[1]})
+            elif len(parts) == 2:
+                await writeResponse(writer, 200, job.getStatus())
+            elif parts[2] == "events":
+                await self.writeEvents(writer, job)
+            elif parts[2] == "image":
+                await self.writeImage(writer, job)
+            else:
+                await writeResponse(writer, 404, {"error": "not found"})
+            return
+
+        await writeResponse(writer, 404, {"error": "not found"})
+
+    async def writeImage(self, writer, job):
+        """
+        Waits for a job to finish and sends its image, or its error
+        """
+
+        status = job.getStatus()
+        while not job.isFinished():
+            status = await job.waitForChange(status)
+
+        if job.mState == "failed":
+            await writeResponse(writer, 500, status)
+            return
+
+        headers = {"X-Render-Job": str(job.mId), "X-Render-Cached": "true" if job.mCached else "false"}
+        await writeResponse(writer, 200, job.mImage, IMAGE_FORMATS[job.mJob["format"]], headers)
+
+    async def writeEvents(self, writer, job):
+        """
+        Streams a job's status as newline separated JSON, chunked, until it finishes
+        """
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n"
+                     b"Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n")
+
+        status = job.getStatus()
+        while True:
+            line = json.dumps(status).encode("utf-8") + b"\n"
+            writer.write(b"%x\r\n%s\r\n" % (len(line), line))
+            await writer.drain()
+            if job.isFinished():
+                break
+            status = await job.waitForChange(status)
+
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+async def readRequest(reader):
+    """
+    Reads an HTTP/1.1 request
+    :param reader: the connection's asyncio.StreamReader
+    :return: (method, path, body bytes)
+    """
+
+    requestLine = (await reader.readline()).decode("latin-1").split()
+    if len(requestLine) != 3:
+        raise ValueError("bad request line")
+    method, path, version = requestLine
+
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path, body
+
+
+async def writeResponse(writer, code, body, contentType="application/json", headers=None):
+    """
+    Sends a whole HTTP response
+    :param writer: the connection's asyncio.StreamWriter
+    :param code: the status code
+    :param body: bytes, or anything else to be sent as JSON
+    :param contentType: the body's type, for bytes
+    :param headers: extra headers
+    :return: None
+    """
+
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode("utf-8") + b"\n"
+        contentType = "application/json"
+
+    reasons = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+    lines = ["HTTP/1.1 %d %s" % (code, reasons[code]), "Content-Type: " + contentType,
+             "Content-Length: %d" % len(body), "Connection: close"]
+    lines.extend("%s: %s" % item for item in (headers or {}).items())
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+
+async def serve(host, port, numWorkers):
+    server = RenderServer(numWorkers)
+    await server.start()
+    listener = await asyncio.start_server(server.handleConnection, host, port)
+    print("serving on http://%s:%d with %d worker(s)" % (host, port, server.mNumWorkers))
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve render jobs over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on, only this machine by default")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the CPU count")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
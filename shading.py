@@ -0,0 +1,247 @@
+import math
+from math3d import Vec3, toVec3
+from objects3d import Ray
+from lightindex import LightIndex
+
+
+class SceneSnapshot(object):
+
+    __slots__ = ("mBVH", "mUnboundedObjects", "mLights", "mLightIndex", "mSceneAmbient", "mBGColor", "mMinContribution")
+
+    def __init__(self, bvh, unboundedObjects, lights, sceneAmbient, bgColor, minContribution):
+        """
+        Everything the trace and shade functions read, frozen at the start of a render so any number
+        of threads can share it. Build one with Raytracer.getSnapshot rather than by hand.
+        :param bvh: BVH over the bounded objects
+        :param unboundedObjects: the objects without bounds, tested on every ray
+        :param lights: the scene's lights
+        :param sceneAmbient: VectorN ambient light color
+        :param bgColor: tuple of floats returned for rays that hit nothing
+        :param minContribution: reflection bounces adding less than this to a channel aren't traced
+        :return: N/A
+        """
+
+        object.__setattr__(self, "mBVH", bvh)
+        object.__setattr__(self, "mUnboundedObjects", tuple(unboundedObjects))
+        object.__setattr__(self, "mLights", tuple(lights))
+        object.__setattr__(self, "mLightIndex", LightIndex(lights))
+        object.__setattr__(self, "mSceneAmbient", toVec3(sceneAmbient).copy())
+        object.__setattr__(self, "mBGColor", tuple(bgColor))
+        object.__setattr__(self, "mMinContribution", minContribution)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SceneSnapshot is immutable, take a new one with Raytracer.getSnapshot")
+
+    def matches(self, bvh, lights, sceneAmbient, bgColor, minContribution):
+        """
+        :return: True if a snapshot taken of these values now would equal this one
+        """
+
+        return self.mBVH is bvh and self.mLightIndex.matches(lights) and self.mSceneAmbient == sceneAmbient \
+               and self.mBGColor == tuple(bgColor) and self.mMinContribution == minContribution
+
+
+def castRay(scene, ray, tMax=math.inf):
+    """
+    Finds the closest hit along ray, testing the unbounded objects and then walking the BVH front to back.
+    Every test is given the best distance so far, and only the winner's hit record is built.
+    :param scene: a SceneSnapshot
+    :param ray: the Ray to cast
+    :param tMax: only hits closer than this are considered
+    :return: a new RayHitResult holding only the closest hit, or None
+    """
+
+    bestObject = None
+    bestDist = tMax
+
+    for Object in scene.mUnboundedObjects:
+        distance = Object.closestHit(ray, bestDist)
+        if distance is not None:
+            bestDist = distance
+            bestObject = Object
+
+    Object, distance = scene.mBVH.findClosestHit(ray, bestDist)
+    if Object is not None:
+        bestObject = Object
+        bestDist = distance
+
+    if bestObject is None:
+        return None
+
+    return bestObject.getHitResult(ray, bestDist)
+
+
+def castShadowRay(scene, ray, maxDist):
+    """
+    Finds any hit along ray closer than maxDist, stopping at the first one
+    :param scene: a SceneSnapshot
+    :param ray: the Ray to cast
+    :param maxDist: the distance along the ray that matters
+    :return: the RayHitResult of the first blocker found, or None
+    """
+
+    for Object in scene.mUnboundedObjects:
+        result = Object.rayHit(ray)
+        if result:
+            for distance in result.mIntersectionDistances:
+                if distance <= maxDist:
+                    return result
+
+    return scene.mBVH.findAnyHit(ray, maxDist)
+
+
+def findOccluder(scene, ray, maxDist, firstTry=None):
+    """
+    Shadow query that returns as soon as any blocker is found and never builds hit records
+    :param scene: a SceneSnapshot
+    :param ray: the shadow Ray
+    :param maxDist: distance from the ray origin to the light
+    :param firstTry: an object to test before anything else, e.g. the last blocker of the same light
+    :return: the blocking object, or None
+    """
+
+    if firstTry is not None and firstTry.occludes(ray, maxDist):
+        return firstTry
+
+    for Object in scene.mUnboundedObjects:
+        if Object.occludes(ray, maxDist):
+            return Object
+
+    return scene.mBVH.findOccluder(ray, maxDist)
+
+
+class TraceContext(object):
+
+    def __init__(self, scene):
+        """
+        The trace and shade path over one SceneSnapshot. The snapshot is only read; the little state
+        a trace keeps (the last occluder of each light) lives here, so each thread uses its own context.
+        :param scene: a SceneSnapshot
+        :return: N/A
+        """
+
+        self.mScene = scene
+        self.mLastOccluders = {}
+
+    def rayCast(self, ray, isShadow=False, light=None):
+        """
+        :param ray: the Ray to cast
+        :param isShadow: if True (with light), return the first object found between the ray origin and light
+        :param light: the Light the shadow ray is heading towards
+        :return: a RayHitResult, see castRay and castShadowRay, or None
+        """
+
+        if isShadow and light:
+            return castShadowRay(self.mScene, ray, (light.mPos - ray.mOrigin).magnitude())
+
+        return castRay(self.mScene, ray)
+
+    def isOccluded(self, ray, maxDist, light=None):
+        """
+        Shadow query, see findOccluder. Neighbouring pixels are usually shadowed by the same object,
+        so the last blocker found for light is tested before anything else.
+        :param ray: the shadow Ray
+        :param maxDist: distance from the ray origin to the light
+        :param light: the Light being tested, used to key the last-occluder cache
+        :return: True if the ray is blocked
+        """
+
+        if light is None:
+            return findOccluder(self.mScene, ray, maxDist) is not None
+
+        occluder = findOccluder(self.mScene, ray, maxDist, self.mLastOccluders.get(light))
+        if occluder is None:
+            return False
+
+        self.mLastOccluders[light] = occluder
+        return True
+
+    def getColorOfHit(self, hitData):
+        """
+        This returns the color of the result passed in, no special effects right now
+        :param hitData: a RayHitResult Object
+        :return: a Vec3 color, components nominally 0-1
+        """
+
+        material = hitData.mHitObject.mMaterial
+        point = hitData.getPoint()
+        ambient = material.mAmbient.pairwise(self.mScene.mSceneAmbient)
+
+        if self.mScene.mLights:
+            objNormal = hitData.getNormal()
+            vectorToCam = -hitData.mRay.mDirection
+
+            for light in self.mScene.mLightIndex.findLights(point):
+                # The cheap cone and range test first, so lights that can't reach the point cast no shadow ray
+                lightIntensity = light.getIntensity(point)
+                if not lightIntensity:
+                    continue
+
+                lightVector = (light.mPos - point).normalized_copy()
+
+                shadowOrigin = point + objNormal*.001
+                if self.isOccluded(Ray(shadowOrigin, lightVector, isNormalized=True),
+                                   (light.mPos - shadowOrigin).magnitude(), light):
+                    continue
+
+                lightPortion = Vec3()
+
+                # Check Diffuse light
+                diffuseStrength = lightVector.dot(objNormal)
+
+                if diffuseStrength > 0:
+                    lightPortion += diffuseStrength * (light.mDiffuse.pairwise(material.mDiffuse))
+
+                # Check Specular
+                lightVectorParallel = objNormal * diffuseStrength
+                reflectionVector = 2*lightVectorParallel - lightVector
+
+                specularStrength = reflectionVector.dot(vectorToCam)
+
+                if specularStrength > 0:
+                    lightPortion += specularStrength**material.mHardness * (light.mSpecular.pairwise(material.mSpecular))
+
+                ambient += lightPortion*lightIntensity
+
+        return ambient
+
+    def getColorOfHitRecursive(self, hitData):
+        """
+        Shades a primary hit together with what it reflects. Each surface keeps (1 - reflectivity) of
+        its own color and passes the rest on to the reflection bounce, for as long as its material's
+        reflection depth allows and the share left is at least mMinContribution. The last surface
+        shaded keeps all of its share, and a bounce that misses adds nothing.
+
+        Despite the name this is a loop, each point is shaded once. The color is left as it is,
+        clamping and tone mapping happen when the frame buffer is presented.
+        :param hitData: a RayHitResult Object, or None
+        :return: a tuple of floats
+        """
+
+        if not hitData:
+            return self.mScene.mBGColor
+
+        color = Vec3()
+        weight = 1.0
+        bounces = 0
+
+        while hitData:
+            material = hitData.mHitObject.mMaterial
+            surfaceColor = self.getColorOfHit(hitData)
+            reflectivity = material.mReflectivity
+
+            if bounces >= material.mReflectionDepth or weight*reflectivity < self.mScene.mMinContribution:
+                color += weight*surfaceColor
+                break
+
+            color += (weight*(1 - reflectivity))*surfaceColor
+            weight *= reflectivity
+            bounces += 1
+
+            objNormal = hitData.getNormal()
+            vectorToCam = -hitData.mRay.mDirection
+            reflectionVector = 2*vectorToCam.dot(objNormal)*objNormal - vectorToCam
+
+            hitData = self.rayCast(Ray(hitData.getPoint() + objNormal*.001, reflectionVector))
+
+        return color.mX, color.mY, color.mZ
@@ -0,0 +1,237 @@
+import time
+
+# TraceContext methods that RenderStats wraps while it is attached
+TIMED_METHODS = ("rayCast", "getColorOfHit", "getColorOfHitRecursive")
+
+
+class CountedObject(object):
+
+    def __init__(self, obj, stats):
+        """
+        Stands in for a scene object inside the BVH while stats are on, counting its intersection
+        tests and hits by class. Everything else is forwarded to the real object, and hit results
+        still name the real object.
+        :param obj: the wrapped scene object
+        :param stats: the RenderStats to count into
+        :return: N/A
+        """
+
+        self.mObject = obj
+        self.mStats = stats
+        self.mClassName = type(obj).__name__
+
+    def __getattr__(self, name):
+        if name == "mObject":
+            # Not set yet, e.g. while unpickling
+            raise AttributeError(name)
+        return getattr(self.mObject, name)
+
+    def rayHit(self, R):
+        result = self.mObject.rayHit(R)
+        self.mStats.countTest(self.mClassName, bool(result))
+        return result
+
+    def closestHit(self, R, tMax):
+        result = self.mObject.closestHit(R, tMax)
+        self.mStats.countTest(self.mClassName, result is not None)
+        return result
+
+    def occludes(self, R, maxDist):
+        result = self.mObject.occludes(R, maxDist)
+        self.mStats.countTest(self.mClassName, result)
+        return result
+
+    def rayHitBatch(self, origins, directions, parts=None):
+        result = self.mObject.rayHitBatch(origins, directions, parts)
+        self.mStats.countTest(self.mClassName, False, len(origins), int((result < float("inf")).sum()))
+        return result
+
+
+class RenderStats(object):
+
+    def __init__(self):
+        """
+        Opt-in render statistics for a Raytracer, see Raytracer.enableStats.
+
+        Counts primary, shadow and reflection rays, intersection tests and hits per primitive class,
+        and the inclusive time spent in rayCast, getColorOfHit and getColorOfHitRecursive (only the
+        outermost call of a recursion is timed). Counters accumulate until finishFrame, which files
+        them away as one frame's summary and starts over.
+        :return: N/A
+        """
+
+        self.mFrames = []
+        self.reset()
+
+    def reset(self):
+        """
+        Zeroes the current frame's counters
+        :return: None
+        """
+
+        self.mPrimaryRays = 0
+        self.mShadowRays = 0
+        self.mReflectionRays = 0
+        self.mTests = {}          # Intersection tests by primitive class name
+        self.mHits = {}           # Intersection hits by primitive class name
+        self.mSeconds = dict.fromkeys(TIMED_METHODS, 0.0)
+        self.mCalls = dict.fromkeys(TIMED_METHODS, 0)
+        self.mPrimarySeconds = 0.0
+        self.mShadowSeconds = 0.0
+        self.mReflectionSeconds = 0.0
+        self.mFrameStart = time.perf_counter()
+
+    def countTest(self, className, hit, tests=1, hits=None):
+        """
+        Records intersection tests against one primitive class
+        :param className: name of the primitive's class
+        :param hit: whether the (single) test hit
+        :param tests: number of tests, for batch calls
+        :param hits: number of hits, for batch calls (overrides hit)
+        :return: None
+        """
+
+        self.mTests[className] = self.mTests.get(className, 0) + tests
+        if hits is None:
+            hits = 1 if hit else 0
+        self.mHits[className] = self.mHits.get(className, 0) + hits
+
+    def attach(self, context):
+        """
+        Wraps the context's trace methods on the instance, so nothing is paid once they are removed again
+        :param context: the TraceContext to instrument
+        :return: None
+        """
+
+        stats = self
+        shadingDepth = [0]
+        perfCounter = time.perf_counter
+
+        rayCast = context.rayCast
+        isOccluded = context.isOccluded
+        getColorOfHit = context.getColorOfHit
+        getColorOfHitRecursive = context.getColorOfHitRecursive
+
+        def timedRayCast(ray, isShadow=False, light=None):
+            start = perfCounter()
+            result = rayCast(ray, isShadow, light)
+            seconds = perfCounter() - start
+
+            stats.mSeconds["rayCast"] += seconds
+            stats.mCalls["rayCast"] += 1
+            if isShadow and light:
+                stats.mShadowRays += 1
+                stats.mShadowSeconds += seconds
+            elif shadingDepth[0]:
+                stats.mReflectionRays += 1
+                stats.mReflectionSeconds += seconds
+            else:
+                stats.mPrimaryRays += 1
+                stats.mPrimarySeconds += seconds
+            return result
+
+        def timedIsOccluded(ray, maxDist, light=None):
+            start = perfCounter()
+            result = isOccluded(ray, maxDist, light)
+            stats.mShadowSeconds += perfCounter() - start
+            stats.mShadowRays += 1
+            return result
+
+        def timedGetColorOfHit(hitData):
+            start = perfCounter()
+            result = getColorOfHit(hitData)
+            stats.mSeconds["getColorOfHit"] += perfCounter() - start
+            stats.mCalls["getColorOfHit"] += 1
+            return result
+
+        def timedGetColorOfHitRecursive(*args, **kwargs):
+            shadingDepth[0] += 1
+            start = perfCounter()
+            try:
+                return getColorOfHitRecursive(*args, **kwargs)
+            finally:
+                shadingDepth[0] -= 1
+                stats.mCalls["getColorOfHitRecursive"] += 1
+                if not shadingDepth[0]:
+                    stats.mSeconds["getColorOfHitRecursive"] += perfCounter() - start
+
+        context.rayCast = timedRayCast
+        context.isOccluded = timedIsOccluded
+        context.getColorOfHit = timedGetColorOfHit
+        context.getColorOfHitRecursive = timedGetColorOfHitRecursive
+
+    def detach(self, context):
+        """
+        Removes the wrappers attach installed
+        :param context: the instrumented TraceContext
+        :return: None
+        """
+
+        for name in TIMED_METHODS + ("isOccluded",):
+            context.__dict__.pop(name, None)
+
+    def merge(self, other):
+        """
+        Adds another RenderStats' current counters to this one's, e.g. one filled by a render thread
+        :param other: a RenderStats
+        :return: None
+        """
+
+        self.mPrimaryRays += other.mPrimaryRays
+        self.mShadowRays += other.mShadowRays
+        self.mReflectionRays += other.mReflectionRays
+        self.mPrimarySeconds += other.mPrimarySeconds
+        self.mShadowSeconds += other.mShadowSeconds
+        self.mReflectionSeconds += other.mReflectionSeconds
+
+        for className, tests in other.mTests.items():
+            self.countTest(className, False, tests, other.mHits.get(className, 0))
+        for name in TIMED_METHODS:
+            self.mSeconds[name] += other.mSeconds[name]
+            self.mCalls[name] += other.mCalls[name]
+
+    def finishFrame(self):
+        """
+        Files the current counters away as one frame and starts counting the next
+        :return: the frame's summary dict
+        """
+
+        frame = {"seconds": time.perf_counter() - self.mFrameStart,
+                 "primaryRays": self.mPrimaryRays,
+                 "shadowRays": self.mShadowRays,
+                 "reflectionRays": self.mReflectionRays,
+                 "primarySeconds": self.mPrimarySeconds,
+                 "shadowSeconds": self.mShadowSeconds,
+                 "reflectionSeconds": self.mReflectionSeconds,
+                 "tests": dict(self.mTests),
+                 "hits": dict(self.mHits),
+                 "methodSeconds": dict(self.mSeconds),
+                 "methodCalls": dict(self.mCalls)}
+
+        self.mFrames.append(frame)
+        self.reset()
+        return frame
+
+
+def formatFrameSummary(frame):
+    """
+    :param frame: a dict from RenderStats.finishFrame
+    :return: a multi-line, human readable summary
+    """
+
+    seconds = frame["seconds"]
+    lines = ["frame time %.3f s" % seconds]
+
+    for kind in ("primary", "shadow", "reflection"):
+        rays = frame[kind + "Rays"]
+        lines.append("  %-10s rays %9d  %10.0f rays/s" % (kind, rays, rays / seconds if seconds else 0.0))
+
+    for className in sorted(frame["tests"]):
+        tests = frame["tests"][className]
+        hits = frame["hits"].get(className, 0)
+        lines.append("  %-10s tests %9d  hits %9d (%.1f%%)" % (className, tests, hits, 100.0 * hits / tests if tests else 0.0))
+
+    for name in TIMED_METHODS:
+        lines.append("  %-22s %8.3f s over %d calls" % (name, frame["methodSeconds"][name], frame["methodCalls"][name]))
+
+    return "\n".join(lines)
@@ -0,0 +1,51 @@
+"""
+Checks the camera states the animation renderer works out ahead of time.
+
+    python -m unittest test_animation
+"""
+import math, unittest
+import pygame
+import animation, raytracer, scenes
+
+
+class TurntableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mRT = raytracer.Raytracer(pygame.Surface((40, 30)))
+        scenes.SCENES["default"](self.mRT)
+
+    def getRadius(self, state):
+        camPos = state[0]
+        return math.hypot(camPos[0], camPos[2])
+
+    def testRadiusStaysConstant(self):
+        states = animation.computeTurntableStates(self.mRT, 120)
+        radius = self.getRadius(states[0])
+
+        self.assertEqual(len(states), 120)
+        for i, state in enumerate(states):
+            self.assertAlmostEqual(self.getRadius(state), radius, delta=1e-9 * radius, msg="frame %d" % i)
+            self.assertAlmostEqual(state[0][1], states[0][0][1], msg="frame %d" % i)
+
+    def testFullTurnMeetsFirstFrame(self):
+        numFrames = 120
+        states = animation.computeTurntableStates(self.mRT, numFrames + 1, 2 * math.pi * (numFrames + 1) / numFrames)
+
+        for a, b in zip(states[numFrames][0], states[0][0]):
+            self.assertAlmostEqual(a, b, places=9)
+
+    def testCameraPutBack(self):
+        start = animation.getCameraState(self.mRT)
+        animation.computeTurntableStates(self.mRT, 12)
+        self.assertEqual(animation.getCameraState(self.mRT), start)
+
+    def testRotateAboutYAxis(self):
+        self.mRT.setCamera((30, 5, 40), (0, 0, 0), (0, 1, 0), 60.0, 1.0)
+        self.mRT.rotateAboutYAxis(math.pi / 2)
+
+        for a, b in zip(self.mRT.mCamPos, (-40, 5, 30)):
+            self.assertAlmostEqual(a, b, places=9)
+
+
+if __name__ == "__main__":
+    unittest.main()
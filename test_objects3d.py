@@ -0,0 +1,201 @@
+"""
+Checks that every primitive's batch intersection methods agree with the one ray at a time ones, and that
+meshes without any triangles to hit can still be built and traced.
+
+    python -m unittest test_objects3d
+"""
+import math, random, unittest
+import numpy as np
+from math3d import VectorN
+from objects3d import *
+from mesh import TriangleMesh, makeTorus
+
+
+def makePrimitives():
+    """
+    :return: a dict of name -> (primitive, its face planes as ((lo, hi) per axis))
+    """
+
+    material = Material(VectorN((1, 1, 1)))
+    vertices, indices = makeTorus(12, 5, 16, 8)
+    return {
+        "Sphere": (Sphere(VectorN((0, 0, 0)), 10, material), ((-10, 10), (-10, 10), (-10, 10))),
+        "Plane": (Plane(VectorN((0, 1, 0)), 0, material), ((-10, 10), (0, 0), (-10, 10))),
+        "AABB": (AABB(VectorN((0, 0, 0)), VectorN((5, 10, 5)), material), ((0, 5), (0, 10), (0, 5))),
+        "CylinderY": (CylinderY(VectorN((-17, 6, 30)), 22.0, 15.0, material), ((-32, -2), (6, 28), (15, 45))),
+        "TriangleMesh": (TriangleMesh(vertices, indices, material), ((-17, 17), (-5, 5), (-17, 17))),
+    }
+
+
+# Where two triangles of a mesh meet either one's normal is right, so there only getNormal is checked
+SHARED_EDGE_PRIMITIVES = {"TriangleMesh"}
+
+
+def makeRandomRays(rng, count, planes):
+    """
+    :param rng: a random.Random
+    :param count: number of rays
+    :param planes: the primitive's face planes
+    :return: rays from random points towards random points round the primitive
+    """
+
+    rays = []
+    for i in range(count):
+        origin = VectorN([rng.uniform(lo - 30, hi + 30) for lo, hi in planes])
+        target = VectorN([rng.uniform(lo - 5, hi + 5) for lo, hi in planes])
+        rays.append(Ray(origin, target - origin))
+    return rays
+
+
+def makeAxisRays(planes):
+    """
+    :param planes: the primitive's face planes
+    :return: rays along each axis, both ways, whose other coordinates lie on the face planes, between
+             them and outside them, so many run along a face
+    """
+
+    rays = []
+    for axis in range(3):
+        lo, hi = planes[axis]
+        others = [i for i in range(3) if i != axis]
+        coordinates = [sorted({planes[i][0] - 3, planes[i][0], (planes[i][0] + planes[i][1]) / 2, planes[i][1],
+                               planes[i][1] + 3}) for i in others]
+
+        for sign in (1.0, -1.0):
+            direction = [0.0, 0.0, 0.0]
+            direction[axis] = sign
+            for a in coordinates[0]:
+                for b in coordinates[1]:
+                    origin = [0.0, 0.0, 0.0]
+                    origin[others[0]] = a
+                    origin[others[1]] = b
+                    origin[axis] = lo - 20 if sign > 0 else hi + 20
+                    rays.append(Ray(VectorN(origin), VectorN(direction), isNormalized=True))
+
+    return rays
+
+
+def makeFacePlaneRays(rng, count, planes):
+    """
+    :param rng: a random.Random
+    :param count: number of rays
+    :param planes: the primitive's face planes
+    :return: rays in random directions from points outside the primitive lying exactly on one of its face planes
+    """
+
+    rays = []
+    for i in range(count):
+        axis = rng.randrange(3)
+        origin = [rng.choice((lo - rng.uniform(1, 20), hi + rng.uniform(1, 20))) for lo, hi in planes]
+        origin[axis] = rng.choice(planes[axis])
+        target = VectorN([rng.uniform(lo - 5, hi + 5) for lo, hi in planes])
+        rays.append(Ray(VectorN(origin), target - VectorN(origin)))
+    return rays
+
+
+class BatchIntersectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mRng = random.Random(1803)
+        self.mPrimitives = makePrimitives()
+
+    def assertBatchMatches(self, name, obj, rays):
+        """
+        Asserts rayHitBatch gives the nearest distance rayHit does for every ray, getNormalBatch the normal
+        getNormal does at every hit point, and given the ray directions the normal the hit record holds
+        """
+
+        origins = np.array([R.mOrigin.mData for R in rays], dtype=float)
+        directions = np.array([R.mDirection.mData for R in rays], dtype=float)
+        batchDist = obj.rayHitBatch(origins, directions)
+
+        hitPoints = []
+        hitDirections = []
+        hitNormals = []
+        for i, R in enumerate(rays):
+            result = obj.rayHit(R)
+            scalarDist = min(result.mIntersectionDistances) if result else math.inf
+            message = "%s ray %d from %s along %s" % (name, i, R.mOrigin.mData, R.mDirection.mData)
+
+            if math.isinf(scalarDist):
+                self.assertTrue(np.isinf(batchDist[i]), message + ": batch hit at %r, scalar missed" % batchDist[i])
+                continue
+
+            self.assertTrue(math.isclose(scalarDist, batchDist[i], rel_tol=1e-9, abs_tol=1e-9),
+                            message + ": scalar %r, batch %r" % (scalarDist, batchDist[i]))
+            hitPoints.append(R.getPoint(scalarDist))
+            hitDirections.append(R.mDirection.mData)
+            hitNormals.append(result.getNormal(result.mIntersectionDistances.index(scalarDist)).mData)
+
+        if hitPoints:
+            points = np.array([point.mData for point in hitPoints], dtype=float)
+            for point, normal in zip(hitPoints, obj.getNormalBatch(points)):
+                np.testing.assert_allclose(normal, obj.getNormal(point).mData, atol=1e-9,
+                                           err_msg="%s normal at %s" % (name, point.mData))
+
+            if name in SHARED_EDGE_PRIMITIVES:
+                return
+            normals = obj.getNormalBatch(points, np.array(hitDirections, dtype=float))
+            for point, normal, expected in zip(hitPoints, normals, hitNormals):
+                np.testing.assert_allclose(normal, expected, atol=1e-9,
+                                           err_msg="%s hit record normal at %s" % (name, point.mData))
+
+    def testRandomRays(self):
+        for name, (obj, planes) in self.mPrimitives.items():
+            self.assertBatchMatches(name, obj, makeRandomRays(self.mRng, 2000, planes))
+
+    def testAxisParallelRays(self):
+        for name, (obj, planes) in self.mPrimitives.items():
+            self.assertBatchMatches(name, obj, makeAxisRays(planes))
+
+    def testRaysFromFacePlanes(self):
+        for name, (obj, planes) in self.mPrimitives.items():
+            self.assertBatchMatches(name, obj, makeFacePlaneRays(self.mRng, 1000, planes))
+
+    def testBoxRayAlongFace(self):
+        obj = self.mPrimitives["AABB"][0]
+        dist = obj.rayHitBatch(np.array([[0.0, 5.0, -20.0]]), np.array([[0.0, 0.0, 1.0]]))
+        self.assertEqual(dist[0], 20.0)
+
+        normal = obj.getNormalBatch(np.array([[0.0, 5.0, 0.0]]), np.array([[0.0, 0.0, 1.0]]))
+        np.testing.assert_array_equal(normal[0], (0.0, 0.0, -1.0))
+
+    def testMeshRecordsTrianglesHit(self):
+        obj, planes = self.mPrimitives["TriangleMesh"]
+        rays = makeRandomRays(self.mRng, 2000, planes)
+        origins = np.array([R.mOrigin.mData for R in rays], dtype=float)
+        directions = np.array([R.mDirection.mData for R in rays], dtype=float)
+
+        parts = np.full(len(rays), -1)
+        dist = obj.rayHitBatch(origins, directions, parts)
+        hit = dist < np.inf
+        np.testing.assert_array_equal(parts >= 0, hit)
+
+        # Each ray's recorded triangle is one it hits at the distance returned
+        for i in np.flatnonzero(hit).tolist():
+            self.assertEqual(obj.hitTrianglesBatch(origins[i:i + 1], directions[i:i + 1], parts[i], 1)[0, 0], dist[i])
+
+        points = origins[hit] + dist[hit, np.newaxis] * directions[hit]
+        np.testing.assert_array_equal(obj.getNormalBatch(points, directions[hit], parts[hit]), obj.mFaceNormals[parts[hit]])
+
+
+class EmptyMeshTest(unittest.TestCase):
+
+    def assertMisses(self, obj):
+        R = Ray(VectorN((0.5, 0.25, -5)), VectorN((0, 0, 1)), isNormalized=True)
+        self.assertIsNone(obj.getBounds())
+        self.assertIsNone(obj.rayHit(R))
+        self.assertIsNone(obj.closestHit(R))
+        self.assertFalse(obj.occludes(R, 10))
+        self.assertTrue(np.isinf(obj.rayHitBatch(np.array([[0.5, 0.25, -5]]), np.array([[0.0, 0.0, 1.0]]))).all())
+
+    def testNoTriangles(self):
+        self.assertMisses(TriangleMesh(np.zeros((0, 3)), np.zeros((0, 3)), Material(VectorN((1, 1, 1)))))
+
+    def testOnlyDegenerateTriangles(self):
+        vertices = [(0, 0, 0), (1, 0, 0), (2, 0, 0), (1, 1, 0)]
+        self.assertMisses(TriangleMesh(vertices, [(0, 1, 2), (3, 3, 3), (0, 0, 1)], Material(VectorN((1, 1, 1)))))
+
+
+if __name__ == "__main__":
+    unittest.main()
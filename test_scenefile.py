@@ -0,0 +1,112 @@
+"""
+Checks that scene files load back to the same render, building objects only as rays reach them.
+
+    python -m unittest test_scenefile
+"""
+import os, pickle, tempfile, unittest
+import numpy as np
+import pygame
+import raytracer, scenefile, scenes
+from math3d import Vec3
+from mesh import TriangleMesh
+from objects3d import Material, Sphere
+
+
+class SceneFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mDirectory = tempfile.TemporaryDirectory()
+        self.mPath = os.path.join(self.mDirectory.name, "grid.scn")
+
+        self.mRT = raytracer.Raytracer(pygame.Surface((40, 30)))
+        scenes.SCENES["spheregrid"](self.mRT)
+        scenefile.saveScene(self.mRT, self.mPath)
+
+    def tearDown(self):
+        self.mDirectory.cleanup()
+
+    def render(self, RT):
+        for iy in range(RT.mPyHeight):
+            RT.renderOneLine(iy)
+        return pygame.surfarray.array3d(RT.mRenderSurface)
+
+    def load(self):
+        RT = raytracer.Raytracer(pygame.Surface((40, 30)))
+        scenefile.loadScene(RT, self.mPath)
+        return RT
+
+    def testLoadBuildsNothing(self):
+        RT = self.load()
+        self.assertEqual(len(RT.mObjects), len(self.mRT.mObjects))
+        self.assertEqual(RT.mObjects.getNumBuilt(), 0)
+
+        # The stored tree only needs the unbounded plane
+        RT.getBVH()
+        self.assertEqual(RT.mObjects.getNumBuilt(), 1)
+
+    def testRendersTheSame(self):
+        expected = self.render(self.mRT)
+        RT = self.load()
+
+        np.testing.assert_array_equal(self.render(RT), expected)
+        self.assertLess(RT.mObjects.getNumBuilt(), len(RT.mObjects))
+
+        RT.renderPackets()
+        np.testing.assert_array_equal(pygame.surfarray.array3d(RT.mRenderSurface), expected)
+
+    def testWorkersOpenTheFile(self):
+        expected = self.render(self.mRT)
+        RT = pickle.loads(pickle.dumps(self.load()))
+        RT.setRenderSurface(pygame.Surface((40, 30)))
+
+        self.assertIsInstance(RT.mObjects, scenefile.SceneObjectList)
+        self.assertEqual(RT.mObjects.getNumBuilt(), 0)
+        np.testing.assert_array_equal(self.render(RT), expected)
+
+    def testChangedObjectsArePickled(self):
+        RT = self.load()
+        RT.mObjects.append(Sphere(Vec3(0, 40, 0), 3, Material(Vec3(1, 1, 1))))
+        self.assertEqual(RT.mObjects.getNumBuilt(), 1)
+
+        copy = pickle.loads(pickle.dumps(RT))
+        self.assertIs(type(copy.mObjects), raytracer.ObjectList)
+        self.assertEqual(len(copy.mObjects), len(self.mRT.mObjects) + 1)
+        self.assertNotIn(None, list(copy.mObjects))
+
+    def testReflectionArraysFromFile(self):
+        RT = self.load()
+        reflectivity, reflectionDepth = RT.getReflectionArrays()
+        self.assertEqual(RT.mObjects.getNumBuilt(), 0)
+
+        RT.mObjects.buildAll()
+        np.testing.assert_array_equal(reflectivity, [obj.mMaterial.mReflectivity for obj in RT.mObjects])
+        np.testing.assert_array_equal(reflectionDepth, [obj.mMaterial.mReflectionDepth for obj in RT.mObjects])
+
+    def testFileWithoutTree(self):
+        scene = scenefile.SceneFile(self.mPath)
+        arrays = {name: np.array(array) for name, array in scene.mArrays.items() if not name.startswith("bvh")}
+        del scene
+        scenefile.writeSceneFile(self.mPath, arrays)
+
+        RT = self.load()
+        np.testing.assert_array_equal(self.render(RT), self.render(self.mRT))
+
+    def testMeshRoundTrip(self):
+        RT = raytracer.Raytracer(pygame.Surface((40, 30)))
+        scenes.buildMeshScene(RT, rings=12, sides=8)
+        scenes.buildMeshScene(RT, rings=6, sides=4)
+        scenefile.saveScene(RT, self.mPath)
+
+        loaded = self.load()
+        loaded.mObjects.buildAll()
+        meshes = [obj for obj in loaded.mObjects if isinstance(obj, TriangleMesh)]
+        self.assertEqual(len(meshes), 2)
+        for mesh, expected in zip(meshes, RT.mObjects[1::2]):
+            np.testing.assert_array_equal(mesh.mVertices, expected.mVertices)
+            np.testing.assert_array_equal(mesh.mIndices, expected.mIndices)
+
+        np.testing.assert_array_equal(self.render(self.load()), self.render(RT))
+
+
+if __name__ == "__main__":
+    unittest.main()
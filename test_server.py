@@ -0,0 +1,78 @@
+"""
+Checks the render server's job bookkeeping and error answers, without starting its worker pool.
+
+    python -m unittest test_server
+"""
+import asyncio, contextlib, io, json, unittest
+import server
+
+
+class FakeWriter(object):
+
+    def __init__(self):
+        self.mData = b""
+
+    def write(self, data):
+        self.mData += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class RenderServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mServer = server.RenderServer(1, finishedJobs=2)
+
+    def request(self, method, path, body=b""):
+        """
+        :return: (status code, decoded JSON body) of the server's answer
+        """
+
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b"%s %s HTTP/1.1\r\nContent-Length: %d\r\n\r\n%s" % (method, path, len(body), body))
+            reader.feed_eof()
+            writer = FakeWriter()
+            await self.mServer.handleConnection(reader, writer)
+            return writer.mData
+
+        head, _, body = asyncio.run(run()).partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(body)
+
+    def submitCached(self, width):
+        """
+        Submits a job whose image is already cached, so it finishes without rendering
+        :return: the job's id
+        """
+
+        request = {"scene": "default", "width": width}
+        self.mServer.mCache[server.RenderJob(0, server.parseJob(request)).mKey] = b"image"
+        code, status = self.request(b"POST", b"/jobs", json.dumps(request).encode("utf-8"))
+        self.assertEqual((code, status["state"]), (202, "done"))
+        return status["job"]
+
+    def testFinishedJobsDropped(self):
+        jobIds = [self.submitCached(width) for width in (10, 20, 30)]
+
+        self.assertEqual(sorted(self.mServer.mJobs), jobIds[1:])
+        self.assertEqual(self.request(b"GET", b"/jobs/%d" % jobIds[0])[0], 404)
+        self.assertEqual(self.request(b"GET", b"/jobs/%d/image" % jobIds[0])[0], 404)
+        self.assertEqual(self.request(b"GET", b"/jobs/%d" % jobIds[2]), (200, self.mServer.mJobs[jobIds[2]].getStatus()))
+
+    def testUnexpectedErrorAnswered(self):
+        async def route(writer, method, path, body):
+            raise KeyError("broken")
+
+        self.mServer.route = route
+        with contextlib.redirect_stderr(io.StringIO()):
+            code, body = self.request(b"GET", b"/jobs/1")
+        self.assertEqual(code, 500)
+        self.assertEqual(body["error"], "KeyError: 'broken'")
+
+
+if __name__ == "__main__":
+    unittest.main()